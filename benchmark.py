@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+
+
+"""
+
+性能测试
+
+Benchmarks of the inference/training modes. The options not recognized by the benchmark are forwarded to the
+chatbot (ex: --modelTag, --rootDir). Each benchmark print a small table on the console.
+
+Use python 3
+"""
+
+import argparse
+import copy
+import math
+import multiprocessing.pool
+import os
+import random
+import resource
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from chatbot import chatbot
+from chatbot import execution
+from chatbot.model import Model
+from chatbot import npmodel
+from chatbot.replicapool import ReplicaPool
+from chatbot.textdata import TextData
+
+
+def loadSamples(rootDir):
+    """ Load the test sentences (data/test/samples.txt)
+    Args:
+        rootDir (str): root of the project
+    Return:
+        list<str>: the questions
+    """
+    with open(os.path.join(rootDir or os.getcwd(), 'data', 'test', 'samples.txt'), 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def timeAnswers(predictFct, questions):
+    """ Answer all the questions, timing each of them
+    Args:
+        predictFct (function): the function which answer a question
+        questions (list<str>): the sentences to answer
+    Return:
+        list<float>, list<Obj>: the latencies (in ms) and the answers
+    """
+    latencies = []
+    answers = []
+    for question in questions:
+        tic = time.perf_counter()
+        answers.append(predictFct(question))
+        latencies.append((time.perf_counter() - tic) * 1000)
+    return latencies, answers
+
+
+def printLatencies(name, latencies):
+    """ Print one row of latency statistics
+    """
+    print('{:<20} median {:8.2f}ms | mean {:8.2f}ms | p90 {:8.2f}ms'.format(
+        name,
+        np.median(latencies),
+        np.mean(latencies),
+        np.percentile(latencies, 90)
+    ))
+
+
+def startDaemon(chatbotArgs):
+    """ Launch a chatbot in daemon mode
+    Args:
+        chatbotArgs (list<str>): the options forwarded to the chatbot
+    Return:
+        Chatbot: the loaded bot
+    """
+    bot = chatbot.Chatbot()
+    bot.main(['--test', chatbot.Chatbot.TestMode.DAEMON] + chatbotArgs)
+    return bot
+
+
+def benchmarkBeam(args, chatbotArgs):
+    """ Latency of the beam search for each beam width
+    """
+    bot = startDaemon(chatbotArgs)
+    questions = loadSamples(bot.args.rootDir)
+    for beamSize in args.beamSizes:
+        bot.args.beamSize = beamSize
+        latencies, _ = timeAnswers(bot.daemonPredict, questions)
+        printLatencies('beamSize={}'.format(beamSize), latencies)
+    bot.daemonClose()
+
+
+def benchmarkEarlyExit(args, chatbotArgs):
+    """ Latency of the unrolled decoding compared to the step by step decoding with early exit
+    """
+    bot = startDaemon(chatbotArgs)
+    questions = loadSamples(bot.args.rootDir)
+
+    bot.args.earlyExit = False
+    latenciesUnrolled, answersUnrolled = timeAnswers(bot.daemonPredict, questions)
+    bot.args.earlyExit = True
+    latenciesEarlyExit, answersEarlyExit = timeAnswers(bot.daemonPredict, questions)
+
+    printLatencies('unrolled', latenciesUnrolled)
+    printLatencies('earlyExit', latenciesEarlyExit)
+    print('Median speedup: x{:.2f}, identical answers: {}/{}'.format(
+        np.median(latenciesUnrolled) / np.median(latenciesEarlyExit),
+        sum(a == b for a, b in zip(answersUnrolled, answersEarlyExit)),
+        len(questions)
+    ))
+    bot.daemonClose()
+
+
+def benchmarkShortlist(args, chatbotArgs):
+    """ Latency and answer agreement of the decoder shortlist compared to the full vocabulary projection
+    """
+    bot = startDaemon(chatbotArgs)
+    questions = loadSamples(bot.args.rootDir)
+
+    bot.args.earlyExit = True  # Same decoding loop for all the runs
+    references = None
+    for shortlistSize in [0] + args.shortlistSizes:
+        bot.args.shortlistSize = shortlistSize
+        latencies, answers = timeAnswers(bot.daemonPredict, questions)
+        if references is None:
+            references = answers
+        printLatencies('shortlistSize={}'.format(shortlistSize or 'full'), latencies)
+        print('{:<20} agreement {}/{}'.format('', sum(a == b for a, b in zip(references, answers)), len(questions)))
+    bot.daemonClose()
+
+
+def benchmarkQuantization(args, chatbotArgs):
+    """ Memory, latency and answer agreement of the quantized NumPy model compared to the float32 one
+    """
+    bot = npmodel.NumpyChatbot(args.modelDir)
+    questions = loadSamples(bot.args.rootDir)
+    weights = bot.model.weights
+    if any(value.dtype != np.float32 for value in weights.values()):
+        raise ValueError('The benchmark should be run on a model exported without quantization')
+
+    references = None
+    for quantization in npmodel.QUANTIZATION_CHOICES:
+        quantizedWeights = npmodel.quantizeWeights(weights, quantization)
+        configurations = [(quantization, quantizedWeights)]
+        if quantization != 'none':  # Kept quantized in memory (memory-mapped replicas) or converted when loaded
+            configurations.append((quantization + ' (loaded)', npmodel.dequantizeWeights(quantizedWeights)))
+        for name, modelWeights in configurations:
+            bot.model = npmodel.NumpyModel(modelWeights, bot.args.numLayers)
+            latencies, answers = timeAnswers(bot.daemonPredict, questions)
+            if references is None:
+                references = answers
+            printLatencies(name, latencies)
+            print('{:<20} memory {:8.2f}MB | file {:8.2f}MB | agreement {}/{}'.format(
+                '',
+                npmodel.weightsSize(modelWeights) / 2**20,
+                npmodel.weightsSize(quantizedWeights) / 2**20,
+                sum(a == b for a, b in zip(references, answers)),
+                len(questions)
+            ))
+
+
+def benchmarkReplicas(args, chatbotArgs):
+    """ Throughput of the replica pool for an increasing number of processes
+    """
+    questions = loadSamples(npmodel.NumpyChatbot.loadArgs(args.modelDir).rootDir) * args.repeat
+    for nbReplicas in args.replicas:
+        pool = ReplicaPool(args.modelDir, nbReplicas)
+        pool.daemonPredict(questions[0])  # Warm up
+        with multiprocessing.pool.ThreadPool(nbReplicas) as clients:  # One concurrent client per replica
+            tic = time.perf_counter()
+            clients.map(pool.daemonPredict, questions)
+            duration = time.perf_counter() - tic
+        print('{:<20} {:8.2f} requests/sec'.format('replicas={}'.format(nbReplicas), len(questions) / duration))
+        pool.daemonClose()
+
+
+def benchmarkStartup(args, chatbotArgs):
+    """ Cold start of the daemon, and loading time of the full dataset compared to the vocabulary saved with the model
+    """
+    tic = time.perf_counter()
+    bot = startDaemon(chatbotArgs)
+    daemonTime = time.perf_counter() - tic
+    bot.daemonClose()
+
+    tic = time.perf_counter()
+    TextData(bot.args)
+    datasetTime = time.perf_counter() - tic
+
+    tic = time.perf_counter()
+    TextData(bot.args, vocabularyFile=os.path.join(bot.modelDir, npmodel.VOCABULARY_FILENAME))
+    vocabularyTime = time.perf_counter() - tic
+
+    print('{:<20} {:8.2f}s'.format('daemon', daemonTime))
+    print('{:<20} {:8.2f}s'.format('full dataset', datasetTime))
+    print('{:<20} {:8.2f}s'.format('vocabulary only', vocabularyTime))
+
+
+def benchmarkFrozen(args, chatbotArgs):
+    """ Startup time, latency and answer agreement of the frozen graph compared to the restored checkpoint
+    """
+    references = None
+    for name, options in [('checkpoint', []), ('frozen', ['--frozen'])]:
+        tic = time.perf_counter()
+        bot = startDaemon(chatbotArgs + options)
+        startupTime = time.perf_counter() - tic
+        questions = loadSamples(bot.args.rootDir)
+        latencies, answers = timeAnswers(bot.daemonPredict, questions)
+        if references is None:
+            references = answers
+        printLatencies(name, latencies)
+        print('{:<20} startup {:8.2f}s | agreement {}/{}'.format(
+            '',
+            startupTime,
+            sum(a == b for a, b in zip(references, answers)),
+            len(questions)
+        ))
+        bot.daemonClose()
+
+
+def benchmarkPipeline(args, chatbotArgs):
+    """ Training steps/sec with the placeholders feed_dict compared to the tf.data input pipeline
+    The model is trained from scratch for a few steps (nothing is saved). The creation of the python batches of the
+    feed_dict mode is included, amortized over the epoch.
+    """
+    for inputPipeline in [False, True]:
+        bot = chatbot.Chatbot()
+        bot.args = bot.parseArgs(chatbotArgs + (['--inputPipeline'] if inputPipeline else []))
+        bot.args.rootDir = bot.args.rootDir or os.getcwd()
+        bot.loadModelParams()
+        bot.textData = TextData(bot.args)
+
+        with bot.graph.as_default():
+            bot.model = Model(bot.args, bot.textData)
+            sess = tf.Session()
+            sess.run(tf.global_variables_initializer())
+
+            epochSeed = random.getrandbits(32)  # As the training (same order for the resumed epochs)
+            tic = time.perf_counter()
+            if inputPipeline:
+                ops, feedDict = bot.model.initInputPipeline(bot.textData.getSampleArrays(), bot.textData.getEpochOrder(epochSeed))
+                sess.run(ops, feedDict)
+                batches = [None] * args.steps
+            else:
+                batches = bot.textData.getBatches(epochSeed)
+                batches = batches[:args.steps]
+            setupTime = time.perf_counter() - tic
+            if not inputPipeline:  # Only the batches used are counted
+                setupTime *= len(batches) / max(math.ceil(bot.textData.getSampleSize() / bot.args.batchSize), 1)
+
+            tic = time.perf_counter()
+            for batch in batches:
+                ops, feedDict = bot.model.step(batch)
+                sess.run(ops, feedDict)
+            duration = time.perf_counter() - tic + setupTime
+            sess.close()
+
+        print('{:<20} {:8.2f} steps/sec'.format('inputPipeline' if inputPipeline else 'feed_dict', len(batches) / duration))
+
+
+def benchmarkDistributed(args, chatbotArgs):
+    """ Training samples/sec of the data-parallel training for an increasing number of worker processes
+    Each configuration trains one epoch from scratch in a temporary model directory. The startup of the processes and
+    the loading of the dataset are included in the time.
+    """
+    bot = chatbot.Chatbot()
+    bot.args = bot.parseArgs(chatbotArgs)
+    bot.args.rootDir = bot.args.rootDir or os.getcwd()
+    bot.loadModelParams()
+    nbSamples = TextData(bot.args).getSampleSize()
+
+    reference = None
+    for nbWorkers in args.workers:
+        options = [
+            '--numWorkers', str(nbWorkers),
+            '--numPs', str(args.numPs),
+            '--numEpochs', '1',
+            '--modelTag', 'benchmark-distributed',
+            '--reset',
+        ]
+        if args.syncReplicas:
+            options.append('--syncReplicas')
+        tic = time.perf_counter()
+        chatbot.Chatbot().main(chatbotArgs + options)
+        samplesPerSec = nbSamples / (time.perf_counter() - tic)
+        if reference is None:
+            reference = samplesPerSec
+        print('{:<20} {:8.2f} samples/sec | speedup x{:.2f}'.format('workers={}'.format(nbWorkers), samplesPerSec, samplesPerSec / reference))
+
+
+def _timeThreads(args, textData, batches, inferenceBatches, threads, warmup):
+    """ Steps/sec of the training and the inference with the given thread counts (run in a new process: the thread
+    pools are created once per process, by the first session)
+    """
+    config = execution.getSessionConfig(*threads)
+    stepsPerSec = []
+    for test, stepBatches in [(None, batches), (chatbot.Chatbot.TestMode.DAEMON, inferenceBatches)]:
+        modelArgs = copy.copy(args)
+        modelArgs.test = test
+        with tf.Graph().as_default():
+            model = Model(modelArgs, textData)
+            steps = [model.step(batch) for batch in stepBatches]
+            with tf.Session(config=config) as sess:
+                sess.run(tf.global_variables_initializer())  # Random weights, only the time matters
+                for ops, feedDict in steps[:warmup]:
+                    sess.run(ops, feedDict)
+                tic = time.perf_counter()
+                for ops, feedDict in steps:
+                    sess.run(ops, feedDict)
+                stepsPerSec.append(len(steps) / (time.perf_counter() - tic))
+    return stepsPerSec
+
+
+def benchmarkAutotune(args, chatbotArgs):
+    """ Find the fastest thread counts of the host for the training and the inference
+    Each configuration runs the same training steps and predictions in a new process. The best ones are recorded in
+    the params.ini of the model (used when --intraOpThreads/--interOpThreads are not set).
+    """
+    bot = chatbot.Chatbot()
+    bot.args = bot.parseArgs(chatbotArgs)
+    bot.args.rootDir = bot.args.rootDir or os.getcwd()
+    bot.loadModelParams()
+    if bot.args.cpuAffinity:  # Inherited by the processes of the candidates
+        execution.setCpuAffinity(bot.args.cpuAffinity)
+
+    textData = TextData(bot.args)
+    batches = textData.getBatches()[:args.steps]
+    inferenceBatches = [textData.sentence2enco(question) for question in loadSamples(bot.args.rootDir)]
+    inferenceBatches = [batch for batch in inferenceBatches if batch]
+    inferenceBatches = (inferenceBatches * math.ceil(args.steps / len(inferenceBatches)))[:args.steps]
+    textData.trainingSamples = []  # Only the vocabulary is sent to the processes
+    textData.validationSamples = []
+
+    nbCpus = execution.getCpuCount()
+    intraCandidates = sorted({nbCpus} | {2**i for i in range(nbCpus.bit_length())})
+    candidates = [(0, 0)] + [(intra, inter) for intra in intraCandidates for inter in args.interOpThreads]
+    print('{} usable cores, {} configurations'.format(nbCpus, len(candidates)))
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    for threads in candidates:
+        with context.Pool(1) as pool:
+            results[threads] = pool.apply(_timeThreads, (bot.args, textData, batches, inferenceBatches, threads, args.warmup))
+        print('{:<20} training {:8.2f} steps/sec | inference {:8.2f} steps/sec'.format(
+            'intra={} inter={}'.format(*threads) if any(threads) else 'default',
+            *results[threads]
+        ))
+
+    bestTraining = max(candidates, key=lambda threads: results[threads][0])
+    bestInference = max(candidates, key=lambda threads: results[threads][1])
+    print('Best training: --intraOpThreads {} --interOpThreads {}'.format(*bestTraining))
+    print('Best inference: --intraOpThreads {} --interOpThreads {}'.format(*bestInference))
+    configName = os.path.join(bot.modelDir, bot.CONFIG_FILENAME)
+    if os.path.isfile(configName):
+        execution.saveTunedThreads(configName, bestTraining, bestInference)
+        print('Recorded in {}'.format(configName))
+
+
+def _trainSteps(args, textData, batches, warmup):
+    """ Samples/sec and peak memory of the training (run in a new process, the peak memory of a process never
+    decreases)
+    """
+    with tf.Graph().as_default():
+        model = Model(args, textData)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            if model.accumulatorsInit is not None:
+                sess.run(model.accumulatorsInit)
+
+            def run(step, batch):
+                ops, feedDict = model.step(batch)
+                if (step + 1) % args.accumulateSteps:
+                    ops = (model.accumulateOp,) + ops[1:]
+                sess.run(ops, feedDict)
+
+            for step, batch in enumerate(batches[:warmup * args.accumulateSteps]):
+                run(step, batch)
+            tic = time.perf_counter()
+            for step, batch in enumerate(batches):
+                run(step, batch)
+            duration = time.perf_counter() - tic
+    nbSamples = sum(len(batch.encoderSeqs[0]) for batch in batches)
+    return nbSamples / duration, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # Linux: in KB
+
+
+def benchmarkAccumulation(args, chatbotArgs):
+    """ Peak memory and samples/sec of the gradient accumulation compared to a single batch of the same size
+    Each configuration trains from scratch in a new process, on the same samples
+    """
+    bot = chatbot.Chatbot()
+    bot.args = bot.parseArgs(chatbotArgs)
+    bot.args.rootDir = bot.args.rootDir or os.getcwd()
+    bot.loadModelParams()
+    textData = TextData(bot.args)
+    vocabulary = copy.copy(textData)  # Only the vocabulary is sent to the processes
+    vocabulary.trainingSamples = []
+    vocabulary.validationSamples = []
+    batchSize = bot.args.batchSize
+
+    context = multiprocessing.get_context('spawn')
+    for accumulateSteps in args.accumulateSteps:
+        runArgs = copy.copy(bot.args)
+        runArgs.batchSize = batchSize * max(args.accumulateSteps) // accumulateSteps  # Same effective batch size
+        runArgs.accumulateSteps = accumulateSteps
+        textData.args = runArgs
+        random.seed(0)  # Same samples for all the configurations
+        batches = textData.getBatches()[:args.updates * accumulateSteps]
+        with context.Pool(1) as pool:
+            samplesPerSec, peakMemory = pool.apply(_trainSteps, (runArgs, vocabulary, batches, args.warmup))
+        print('{:<30} {:8.2f} samples/sec | peak memory {:8.2f}MB'.format(
+            'batchSize={} accumulate={}'.format(runArgs.batchSize, accumulateSteps),
+            samplesPerSec,
+            peakMemory
+        ))
+
+
+def benchmarkSoftmax(args, chatbotArgs):
+    """ Step time of the training and of the decoding with the full softmax compared to the adaptive softmax
+    The models are built from scratch with random weights (only the time matters)
+    """
+    bot = chatbot.Chatbot()
+    bot.args = bot.parseArgs(chatbotArgs)
+    bot.args.rootDir = bot.args.rootDir or os.getcwd()
+    bot.loadModelParams()
+    textData = TextData(bot.args)
+    batches = textData.getBatches()[:args.steps]
+    print('Vocabulary: {} words'.format(textData.getVocabularySize()))
+
+    for name, cutoffs in [('full', []), ('adaptive', args.cutoffs)]:
+        modelArgs = copy.copy(bot.args)
+        modelArgs.adaptiveSoftmax = cutoffs
+        modelArgs.softmaxSamples = 0
+
+        modelArgs.test = None
+        with tf.Graph().as_default():
+            model = Model(modelArgs, textData)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                steps = [model.step(batch) for batch in batches]
+                sess.run(*steps[0])  # Warm up
+                tic = time.perf_counter()
+                for ops, feedDict in steps:
+                    sess.run(ops, feedDict)
+                trainingTime = (time.perf_counter() - tic) / len(steps) * 1000
+
+        modelArgs.test = chatbot.Chatbot.TestMode.DAEMON
+        decodingTimes = []
+        with tf.Graph().as_default():
+            model = Model(modelArgs, textData)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                for nbHypothesis in [1, args.beamSize]:  # Greedy and beam search steps
+                    state = tf.contrib.framework.nest.map_structure(
+                        lambda placeholder: np.zeros((nbHypothesis, placeholder.shape[1]), dtype=np.float32),
+                        model.stepStateIn
+                    )
+                    inputs = [textData.goToken] * nbHypothesis
+                    ops, feedDict = model.stepDecoder(inputs, state, nbHypothesis)
+                    sess.run(ops, feedDict)  # Warm up
+                    tic = time.perf_counter()
+                    for _ in range(args.steps):
+                        sess.run(ops, feedDict)
+                    decodingTimes.append((time.perf_counter() - tic) / args.steps * 1000)
+
+        print('{:<20} training {:8.2f}ms/step | greedy {:8.2f}ms/step | beam={} {:8.2f}ms/step'.format(
+            name, trainingTime, decodingTimes[0], args.beamSize, decodingTimes[1]
+        ))
+
+
+def benchmarkProjection(args, chatbotArgs):
+    """ Samples/sec and peak memory of the training with and without the projection of the LSTM outputs
+    Each configuration trains from scratch in a new process, on the same samples
+    """
+    bot = chatbot.Chatbot()
+    bot.args = bot.parseArgs(chatbotArgs)
+    bot.args.rootDir = bot.args.rootDir or os.getcwd()
+    bot.loadModelParams()
+    textData = TextData(bot.args)
+    vocabulary = copy.copy(textData)  # Only the vocabulary is sent to the processes
+    vocabulary.trainingSamples = []
+    vocabulary.validationSamples = []
+    random.seed(0)
+    batches = textData.getBatches()[:args.steps]
+
+    context = multiprocessing.get_context('spawn')
+    for size in args.sizes:
+        try:
+            hiddenSize, numProj = (int(value) for value in size.split(':'))
+        except ValueError:
+            raise ValueError('Wrong size: {} (should be hiddenSize:numProj)'.format(size))
+        runArgs = copy.copy(bot.args)
+        runArgs.hiddenSize = hiddenSize
+        runArgs.numProj = numProj
+        runArgs.accumulateSteps = 1
+        with context.Pool(1) as pool:
+            samplesPerSec, peakMemory = pool.apply(_trainSteps, (runArgs, vocabulary, batches, args.warmup))
+        print('{:<30} {:8.2f} samples/sec | peak memory {:8.2f}MB'.format(
+            'hiddenSize={} numProj={}'.format(hiddenSize, numProj),
+            samplesPerSec,
+            peakMemory
+        ))
+
+
+def _decodeSteps(args, textData, nbSteps):
+    """ Time and peak memory of the greedy decoding steps (run in a new process)
+    """
+    with tf.Graph().as_default():
+        model = Model(args, textData)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            state = tf.contrib.framework.nest.map_structure(
+                lambda placeholder: np.zeros((1, placeholder.shape[1]), dtype=np.float32),
+                model.stepStateIn
+            )
+            ops, feedDict = model.stepDecoder([textData.goToken], state)
+            sess.run(ops, feedDict)  # Warm up
+            tic = time.perf_counter()
+            for _ in range(nbSteps):
+                sess.run(ops, feedDict)
+            duration = time.perf_counter() - tic
+    return duration / nbSteps * 1000, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10  # Linux: in KB
+
+
+def benchmarkCells(args, chatbotArgs):
+    """ Training and decoding step time and peak memory of each recurrent cell type
+    Each measure is done from scratch in a new process, on the same samples
+    """
+    bot = chatbot.Chatbot()
+    bot.args = bot.parseArgs(chatbotArgs)
+    bot.args.rootDir = bot.args.rootDir or os.getcwd()
+    bot.loadModelParams()
+    textData = TextData(bot.args)
+    vocabulary = copy.copy(textData)  # Only the vocabulary is sent to the processes
+    vocabulary.trainingSamples = []
+    vocabulary.validationSamples = []
+    random.seed(0)
+    batches = textData.getBatches()[:args.steps]
+
+    context = multiprocessing.get_context('spawn')
+    for cellType in args.cellTypes:
+        runArgs = copy.copy(bot.args)
+        runArgs.cellType = cellType
+        runArgs.numProj = 0
+        runArgs.accumulateSteps = 1
+        runArgs.test = None
+        with context.Pool(1) as pool:
+            samplesPerSec, trainingMemory = pool.apply(_trainSteps, (runArgs, vocabulary, batches, args.warmup))
+        trainingTime = sum(len(batch.encoderSeqs[0]) for batch in batches) / samplesPerSec / len(batches) * 1000
+
+        runArgs = copy.copy(runArgs)
+        runArgs.test = chatbot.Chatbot.TestMode.DAEMON
+        with context.Pool(1) as pool:
+            decodingTime, decodingMemory = pool.apply(_decodeSteps, (runArgs, vocabulary, args.steps))
+        print('{:<10} training {:8.2f}ms/step, peak memory {:8.2f}MB | decoding {:8.2f}ms/step, peak memory {:8.2f}MB'.format(
+            cellType, trainingTime, trainingMemory, decodingTime, decodingMemory
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the chatbot, other options are forwarded to the chatbot')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    subparsers.required = True
+
+    beamArgs = subparsers.add_parser('beam', help='latency of the beam search decoder')
+    beamArgs.add_argument('--beamSizes', type=int, nargs='+', default=[1, 2, 4, 8], help='beam widths to compare')
+    beamArgs.set_defaults(fct=benchmarkBeam)
+
+    earlyExitArgs = subparsers.add_parser('earlyexit', help='latency of the early exit decoding')
+    earlyExitArgs.set_defaults(fct=benchmarkEarlyExit)
+
+    shortlistArgs = subparsers.add_parser('shortlist', help='latency/agreement of the decoder shortlist')
+    shortlistArgs.add_argument('--shortlistSizes', type=int, nargs='+', default=[1000, 2000, 5000], help='shortlist sizes to compare with the full vocabulary')
+    shortlistArgs.set_defaults(fct=benchmarkShortlist)
+
+    quantizationArgs = subparsers.add_parser('quantization', help='memory/latency/agreement of the quantized NumPy model')
+    quantizationArgs.add_argument('--modelDir', type=str, default=os.path.join('save', 'model-server'), help='directory of the model exported with --exportNumpy')
+    quantizationArgs.set_defaults(fct=benchmarkQuantization)
+
+    replicasArgs = subparsers.add_parser('replicas', help='throughput of the multi-process NumPy replica pool')
+    replicasArgs.add_argument('--modelDir', type=str, default=os.path.join('save', 'model-server'), help='directory of the model exported with --exportNumpy')
+    replicasArgs.add_argument('--replicas', type=int, nargs='+', default=[1, 2, 4, multiprocessing.cpu_count()], help='number of processes to compare')
+    replicasArgs.add_argument('--repeat', type=int, default=20, help='number of times the test sentences are asked')
+    replicasArgs.set_defaults(fct=benchmarkReplicas)
+
+    startupArgs = subparsers.add_parser('startup', help='cold start time of the daemon')
+    startupArgs.set_defaults(fct=benchmarkStartup)
+
+    frozenArgs = subparsers.add_parser('frozen', help='startup/latency of the frozen inference graph (export it first with --exportFrozen)')
+    frozenArgs.set_defaults(fct=benchmarkFrozen)
+
+    pipelineArgs = subparsers.add_parser('pipeline', help='training steps/sec of the feed_dict and the tf.data input pipeline')
+    pipelineArgs.add_argument('--steps', type=int, default=100, help='number of training steps timed')
+    pipelineArgs.set_defaults(fct=benchmarkPipeline)
+
+    distributedArgs = subparsers.add_parser('distributed', help='training samples/sec of the data-parallel training')
+    distributedArgs.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='number of worker processes to compare')
+    distributedArgs.add_argument('--numPs', type=int, default=1, help='number of parameter server processes')
+    distributedArgs.add_argument('--syncReplicas', action='store_true', help='aggregate the gradients of the workers at each step')
+    distributedArgs.set_defaults(fct=benchmarkDistributed)
+
+    autotuneArgs = subparsers.add_parser('autotune', help='fastest thread counts of the host, recorded in the params.ini of the model')
+    autotuneArgs.add_argument('--steps', type=int, default=200, help='number of training and inference steps timed for each configuration')
+    autotuneArgs.add_argument('--warmup', type=int, default=10, help='number of steps run before the timing')
+    autotuneArgs.add_argument('--interOpThreads', type=int, nargs='+', default=[1, 2], help='inter op thread counts to combine with each intra op thread count')
+    autotuneArgs.set_defaults(fct=benchmarkAutotune)
+
+    accumulationArgs = subparsers.add_parser('accumulation', help='peak memory of the gradient accumulation compared to a single large batch')
+    accumulationArgs.add_argument('--accumulateSteps', type=int, nargs='+', default=[1, 2, 4, 8], help='numbers of mini-batches to compare, the effective batch size is batchSize * the largest one for all of them')
+    accumulationArgs.add_argument('--updates', type=int, default=20, help='number of updates timed')
+    accumulationArgs.add_argument('--warmup', type=int, default=2, help='number of updates run before the timing')
+    accumulationArgs.set_defaults(fct=benchmarkAccumulation)
+
+    softmaxArgs = subparsers.add_parser('softmax', help='training/decoding step time of the adaptive softmax')
+    softmaxArgs.add_argument('--cutoffs', type=int, nargs='+', default=[2000, 10000], help='cutoffs of the adaptive softmax')
+    softmaxArgs.add_argument('--steps', type=int, default=50, help='number of steps timed')
+    softmaxArgs.add_argument('--beamSize', type=int, default=4, help='number of hypothesis of the beam search steps')
+    softmaxArgs.set_defaults(fct=benchmarkSoftmax)
+
+    projectionArgs = subparsers.add_parser('projection', help='training samples/sec and peak memory of the projected LSTM')
+    projectionArgs.add_argument('--sizes', type=str, nargs='+', default=['512:0', '512:256', '1024:0', '1024:256', '1024:512'], help='hiddenSize:numProj configurations to compare (0 for no projection)')
+    projectionArgs.add_argument('--steps', type=int, default=50, help='number of training steps timed')
+    projectionArgs.add_argument('--warmup', type=int, default=2, help='number of steps run before the timing')
+    projectionArgs.set_defaults(fct=benchmarkProjection)
+
+    cellsArgs = subparsers.add_parser('cells', help='training/decoding step time and peak memory of the recurrent cell types')
+    cellsArgs.add_argument('--cellTypes', type=str, nargs='+', default=Model.CELL_TYPES, help='cell types to compare')
+    cellsArgs.add_argument('--steps', type=int, default=50, help='number of steps timed')
+    cellsArgs.add_argument('--warmup', type=int, default=2, help='number of training steps run before the timing')
+    cellsArgs.set_defaults(fct=benchmarkCells)
+
+    args, chatbotArgs = parser.parse_known_args()
+    args.fct(args, chatbotArgs)
+
+
+if __name__ == "__main__":
+    main()
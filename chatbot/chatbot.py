@@ -9,7 +9,10 @@ Use python 3
 import argparse  # Command line parsing ,解析参数
 import configparser  # Saving the models parameters 保持模型参数
 import datetime  # Chronometer  日期模块
+import json
 import os  # Files management 文件管理模块
+import random
+import sys
 import tensorflow as tf  # 使用的tensorlfow  当前版本1.10.0
 import numpy as np
 import math
@@ -19,6 +22,14 @@ from tensorflow.python import debug as tf_debug
 
 from chatbot.textdata import TextData
 from chatbot.model import Model
+from chatbot import frozenmodel
+from chatbot.checkpointmanager import AsyncSaver, RetentionPolicy, copyCheckpoint
+from chatbot import distributed
+from chatbot import execution
+from chatbot.profiling import TimelineProfiler, TrainingProfiler
+from chatbot import decoding
+from chatbot import npmodel
+from chatbot.responsecache import ResponseCache
 #
 # from .textdata import TextData
 # from .model import Model
@@ -51,12 +62,27 @@ class Chatbot:
         # Tensorflow utilities for convenience saving/logging
         self.writer = None
         self.saver = None
+        self.asyncSaver = None  # Background checkpoints (if --asyncSave)
+        self.retention = None  # Prune the old checkpoints
         self.modelDir = ''  # Where the model is saved
         self.globStep = 0  # Represent the number of iteration for the current model
+        self.epoch = 0  # Number of epochs completed by the model
+        self.epochSeed = 0  # Seed of the shuffling of the current epoch (drawn when the epoch starts)
+        self.sampleCursor = 0  # Number of samples of the current epoch already trained (to resume an interrupted epoch)
+        self.executionParams = {}  # Execution section of params.ini (thread counts tuned for the host)
+        self.isChief = True  # Only the first worker saves the model (data-parallel training)
+        self.server = None  # Server of the worker (data-parallel training)
+        self.predictStep = 0  # Number of sentences predicted (step of the inference modes)
+        self.timelineProfiler = None  # Trace the ops of some steps (if --profileSteps)
 
         # TensorFlow main session (we keep track for the daemon)
+        self.graph = tf.Graph()
         self.sess = None
 
+        # Daemon answers cache (invalidated each time a new model is restored)
+        self.responseCache = None
+        self.modelVersion = None  # Identify the restored checkpoint
+
         # Filename and directories constants
         self.MODEL_DIR_BASE = 'save' + os.sep + 'model'
         self.MODEL_NAME_BASE = 'model'
@@ -91,6 +117,11 @@ class Chatbot:
         # 从语料生成数据集
         globalArgs.add_argument('--createDataset', action='store_true', help='if present, the program will only generate the dataset from the corpus (no training/testing)')
 
+        # 导出 numpy 模型
+        globalArgs.add_argument('--exportNumpy', action='store_true', help='if present, the program will only export the weights of the trained model for the NumPy inference (chatbot/npmodel.py), no training/testing (not supported with --adaptiveSoftmax)')
+        globalArgs.add_argument('--exportFrozen', action='store_true', help='if present, the program will only export the inference graph of the trained model with its weights as constants (serve it with --frozen)')
+        globalArgs.add_argument('--exportQuantization', choices=npmodel.QUANTIZATION_CHOICES, default=npmodel.QUANTIZATION_CHOICES[0], help='storage of the embeddings and output projection of the exported NumPy model (int8 uses a scale for each word)')
+
         # 随机使用一些样本
 
         globalArgs.add_argument('--playDataset', type=int, nargs='?', const=10, default=None,  help='if set, the program  will randomly play some samples(can be use conjointly with createDataset if this is the only action you want to perform)')
@@ -102,7 +133,7 @@ class Chatbot:
         # TODO 查询TensorFlow的debug 模式
         globalArgs.add_argument('--debug', action='store_true', help='run DeepQA with Tensorflow debug mode. Read TF documentation for more details on this.')
         # 保存训练过程的所有模型
-        globalArgs.add_argument('--keepAll', action='store_true', help='If this option is set, all saved model will be kept (Warning: make sure you have enough free disk space or increase saveEvery)')  # TODO: Add an option to delimit the max size
+        globalArgs.add_argument('--keepAll', action='store_true', help='If this option is set, the saved models are not overwritten (the old ones are pruned within the --maxCheckpoints and --maxCheckpointsSize budgets)')
         # 制定模型名称，将会从制定模型加载，保存
         globalArgs.add_argument('--modelTag', type=str, default=None, help='tag to differentiate which model to store/load')
          # 制定根目录，将会总根目录下加载模型和数据
@@ -116,6 +147,21 @@ class Chatbot:
         globalArgs.add_argument('--device', type=str, default=None, help='\'gpu\' or \'cpu\' (Warning: make sure you have enough free RAM), allow to choose on which hardware run the model')
 
         globalArgs.add_argument('--seed', type=int, default=None, help='random seed for replication')
+        globalArgs.add_argument('--intraOpThreads', type=int, default=None, help='threads used inside an operation (0 for the TensorFlow default), the value of params.ini (see benchmark.py autotune) if not set')
+        globalArgs.add_argument('--interOpThreads', type=int, default=None, help='operations run in parallel (0 for the TensorFlow default), the value of params.ini if not set')
+        globalArgs.add_argument('--cpuAffinity', type=str, default=None, help='pin the process to these cores (ex: 0-7,16), the value of params.ini if not set')
+        globalArgs.add_argument('--profileSteps', type=str, default=None, help='steps a:b to trace op by op (training steps, or predicted sentences when testing), the Chrome traces and the table of the most expensive ops are written in the model directory')
+
+        # Inference options (not saved with the model)
+        inferenceArgs = parser.add_argument_group('Inference options', 'decoding strategy used when testing')
+        # 集束搜索的宽度，1 表示贪心搜索
+        inferenceArgs.add_argument('--beamSize', type=int, default=1, help='number of hypothesis kept by the beam search decoder (1 uses the greedy decoding)')
+        inferenceArgs.add_argument('--earlyExit', action='store_true', help='decode the answer one step at a time and stop at <eos> instead of always running maxLength steps (implicit with the beam search)')
+        inferenceArgs.add_argument('--shortlistSize', type=int, default=0, help='if set, the decoder only predicts among this number of most frequent answer words (plus the words of the question), implies step by step decoding')
+        inferenceArgs.add_argument('--frozen', action='store_true', help='interactive/daemon mode: load the graph exported with --exportFrozen instead of building the model and restoring the checkpoint')
+        inferenceArgs.add_argument('--cacheSize', type=int, default=0, help='daemon mode: number of answers kept in the response cache (0 to deactivate)')
+        inferenceArgs.add_argument('--cacheTtl', type=float, default=0, help='daemon mode: number of seconds before a cached answer expires (0 for no expiration)')
+        inferenceArgs.add_argument('--lengthPenalty', type=float, default=0.6, help='length normalization strength of the beam search (0 to deactivate, higher values favor longer answers)')
 
         # Dataset options
         datasetArgs = parser.add_argument_group('Dataset options')
@@ -126,6 +172,7 @@ class Chatbot:
         datasetArgs.add_argument('--datasetTag', type=str, default='', help='add a tag to the dataset (file where to load the vocabulary and the precomputed samples, not the original corpus). Useful to manage multiple versions. Also used to define the file used for the lightweight format.')
         # The samples are computed from the corpus if it does not exist already. There are saved in \'data/samples/\'
         # Not implemented, useless ? 使用这个数据集的比例，现在还没有实现这个功能
+        datasetArgs.add_argument('--validationRatio', type=float, default=0.0, help='fraction of the samples held out for the validation (deterministic split, saved with the dataset)')
         datasetArgs.add_argument('--ratioDataset', type=float, default=1.0, help='ratio of dataset used to avoid using the whole dataset')
         # 最大长度 默认是10 这个影响输入和输出的卷积步长 把这个长度改为100
         datasetArgs.add_argument('--maxLength', type=int, default=100, help='maximum length of the sentence (for input and output), define number of maximum step of the RNN')
@@ -149,9 +196,14 @@ class Chatbot:
 
         # 网络的层数 默认是2
         nnArgs.add_argument('--numLayers', type=int, default=2, help='number of rnn layers')
+        # 循环单元的类型
+        nnArgs.add_argument('--cellType', choices=Model.CELL_TYPES, default=Model.CELL_TYPES[0], help='recurrent cell: basic LSTM, fused LSTM kernel (block, faster on CPU) or GRU (a checkpoint can only be restored with its cell type)')
+        # LSTM 输出的投影维度
+        nnArgs.add_argument('--numProj', type=int, default=0, help='if set, the output (and the recurrent state h) of each LSTM cell is projected to this size, which shrinks the recurrent matrices and the softmax input (0 to deactivate)')
 
         # 采样
         nnArgs.add_argument('--softmaxSamples', type=int, default=0, help='Number of samples in the sampled softmax loss function. A value of 0 deactivates sampled softmax')
+        nnArgs.add_argument('--adaptiveSoftmax', type=int, nargs='*', default=[], help='cutoffs of the adaptive softmax (ex: 2000 10000): the head contains the most frequent answer words, each following cluster the words up to the next cutoff, with a smaller projection (training and inference)')
         # 用初始化的词向量进行嵌入
         nnArgs.add_argument('--initEmbeddings', action='store_true', help='if present, the program will initialize the embeddings with pre-trained word2vec vectors')
         # 嵌入词的 大小
@@ -162,14 +214,29 @@ class Chatbot:
         # Training options
         trainingArgs = parser.add_argument_group('Training options')
         # 训练参数，训练轮数 默认 30 ，2000次创建一个检查点
-        trainingArgs.add_argument('--numEpochs', type=int, default=30, help='maximum number of epochs to run')
+        trainingArgs.add_argument('--numEpochs', type=int, default=30, help='maximum number of epochs to run (in total, a resumed model only runs the remaining ones)')
         trainingArgs.add_argument('--saveEvery', type=int, default=2000, help='nb of mini-batch step before creating a model checkpoint')
+        trainingArgs.add_argument('--summaryEvery', type=int, default=100, help='nb of mini-batch step between two summaries (tensorboard and console status with the throughput)')
+        trainingArgs.add_argument('--validateEvery', type=int, default=0, help='nb of mini-batch step between two evaluations of the validation set, which also save a checkpoint when the validation loss improves (copied as model-best.ckpt, not overwritten by the next checkpoints), 0 to deactivate')
+        trainingArgs.add_argument('--patience', type=int, default=5, help='stop the training after this number of evaluations without improvement of the validation loss (0 for no early stopping)')
+        trainingArgs.add_argument('--maxCheckpoints', type=int, default=10, help='with keepAll, maximum number of checkpoints kept: the latest, the best and a log-spaced history (0 for no limit)')
+        trainingArgs.add_argument('--maxCheckpointsSize', type=float, default=3.0, help='with keepAll, maximum disk usage of the checkpoints in GB (0 for no limit)')
+        trainingArgs.add_argument('--asyncSave', action='store_true', help='write the checkpoints on a background thread, the training only waits for the copy of the variables (uses twice the memory of the variables)')
         # 彼此大小，256
         trainingArgs.add_argument('--batchSize', type=int, default=256, help='mini-batch size')
         # 学习率， 默认0.002
         trainingArgs.add_argument('--learningRate', type=float, default=0.002, help='Learning rate')
         # dropout 默认是0.9
         trainingArgs.add_argument('--dropout', type=float, default=0.9, help='Dropout rate (keep probabilities)')
+        # 使用 tf.data 输入管道，不再每一步 feed_dict
+        trainingArgs.add_argument('--accumulateSteps', type=int, default=1, help='accumulate the gradients of this number of mini-batches before each update (effective batch size of batchSize * accumulateSteps, with the memory of a single mini-batch), the steps count the mini-batches')
+        trainingArgs.add_argument('--inputPipeline', action='store_true', help='feed the training batches with a tf.data pipeline instead of the placeholders feed_dict: the padded samples are fed once per epoch in the shuffled order, the targets, batching and prefetching are done by TensorFlow')
+        trainingArgs.add_argument('--pipelineThreads', type=int, default=4, help='number of parallel calls to prepare the samples in the input pipeline')
+        trainingArgs.add_argument('--numWorkers', type=int, default=1, help='data-parallel training: number of local worker processes, each one training on its own shard of the samples (the variables are on the parameter servers)')
+        trainingArgs.add_argument('--numPs', type=int, default=1, help='data-parallel training: number of local parameter server processes')
+        trainingArgs.add_argument('--syncReplicas', action='store_true', help='data-parallel training: aggregate the gradients of all the workers at each step instead of applying them asynchronously')
+        trainingArgs.add_argument('--clusterSpec', type=str, default=None, help=argparse.SUPPRESS)  # Set by the launcher for the worker processes
+        trainingArgs.add_argument('--taskIndex', type=int, default=0, help=argparse.SUPPRESS)
 
         return parser.parse_args(args)
 
@@ -182,6 +249,7 @@ class Chatbot:
         print('Welcome to chat v0.1 !')
         print()
         print('TensorFlow detected: v{}'.format(tf.__version__)) # 当前tensorflow 版本1.10.0 ,测试服务器的版本1.13.1
+        startTime = datetime.datetime.now()
 
         # General initialisation 分割参数
 
@@ -194,12 +262,56 @@ class Chatbot:
         if not self.args.rootDir:
             self.args.rootDir = os.getcwd()  # Use the current working directory 使用当前路径
 
+        if self.args.exportFrozen:  # The frozen graph only contains the inference operators
+            self.args.test = Chatbot.TestMode.DAEMON
+        if self.args.frozen and self.args.test not in [Chatbot.TestMode.INTERACTIVE, Chatbot.TestMode.DAEMON]:
+            raise ValueError('The frozen graph can only be used in interactive or daemon mode')
+
         #tf.logging.set_verbosity(tf.logging.INFO) # DEBUG, INFO, WARN (default), ERROR, or FATAL
 
+        # Data-parallel training: this process only launches the workers and the parameter servers
+        if self.args.numWorkers > 1 and not self.args.clusterSpec and not self.args.test and not self.args.createDataset:
+            if self.args.validateEvery:  # The workers would not stop at the same time
+                raise ValueError('The validation is not supported with the data-parallel training')
+            if self.args.accumulateSteps > 1:  # The accumulators would be shared on the parameter servers
+                raise ValueError('The gradient accumulation is not supported with the data-parallel training')
+            distributed.launchLocalCluster(sys.argv[1:] if args is None else args, self.args.numWorkers, self.args.numPs)
+            print('Data-parallel training done')
+            return
+        if self.args.clusterSpec:
+            self.isChief = self.args.taskIndex == 0
+            self.server = tf.train.Server(
+                tf.train.ClusterSpec(json.loads(self.args.clusterSpec)),
+                job_name='worker',
+                task_index=self.args.taskIndex
+            )
+
         self.loadModelParams()  # Update the self.modelDir and self.globStep, for now, not used when loading Model (but need to be called before _getSummaryName)
+        if self.args.cpuAffinity:
+            execution.setCpuAffinity(self.args.cpuAffinity)
+        if self.args.numProj and self.args.cellType != 'basic':
+            raise ValueError('The projection of the outputs is only supported by the basic LSTM cells')
+        if self.args.adaptiveSoftmax and self.args.softmaxSamples:
+            raise ValueError('The adaptive softmax and the sampled softmax cannot be used together')
+        if self.args.adaptiveSoftmax and self.args.exportNumpy:  # Checked before loading the dataset
+            raise ValueError('The NumPy inference does not support the adaptive softmax, the model cannot be exported')
+        if self.args.adaptiveSoftmax and self.args.shortlistSize:  # The full head and clusters would still be computed
+            raise ValueError('The shortlist is not supported by the adaptive softmax (its clusters already reduce the cost of the rare words)')
+        if self.args.adaptiveSoftmax != sorted(set(self.args.adaptiveSoftmax)):
+            raise ValueError('The cutoffs of the adaptive softmax should be increasing: {}'.format(self.args.adaptiveSoftmax))
 
         # 读取数据对象
-        self.textData = TextData(self.args)
+        # At inference, only the vocabulary saved with the model is needed (much faster than unpickling the dataset)
+        vocabularyName = os.path.join(self.modelDir, npmodel.VOCABULARY_FILENAME)
+        if self.args.test and os.path.isfile(vocabularyName):
+            self.textData = TextData(self.args, vocabularyFile=vocabularyName)
+        else:
+            self.textData = TextData(self.args)
+            if self.args.test and os.path.isdir(self.modelDir):  # Model saved before the vocabulary file existed
+                self.textData.saveVocabulary(vocabularyName)
+            if self.args.clusterSpec:
+                self.textData.shard(self.args.taskIndex, self.args.numWorkers)
+        print('Data loaded in {}'.format(datetime.datetime.now() - startTime))
         # TODO: Add a mode where we can force the input of the decoder // Try to visualize the predictions for
         # each word of the vocabulary / decoder input
         # TODO: For now, the model are trained for a specific dataset (because of the maxLength which define the
@@ -209,58 +321,99 @@ class Chatbot:
             print('Dataset created! Thanks for using this program')
             return  # No need to go further
 
-        # Prepare the model
-        with tf.device(self.getDevice()):
-            self.model = Model(self.args, self.textData)
-
-        # Saver/summaries
-        self.writer = tf.summary.FileWriter(self._getSummaryName())
-        self.saver = tf.train.Saver(max_to_keep=200)
-
-        # TODO: Fixed seed (WARNING: If dataset shuffling, make sure to do that after saving the
-        # dataset, otherwise, all which cames after the shuffling won't be replicable when
-        # reloading the dataset). How to restore the seed after loading ??
-        # Also fix seed for random.shuffle (does it works globally for all files ?)
-
-        # Running session
-        self.sess = tf.Session(config=tf.ConfigProto(
-            allow_soft_placement=True,  # 如果指定的设备不存在，允许tf自动分配设备（true） 如果允许false
-            log_device_placement=False)  # Too verbose ?  是否打印设备分配日志   打印设备日志日志
-        )  # TODO: Replace all sess by self.sess (not necessary a good idea) ?
-
-        if self.args.debug:
-            self.sess = tf_debug.LocalCLIDebugWrapperSession(self.sess)
-            self.sess.add_tensor_filter("has_inf_or_nan", tf_debug.has_inf_or_nan)
-
-        print('Initialize variables...')
-        self.sess.run(tf.global_variables_initializer())
-
-        # Reload the model eventually (if it exist.), on testing mode, the models are not loaded here (but in predictTestset)
-        if self.args.test != Chatbot.TestMode.ALL:
-            self.managePreviousModel(self.sess)
-
-        # Initialize embeddings with pre-trained word2vec vectors
-        if self.args.initEmbeddings:
-            self.loadEmbedding(self.sess)
+        if self.args.exportNumpy:
+            self.exportNumpy()
+            return  # No need to go further
 
-        if self.args.test:
-                #实时对话模式
-            if self.args.test == Chatbot.TestMode.INTERACTIVE:
-                self.mainTestInteractive(self.sess)
-            elif self.args.test == Chatbot.TestMode.ALL:
-                print('Start predicting...')
-                self.predictTestset(self.sess)
-                print('All predictions done')
-            elif self.args.test == Chatbot.TestMode.DAEMON:
-                print('Daemon mode, running in background...')
+        # Each bot has its own graph, so a new model can be loaded while the previous one is still answering
+        with self.graph.as_default():
+            # Prepare the model
+            if self.args.frozen:
+                self.model = frozenmodel.FrozenModel(self.args, self.textData, self.modelDir)
+            elif self.args.clusterSpec:  # The variables are shared by the workers
+                with tf.device(distributed.getDeviceSetter(json.loads(self.args.clusterSpec), self.args.taskIndex, self.getDevice())):
+                    self.model = Model(self.args, self.textData)
             else:
-                raise RuntimeError('Unknown test mode: {}'.format(self.args.test))  # Should never happen
-        else:
-            self.mainTrain(self.sess)
+                with tf.device(self.getDevice()):
+                    self.model = Model(self.args, self.textData)
+
+            # Saver/summaries
+            if self.isChief:
+                self.writer = tf.summary.FileWriter(self._getSummaryName())
+            if not self.args.frozen:  # The frozen graph has no variables
+                self.saver = tf.train.Saver(max_to_keep=None)  # The old checkpoints are removed by the retention policy
+            if self.args.asyncSave and not self.args.test and self.isChief:
+                self.asyncSaver = AsyncSaver(tf.global_variables())
+
+            # TODO: Fixed seed (WARNING: If dataset shuffling, make sure to do that after saving the
+            # dataset, otherwise, all which cames after the shuffling won't be replicable when
+            # reloading the dataset). How to restore the seed after loading ??
+            # Also fix seed for random.shuffle (does it works globally for all files ?)
+
+            # Running session
+            self.sess = tf.Session(
+                self.server.target if self.server else '',
+                config=execution.getSessionConfig(self.args.intraOpThreads, self.args.interOpThreads)
+            )  # TODO: Replace all sess by self.sess (not necessary a good idea) ?
+
+            if self.args.test == Chatbot.TestMode.DAEMON and self.args.cacheSize:
+                self.responseCache = ResponseCache(self.args.cacheSize, self.args.cacheTtl)
+
+            if self.args.profileSteps and self.isChief:
+                self.timelineProfiler = TimelineProfiler(self.args.profileSteps, self.modelDir)
+
+            if self.args.debug:
+                self.sess = tf_debug.LocalCLIDebugWrapperSession(self.sess)
+                self.sess.add_tensor_filter("has_inf_or_nan", tf_debug.has_inf_or_nan)
+
+            # Reload the model eventually (if it exist.), on testing mode, the models are not loaded here (but in predictTestset)
+            restored = False
+            if self.args.frozen:  # Nothing to restore, the weights are constants of the graph
+                frozenName = os.path.join(self.modelDir, frozenmodel.FROZEN_GRAPH_FILENAME)
+                print('Frozen graph loaded from {}'.format(frozenName))
+                self.modelVersion = (frozenName, os.path.getmtime(frozenName))
+                restored = True
+            elif self.args.test != Chatbot.TestMode.ALL and self.isChief:  # The other workers use the shared variables
+                restored = self.managePreviousModel(self.sess)
+
+            if self.args.exportFrozen:
+                if not restored:
+                    raise RuntimeError('No model to export in \'{}\''.format(self.modelDir))
+                frozenmodel.exportFrozenGraph(self.sess, self.model, self.modelDir)
+                self.sess.close()
+                print('Model exported to {}'.format(self.modelDir))
+                return  # No need to go further
+
+            if not restored and self.isChief:  # Otherwise all the variables have been overwritten by the checkpoint
+                print('Initialize variables...')
+                self.sess.run(tf.global_variables_initializer())
+
+            # Initialize embeddings with pre-trained word2vec vectors
+            if self.args.initEmbeddings and not self.args.frozen and self.isChief:
+                self.loadEmbedding(self.sess)
+
+            if self.args.clusterSpec:
+                distributed.initWorker(self.sess, self.model, self.isChief, self.globStep)
+
+            if self.args.test:
+                    #实时对话模式
+                if self.args.test == Chatbot.TestMode.INTERACTIVE:
+                    self.mainTestInteractive(self.sess)
+                elif self.args.test == Chatbot.TestMode.ALL:
+                    print('Start predicting...')
+                    self.predictTestset(self.sess)
+                    print('All predictions done')
+                elif self.args.test == Chatbot.TestMode.DAEMON:
+                    print('Daemon ready in {}'.format(datetime.datetime.now() - startTime))
+                    print('Daemon mode, running in background...')
+                else:
+                    raise RuntimeError('Unknown test mode: {}'.format(self.args.test))  # Should never happen
+            else:
+                self.mainTrain(self.sess)
 
-        if self.args.test != Chatbot.TestMode.DAEMON:
-            self.sess.close()
-            print("The End! Thanks for using this program")
+            if self.args.test != Chatbot.TestMode.DAEMON:
+                self.sess.close()
+                print("The End! Thanks for using this program")
 
     def mainTrain(self, sess):
         """ Training loop
@@ -272,50 +425,185 @@ class Chatbot:
         # Specific training dependent loading
 
         self.textData.makeLighter(self.args.ratioDataset)  # 限制训练集的大小
+        self.retention = RetentionPolicy(
+            self.modelDir,
+            self.MODEL_EXT,
+            maxCount=self.args.maxCheckpoints,
+            maxSize=self.args.maxCheckpointsSize * 2**30
+        )
+        checkpointLosses = []  # Losses since the last checkpoint
+
+        validate = self.args.validateEvery > 0
+        if validate and not self.textData.validationSamples:
+            raise ValueError('No validation samples in the dataset, set --validationRatio to use --validateEvery')
+        bestValidLoss = float('inf')
+        bestModelName = None
+        nbEvalsWithoutImprovement = 0
+        stop = False  # Early stopping
 
         mergedSummaries = tf.summary.merge_all()  # Define the summary operator (Warning: Won't appear on the tensorboard graph)
-        if self.globStep == 0:  # Not restoring from previous run
+        sampleArrays = self.textData.getSampleArrays() if self.args.inputPipeline else None  # Computed once for all epochs
+        if self.globStep == 0 and self.isChief:  # Not restoring from previous run
             self.writer.add_graph(sess.graph)  # First time only
 
-        # If restoring a model, restore the progression bar ? and current batch ?
+        # If restoring a model, the interrupted epoch is resumed at the next unseen sample (same shuffling)
 
         print('Start training (press Ctrl+C to save and exit)...')
 
+        if self.model.accumulatorsInit is not None:  # Not restored from the checkpoints
+            sess.run(self.model.accumulatorsInit)
+
+        profiler = TrainingProfiler()
+        workerStep = self.globStep  # Same as globStep, except with data-parallel training (updated by all the workers)
+        nbSlots = self.args.maxLengthEnco + self.args.maxLengthDeco  # Tokens of each sample, padding included
+        # Gradient accumulation: the accumulators are not saved, so the samples only count as trained (sampleCursor)
+        # once their gradients are applied, the ones of an interrupted cycle are trained again after a restart
+        nbAccumulated = 0  # Mini-batches accumulated since the last update
+        accumulatedSamples = 0
+
         try:  # If the user exit while training, we still try to save the model
-            for e in range(self.args.numEpochs):
+            if self.epoch >= self.args.numEpochs:
+                print('The model has already been trained for {} epochs'.format(self.epoch))
+            for e in range(self.epoch, self.args.numEpochs):  # A resumed model only runs the remaining epochs
 
                 print()
                 print("----- Epoch {}/{} ; (lr={}) -----".format(e+1, self.args.numEpochs, self.args.learningRate))
 
-                batches = self.textData.getBatches()
+                if self.sampleCursor >= self.textData.getSampleSize():  # The dataset has changed since the interruption
+                    self.sampleCursor = 0
+                if self.sampleCursor == 0:  # New epoch
+                    self.epochSeed = random.getrandbits(32)
+                else:
+                    print('Resuming the epoch {} at the sample {}/{}'.format(self.epoch + 1, self.sampleCursor, self.textData.getSampleSize()))
+
+                with profiler.stage('batches'):
+                    if self.args.inputPipeline:  # The batches are generated inside the graph
+                        order = self.textData.getEpochOrder(self.epochSeed)[self.sampleCursor:]
+                        ops, feedDict = self.model.initInputPipeline(sampleArrays, order)
+                        sess.run(ops, feedDict)
+                        batches = [None] * math.ceil(len(order) / self.args.batchSize)
+                    else:  # Only the remaining batches of the epoch are created
+                        batches = self.textData.getBatches(self.epochSeed, self.sampleCursor)
 
                 # TODO: Also update learning parameters eventually
 
                 tic = datetime.datetime.now()
-                for nextBatch in tqdm(batches, desc="Training"):
+                for i, nextBatch in enumerate(tqdm(batches, desc="Training")):
                     # Training pass
-                    ops, feedDict = self.model.step(nextBatch)
+                    with profiler.stage('feed'):
+                        ops, feedDict = self.model.step(nextBatch)
                     assert len(ops) == 2  # training, loss
-                    _, loss, summary = sess.run(ops + (mergedSummaries,), feedDict)
-                    self.writer.add_summary(summary, self.globStep)
-                    self.globStep += 1
+                    applyUpdate = nbAccumulated + 1 >= self.args.accumulateSteps or i == len(batches) - 1  # Each epoch ends with an update
+                    if not applyUpdate:
+                        ops = (self.model.accumulateOp,) + ops[1:]  # The update is applied by the last mini-batch
+                    writeSummary = self.isChief and (workerStep + 1) % self.args.summaryEvery == 0
+                    with profiler.stage('run'):
+                        runArgs = self.timelineProfiler.getRunArgs(self.globStep) if self.timelineProfiler else {}
+                        fetches = {'ops': ops, 'batchStats': self.model.batchStats}
+                        if self.model.globalStepUpdated is not None:
+                            fetches['globalStep'] = self.model.globalStepUpdated
+                        if writeSummary:
+                            fetches['summary'] = mergedSummaries
+                        values = sess.run(fetches, feedDict, **runArgs)
+                        loss, batchStats = values['ops'][1], values['batchStats']
+                    if runArgs:
+                        self.timelineProfiler.addRunMetadata(self.globStep, runArgs)
+                    profiler.addStep(batchStats[0], batchStats[1], batchStats[0] * nbSlots)
+                    if writeSummary:
+                        profilerSummary, profilerStatus = profiler.getSummary(), profiler.format()
+                        profiler.reset()  # The time to write the summaries is counted in the next window
+                        with profiler.stage('summary'):
+                            self.writer.add_summary(values['summary'], self.globStep)
+                            self.writer.add_summary(profilerSummary, self.globStep)
+                    previousStep = self.globStep
+                    self.globStep = int(values['globalStep']) if 'globalStep' in values else self.globStep + 1
+                    workerStep += 1
+                    accumulatedSamples += int(batchStats[0])
+                    if applyUpdate:
+                        self.sampleCursor += accumulatedSamples
+                        nbAccumulated, accumulatedSamples = 0, 0
+                        if self.sampleCursor >= self.textData.getSampleSize():  # Saved as completed by the next checkpoints
+                            self.epoch += 1
+                            self.sampleCursor = 0
+                    else:
+                        nbAccumulated += 1
+                    checkpointLosses.append(loss)
 
-                    # Output training status  输出训练状态 每100步
-                    if self.globStep % 100 == 0:
+                    # Output training status  输出训练状态 每 summaryEvery 步
+                    if writeSummary:
                         perplexity = math.exp(float(loss)) if loss < 300 else float("inf")
                         tqdm.write("----- Step %d -- Loss %.2f -- Perplexity %.2f" % (self.globStep, loss, perplexity))
-
-                    # Checkpoint
-                    if self.globStep % self.args.saveEvery == 0:
-                        self._saveSession(sess)
+                        tqdm.write(profilerStatus)
+
+                    # Validation  验证集
+                    saved = False
+                    if validate and self.globStep % self.args.validateEvery == 0:
+                        validLoss = self.evaluate(sess)
+                        validPerplexity = math.exp(validLoss) if validLoss < 300 else float('inf')
+                        self.writer.add_summary(tf.Summary(value=[
+                            tf.Summary.Value(tag='validation/loss', simple_value=validLoss),
+                            tf.Summary.Value(tag='validation/perplexity', simple_value=validPerplexity),
+                        ]), self.globStep)
+                        if validLoss < bestValidLoss:
+                            tqdm.write('----- Validation -- Loss %.2f -- Perplexity %.2f (best)' % (validLoss, validPerplexity))
+                            bestValidLoss = validLoss
+                            bestModelName = self._getBestModelName()
+                            nbEvalsWithoutImprovement = 0
+                            self._saveSession(sess, validLoss, best=True)
+                            saved = True
+                        else:
+                            nbEvalsWithoutImprovement += 1
+                            tqdm.write('----- Validation -- Loss %.2f -- Perplexity %.2f (no improvement for %d evaluations)' % (validLoss, validPerplexity, nbEvalsWithoutImprovement))
+
+                    # Checkpoint (the global step can advance by more than one with data-parallel training)
+                    if self.globStep // self.args.saveEvery > previousStep // self.args.saveEvery:
+                        if not saved:  # Otherwise already saved with the validation loss
+                            with profiler.stage('checkpoint'):
+                                # With the validation, only the validation losses are compared to keep the best checkpoint
+                                self._saveSession(sess, None if validate else np.mean(checkpointLosses))
+                        checkpointLosses = []
+
+                    if validate and self.args.patience and nbEvalsWithoutImprovement >= self.args.patience:
+                        tqdm.write('Early stopping: the validation loss has not improved since step {} (best weights in {})'.format(
+                            self.globStep - nbEvalsWithoutImprovement * self.args.validateEvery,
+                            bestModelName
+                        ))
+                        stop = True
+                        break
 
                 toc = datetime.datetime.now()
 
-                print("Epoch finished in {}".format(toc-tic))  # Warning: Will overflow if an epoch takes more than 24 hours, and the output isn't really nicer
+                print("Epoch finished in {} ({:.2f} steps/sec)".format(toc-tic, len(batches) / max((toc-tic).total_seconds(), 1e-6)))  # Warning: Will overflow if an epoch takes more than 24 hours, and the output isn't really nicer
+                if stop:
+                    break
         except (KeyboardInterrupt, SystemExit):  # If the user press Ctrl+C while testing progress
             print('Interruption detected, exiting the program...')
 
-        self._saveSession(sess)  # Ultimate saving before complete exit
+        self._saveSession(sess, np.mean(checkpointLosses) if checkpointLosses and not validate else None)  # Ultimate saving before complete exit
+        if self.asyncSaver:
+            print('Waiting for the last checkpoint...')
+            self.asyncSaver.close()
+        if bestModelName:
+            print('Best validation loss {:.2f} (perplexity {:.2f}): {}'.format(bestValidLoss, math.exp(min(bestValidLoss, 300)), bestModelName))
+
+    def evaluate(self, sess):
+        """ Compute the loss on the validation set
+        Forward pass of the training graph (no dropout, no update). With --softmaxSamples, the loss is the sampled
+        approximation, as for the training loss
+        Args:
+            sess: The current running session
+        Return:
+            float: the mean loss of the validation samples
+        """
+        totalLoss = 0.0
+        nbSamples = 0
+        for batch in self.textData.getValidationBatches():
+            ops, feedDict = self.model.stepEvaluate(batch)
+            loss = sess.run(ops[0], feedDict)
+            batchSize = len(batch.encoderSeqs[0])
+            totalLoss += float(loss) * batchSize  # The loss is averaged over the batch
+            nbSamples += batchSize
+        return totalLoss / nbSamples
 
     def predictTestset(self, sess):
         """ Try predicting the sentences from the samples.txt file.
@@ -339,7 +627,7 @@ class Chatbot:
         for modelName in sorted(modelList):  # TODO: Natural sorting
             print('Restoring previous model from {}'.format(modelName))
             # 载入模型
-            self.saver.restore(sess, modelName)
+            self._restoreModel(sess, modelName)
             print('Testing...')
             # 删除模型的扩展后缀并且给预测添加后缀
             saveName = modelName[:-len(self.MODEL_EXT)] + self.TEST_OUT_SUFFIX
@@ -408,16 +696,116 @@ class Chatbot:
         if questionSeq is not None:  # If the caller want to have the real input
             questionSeq.extend(batch.encoderSeqs)
 
-        # Run the model
+        return self._predictBatch(batch)
 
-        ops, feedDict = self.model.step(batch)
+    def _predictBatch(self, batch):
+        """ Run the model on a single sentence batch, with the decoding strategy given by the inference options
+        Args:
+            batch (Batch): the input batch
+        Return:
+            list <int>: the word ids corresponding to the answer
+        """
+        if self.args.beamSize > 1:
+            answer = self._beamPredict(batch)
+        elif self.args.earlyExit or self.args.shortlistSize or self.args.frozen:  # The frozen graph has no unrolled decoder
+            answer = self._greedyPredict(batch)[0]
+        else:
+            ops, feedDict = self.model.step(batch)
 
-        output = self.sess.run(ops[0], feedDict)  # TODO: Summarize the output too (histogram, ...)
-        # 输出结果转成具体语句
-        answer = self.textData.deco2sentence(output)
+            output = self._run(ops[0], feedDict)  # TODO: Summarize the output too (histogram, ...)
+            # 输出结果转成具体语句
+            answer = self.textData.deco2sentence(output)
 
+        self.predictStep += 1
         return answer
 
+    def _run(self, fetches, feedDict):
+        """ Run the inference session (the ops are traced if the current prediction is in --profileSteps)
+        Args:
+            fetches: the tensors to compute
+            feedDict (dict): the inputs
+        Return:
+            the computed values
+        """
+        if self.timelineProfiler is None:
+            return self.sess.run(fetches, feedDict)
+        runArgs = self.timelineProfiler.getRunArgs(self.predictStep)
+        outputs = self.sess.run(fetches, feedDict, **runArgs)
+        self.timelineProfiler.addRunMetadata(self.predictStep, runArgs)
+        return outputs
+
+    def _encode(self, batch, initialState=None):
+        """ Run the encoder
+        Args:
+            batch (Batch): the input batch
+            initialState: if set, the encoder continues from this state
+        Return:
+            Obj: the final encoder state (nested structure of np.array)
+        """
+        ops, feedDict = self.model.stepEncoder(batch, initialState)
+        return self._run(ops[0], feedDict)
+
+    def _greedyPredict(self, batch, state=None):
+        """ Greedy decoding, one step at a time
+        The encoder is run once, then the decoder is called until every sentence of the batch has produced <eos>
+        Args:
+            batch (Batch): the input batch
+            state: the encoder state of the batch, if already computed
+        Return:
+            list<list<int>>: the word ids corresponding to the answer of each sentence
+        """
+        if state is None:
+            state = self._encode(batch)
+
+        return decoding.greedySearch(
+            self._getDecoderStep(batch),
+            state,
+            self.textData.goToken,
+            self.textData.eosToken,
+            self.args.maxLengthDeco
+        )
+
+    def _beamPredict(self, batch, state=None):
+        """ Decode the answer with the beam search
+        The encoder is run once, then the decoder is called step by step on all the hypothesis at once
+        Args:
+            batch (Batch): the input batch (single sentence)
+            state: the encoder state of the batch, if already computed
+        Return:
+            list <int>: the word ids corresponding to the answer
+        """
+        if state is None:
+            state = self._encode(batch)
+
+        return decoding.beamSearch(
+            self._getDecoderStep(batch),
+            state,
+            self.textData.goToken,
+            self.textData.eosToken,
+            self.args.maxLengthDeco,
+            self.args.beamSize,
+            alpha=self.args.lengthPenalty
+        )
+
+    def _getDecoderStep(self, batch):
+        """ Return the function running a single decoding step (see decoding module for the signature)
+        Args:
+            batch (Batch): the input batch, its words are added to the shortlist (if --shortlistSize is set)
+        Return:
+            function: the decoding step
+        """
+        shortlist = None
+        if self.args.shortlistSize:
+            shortlist = self.textData.getShortlist(
+                self.args.shortlistSize,
+                [wordId for encoderSeq in batch.encoderSeqs for wordId in encoderSeq]
+            )
+
+        def runStep(inputs, state, topK):
+            ops, feedDict = self.model.stepDecoder(inputs, state, topK, shortlist)
+            return self._run(ops, feedDict)
+        return runStep
+
     # 预测单个语句
     def daemonPredict(self, sentence):
         """ Return the answer to a given sentence (same as singlePredict() but with additional cleaning)
@@ -426,16 +814,79 @@ class Chatbot:
         Return:
             str: the human readable sentence
         """
-        return self.textData.sequence2str(
-            self.singlePredict(sentence),
-            clean=True
+        if self.responseCache is None:
+            return self.textData.sequence2str(
+                self.singlePredict(sentence),
+                clean=True
+            )
+
+        batch = self.textData.sentence2enco(sentence)
+        if not batch:
+            return ''
+        key = (  # The answer depends on the model, the decoding options and the input words
+            self.modelVersion,
+            self.args.beamSize,
+            self.args.lengthPenalty,
+            self.args.shortlistSize,
+            tuple(tuple(encoderSeq) for encoderSeq in batch.encoderSeqs),
         )
+        return self.responseCache.get(key, lambda: self.textData.sequence2str(self._predictBatch(batch), clean=True))
+
+    def daemonPredictContext(self, sentence, context=None):
+        """ Same as daemonPredict, but the question is encoded after the previous turns of the conversation
+        The encoder continues from the state of the previous turn, so the history is never encoded again. The
+        answers are not cached (they depend on the context).
+        Args:
+            sentence (str): the raw input sentence
+            context: the context returned for the previous turn (None to start a new conversation)
+        Return:
+            str, Obj: the human readable sentence and the context of the next turn (the encoder state after the
+            question and the answer)
+        """
+        batch = self.textData.sentence2enco(sentence)
+        if not batch:
+            return '', context
+
+        questionState = self._encode(batch, context)
+        if self.args.beamSize > 1:
+            answer = self._beamPredict(batch, questionState)
+        else:
+            answer = self._greedyPredict(batch, questionState)[0]
+
+        context = self._encode(self.textData.sequence2enco(answer), questionState)
+        self.predictStep += 1
+        return self.textData.sequence2str(answer, clean=True), context
+
+    def daemonStats(self):
+        """ Return the statistics of the response cache (None if the cache is not used)
+        Return:
+            dict: the cache statistics (see ResponseCache.getStats)
+        """
+        if self.responseCache is None:
+            return None
+        return self.responseCache.getStats()
+
+    def exportNumpy(self):
+        """ Export the weights of the current model and its vocabulary for the NumPy inference
+        The files are saved in the model directory, the params.ini is shared with the checkpoint
+        """
+        modelName = self._getModelName()
+        print('Exporting {} for the NumPy inference...'.format(modelName))
+        reader = tf.train.NewCheckpointReader(modelName)
+        weights = npmodel.weightsFromCheckpoint({
+            name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()
+        })
+        weights = npmodel.quantizeWeights(weights, self.args.exportQuantization)
+        np.savez(os.path.join(self.modelDir, npmodel.WEIGHTS_FILENAME), **weights)
+        self.textData.saveVocabulary(os.path.join(self.modelDir, npmodel.VOCABULARY_FILENAME))
+        print('Model exported to {}'.format(self.modelDir))
 
     def daemonClose(self):
         """ A utility function to close the daemon when finish
         """
         print('Exiting the daemon mode...')
         self.sess.close()
+        self.writer.close()
         print('Daemon closed.')
 
     # 词向量嵌入，采用google 采用GoogleNewS 预训练的向量
@@ -520,6 +971,8 @@ class Chatbot:
         In any case, the directory will exist as it has been created by the summary writer
         Args:
             sess: The current running session
+        Return:
+            bool: True if the variables have been restored from the checkpoint
         """
 
         print('WARNING: ', end='')
@@ -533,7 +986,8 @@ class Chatbot:
             # Analysing directory content
             elif os.path.exists(modelName):  # Restore the model
                 print('Restoring previous model from {}'.format(modelName))
-                self.saver.restore(sess, modelName)  # Will crash when --reset is not activated and the model has not been saved yet
+                self._restoreModel(sess, modelName)  # Will crash when --reset is not activated and the model has not been saved yet
+                return True
             elif self._getModelList():
                 print('Conflict with previous models.')
                 print(self.modelDir)
@@ -550,18 +1004,64 @@ class Chatbot:
 
         else:
             print('No previous model found, starting from clean directory: {}'.format(self.modelDir))
+        return False
 
-    def _saveSession(self, sess):
+    def _restoreModel(self, sess, modelName):
+        """ Restore the variables of the given checkpoint
+        The cached answers of the previous model are discarded
+        Args:
+            sess: the current session
+            modelName (str): the checkpoint to restore
+        """
+        self.saver.restore(sess, modelName)
+        indexName = modelName + '.index'
+        self.modelVersion = (modelName, os.path.getmtime(indexName) if os.path.exists(indexName) else None)
+        if self.responseCache is not None:
+            self.responseCache.clear()
+
+    def _saveSession(self, sess, loss=None, best=False):
         """ Save the model parameters and the variables
         Args:
             sess: the current session
+            loss (float): the loss of the model, used to keep the best checkpoint (None if unknown)
+            best (bool): if True, the checkpoint is also copied as the best one (see _getBestModelName)
         """
+        if not self.isChief:  # The variables are shared, the chief saves them
+            return
         tqdm.write('Checkpoint reached: saving model (don\'t stop the run)...')
-        self.saveModelParams()
+        tic = datetime.datetime.now()
         model_name = self._getModelName()
-        with open(model_name, 'w') as f:  # HACK: Simulate the old model existance to avoid rewriting the file parser
+        config = self._getModelParams()  # Snapshot, the training may continue while the model is written
+        step = self.globStep
+        if self.asyncSaver:
+            self.asyncSaver.save(sess, model_name, lambda: self._saveModelFiles(model_name, config, step, loss, best))
+        else:
+            self.saver.save(sess, model_name)
+            self._saveModelFiles(model_name, config, step, loss, best)
+
+        stallTime = (datetime.datetime.now() - tic).total_seconds()
+        tqdm.write('Training stalled {:.2f}s by the checkpoint{}'.format(stallTime, ' (writing in background)' if self.asyncSaver else ''))
+        self.writer.add_summary(tf.Summary(value=[tf.Summary.Value(tag='checkpoint_stall', simple_value=stallTime)]), self.globStep)
+
+    def _saveModelFiles(self, modelName, config, step, loss, best=False):
+        """ Save the files associated with a checkpoint once its variables are written, then prune the old checkpoints
+        Args:
+            modelName (str): the checkpoint name
+            config (ConfigParser): the model parameters at the time of the checkpoint
+            step (int): the global step of the checkpoint
+            loss (float): the loss of the checkpoint (None if unknown)
+            best (bool): if True, also copy the checkpoint as the best one
+        """
+        self.saveModelParams(config)
+        with open(modelName, 'w') as f:  # HACK: Simulate the old model existance to avoid rewriting the file parser
             f.write('This file is used internally by DeepQA to check the model existance. Please do not remove.\n')
-        self.saver.save(sess, model_name)  # TODO: Put a limit size (ex: 3GB for the modelDir)
+        vocabularyName = os.path.join(self.modelDir, npmodel.VOCABULARY_FILENAME)
+        if not os.path.isfile(vocabularyName):  # Used by the inference to start without loading the dataset
+            self.textData.saveVocabulary(vocabularyName)
+        if best:  # Not overwritten by the next checkpoints (without --keepAll, they all have the same name)
+            copyCheckpoint(modelName, self._getBestModelName())
+        for name in self.retention.apply(modelName, step, float(loss) if loss is not None else None):
+            tqdm.write('Checkpoint removed: {}'.format(name))
         tqdm.write('Model saved.')
 
 
@@ -603,6 +1103,9 @@ class Chatbot:
 
             # Restoring the the parameters
             self.globStep = config['General'].getint('globStep')
+            self.epoch = config['General'].getint('epoch', fallback=0)  # Models trained before the resumable epochs
+            self.epochSeed = config['General'].getint('epochSeed', fallback=0)
+            self.sampleCursor = config['General'].getint('sampleCursor', fallback=0)
             self.args.watsonMode = config['General'].getboolean('watsonMode')
             self.args.autoEncode = config['General'].getboolean('autoEncode')
             self.args.corpus = config['General'].get('corpus')
@@ -614,20 +1117,28 @@ class Chatbot:
             self.args.filterVocab = config['Dataset'].getint('filterVocab')
             self.args.skipLines = config['Dataset'].getboolean('skipLines')
             self.args.vocabularySize = config['Dataset'].getint('vocabularySize')
+            self.args.validationRatio = config['Dataset'].getfloat('validationRatio', fallback=0.0)  # Models trained before the validation split
 
             self.args.hiddenSize = config['Network'].getint('hiddenSize')
             self.args.numLayers = config['Network'].getint('numLayers')
+            self.args.cellType = config['Network'].get('cellType', Model.CELL_TYPES[0])  # Models trained before the cell types
+            self.args.numProj = config['Network'].getint('numProj', fallback=0)  # Models trained before the projected LSTM
             self.args.softmaxSamples = config['Network'].getint('softmaxSamples')
+            self.args.adaptiveSoftmax = [int(cutoff) for cutoff in config['Network'].get('adaptiveSoftmax', '').split(',') if cutoff]
             self.args.initEmbeddings = config['Network'].getboolean('initEmbeddings')
             self.args.embeddingSize = config['Network'].getint('embeddingSize')
             self.args.embeddingSource = config['Network'].get('embeddingSource')
 
+            if config.has_section(execution.EXECUTION_SECTION):
+                self.executionParams = config[execution.EXECUTION_SECTION]  # Case insensitive keys
+
             # No restoring for training params, batch size or other non model dependent parameters
 
             # Show the restored params
             print()
             print('Warning: Restoring parameters:')
             print('globStep: {}'.format(self.globStep))
+            print('epoch: {} (sample {} with the seed {})'.format(self.epoch, self.sampleCursor, self.epochSeed))
             print('watsonMode: {}'.format(self.args.watsonMode))
             print('autoEncode: {}'.format(self.args.autoEncode))
             print('corpus: {}'.format(self.args.corpus))
@@ -636,14 +1147,30 @@ class Chatbot:
             print('filterVocab: {}'.format(self.args.filterVocab))
             print('skipLines: {}'.format(self.args.skipLines))
             print('vocabularySize: {}'.format(self.args.vocabularySize))
+            print('validationRatio: {}'.format(self.args.validationRatio))
             print('hiddenSize: {}'.format(self.args.hiddenSize))
             print('numLayers: {}'.format(self.args.numLayers))
+            print('cellType: {}'.format(self.args.cellType))
+            print('numProj: {}'.format(self.args.numProj))
             print('softmaxSamples: {}'.format(self.args.softmaxSamples))
+            print('adaptiveSoftmax: {}'.format(self.args.adaptiveSoftmax))
             print('initEmbeddings: {}'.format(self.args.initEmbeddings))
             print('embeddingSize: {}'.format(self.args.embeddingSize))
             print('embeddingSource: {}'.format(self.args.embeddingSource))
             print()
 
+        # Execution options: the command line overrides the values tuned for the host (not a model parameter)
+        if self.args.test:
+            intraKey, interKey = 'inferenceIntraOpThreads', 'inferenceInterOpThreads'
+        else:
+            intraKey, interKey = 'intraOpThreads', 'interOpThreads'
+        if self.args.intraOpThreads is None:
+            self.args.intraOpThreads = int(self.executionParams.get(intraKey, 0))
+        if self.args.interOpThreads is None:
+            self.args.interOpThreads = int(self.executionParams.get(interKey, 0))
+        if self.args.cpuAffinity is None:
+            self.args.cpuAffinity = self.executionParams.get('cpuAffinity', '')
+
         # For now, not arbitrary  independent maxLength between encoder and decoder
         self.args.maxLengthEnco = self.args.maxLength
         self.args.maxLengthDeco = self.args.maxLength + 2
@@ -652,14 +1179,29 @@ class Chatbot:
             self.SENTENCES_PREFIX.reverse()
 
 
-    def saveModelParams(self):
+    def saveModelParams(self, config=None):
         """ Save the params of the model, like the current globStep value
+        Args:
+            config (ConfigParser): the parameters to save (see _getModelParams), the current ones if None
+        """
+        if config is None:
+            config = self._getModelParams()
+        with open(os.path.join(self.modelDir, self.CONFIG_FILENAME), 'w') as configFile:
+            config.write(configFile)
+
+    def _getModelParams(self):
+        """ Return the current params of the model, like the current globStep value
         Warning: if you modify this function, make sure the changes mirror loadModelParams
+        Return:
+            ConfigParser: the parameters
         """
         config = configparser.ConfigParser()
         config['General'] = {}
         config['General']['version']  = self.CONFIG_VERSION
         config['General']['globStep']  = str(self.globStep)
+        config['General']['epoch'] = str(self.epoch)
+        config['General']['epochSeed'] = str(self.epochSeed)
+        config['General']['sampleCursor'] = str(self.sampleCursor)
         config['General']['watsonMode'] = str(self.args.watsonMode)
         config['General']['autoEncode'] = str(self.args.autoEncode)
         config['General']['corpus'] = str(self.args.corpus)
@@ -670,23 +1212,29 @@ class Chatbot:
         config['Dataset']['filterVocab'] = str(self.args.filterVocab)
         config['Dataset']['skipLines'] = str(self.args.skipLines)
         config['Dataset']['vocabularySize'] = str(self.args.vocabularySize)
+        config['Dataset']['validationRatio'] = str(self.args.validationRatio)
 
         config['Network'] = {}
         config['Network']['hiddenSize'] = str(self.args.hiddenSize)
         config['Network']['numLayers'] = str(self.args.numLayers)
+        config['Network']['cellType'] = str(self.args.cellType)
+        config['Network']['numProj'] = str(self.args.numProj)
         config['Network']['softmaxSamples'] = str(self.args.softmaxSamples)
+        config['Network']['adaptiveSoftmax'] = ','.join(str(cutoff) for cutoff in self.args.adaptiveSoftmax)
         config['Network']['initEmbeddings'] = str(self.args.initEmbeddings)
         config['Network']['embeddingSize'] = str(self.args.embeddingSize)
         config['Network']['embeddingSource'] = str(self.args.embeddingSource)
 
+        # Only written by the autotune benchmark (see execution.saveTunedThreads), the command line values are not kept
+        config[execution.EXECUTION_SECTION] = dict(self.executionParams)
+
         # Keep track of the learning params (but without restoring them)
         config['Training (won\'t be restored)'] = {}
         config['Training (won\'t be restored)']['learningRate'] = str(self.args.learningRate)
         config['Training (won\'t be restored)']['batchSize'] = str(self.args.batchSize)
         config['Training (won\'t be restored)']['dropout'] = str(self.args.dropout)
 
-        with open(os.path.join(self.modelDir, self.CONFIG_FILENAME), 'w') as configFile:
-            config.write(configFile)
+        return config
 
     def _getSummaryName(self):
         """ Parse the argument to decide were to save the summary, at the same place that the model
@@ -708,6 +1256,11 @@ class Chatbot:
             modelName += '-' + str(self.globStep)
         return modelName + self.MODEL_EXT
 
+    def _getBestModelName(self):
+        """ Return the name of the copy of the checkpoint with the best validation loss (--validateEvery)
+        """
+        return os.path.join(self.modelDir, self.MODEL_NAME_BASE + '-best' + self.MODEL_EXT)
+
     def getDevice(self):
         """ Parse the argument to decide on which device run the model
         Return:
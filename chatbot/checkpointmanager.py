@@ -0,0 +1,204 @@
+"""
+Checkpoints written in background
+
+异步保存模型：训练只等待变量的拷贝，写硬盘在后台线程完成
+
+The values of the variables are fetched from the training session (fast, memory copy only), then loaded into a
+shadow graph and written by its own saver on a background thread, so the training continues during the disk
+writes. The checkpoints use the names of the training variables, they are restored by the usual saver.
+
+The retention policy bounds the number and the disk usage of the checkpoints kept with --keepAll.
+"""
+
+import glob
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+
+import tensorflow as tf
+
+
+def copyCheckpoint(modelName, copyName):
+    """ Copy all the files of a checkpoint under another name (ex: to keep the best one)
+    The data files are copied before the index, each one written under a temporary name then renamed, so an
+    interrupted copy never mixes the index of a checkpoint with the data of another one.
+    Args:
+        modelName (str): the checkpoint to copy
+        copyName (str): the name of the copy (overwritten if it exists)
+    """
+    fileNames = glob.glob(glob.escape(modelName) + '.*')
+    fileNames.sort(key=lambda name: name.endswith('.index'))
+    fileNames.append(modelName)  # Marker file, last: the copy is listed once complete
+    for fileName in fileNames:
+        destName = copyName + fileName[len(modelName):]
+        shutil.copyfile(fileName, destName + '.tmp')
+        os.replace(destName + '.tmp', destName)
+
+
+class AsyncSaver:
+    """ Save the checkpoints on a background thread, at most one save in flight
+    Warning: The shadow graph keeps a second copy of the variables in memory
+    """
+
+    def __init__(self, variables, maxToKeep=None):
+        """
+        Args:
+            variables (list<tf.Variable>): the variables to save (ex: tf.global_variables())
+            maxToKeep (int): number of recent checkpoints kept (same as tf.train.Saver), None to keep them all (pruned by
+                the RetentionPolicy)
+        """
+        self.variables = variables
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            self.placeholders = [tf.placeholder(v.dtype.base_dtype, v.shape) for v in variables]
+            shadowVariables = [tf.Variable(p, trainable=False) for p in self.placeholders]
+            self.loadOp = tf.variables_initializer(shadowVariables)  # Copy the snapshot into the shadow variables
+            self.saver = tf.train.Saver(
+                {v.op.name: s for v, s in zip(variables, shadowVariables)},  # Same names as the training variables
+                max_to_keep=maxToKeep
+            )
+        self.sess = tf.Session(graph=self.graph)
+
+        self.thread = None
+        self.error = None  # Exception raised by the background thread
+
+    def save(self, sess, modelName, onSaved=None):
+        """ Snapshot the variables and write them in background
+        If the previous save is still running, wait for it first
+        Args:
+            sess: the training session
+            modelName (str): the checkpoint name
+            onSaved (function): called without arguments by the background thread once the checkpoint is written
+        Return:
+            float: the time during which the training has been blocked (in seconds)
+        """
+        tic = time.perf_counter()
+        self.wait()
+        values = sess.run(self.variables)
+        stallTime = time.perf_counter() - tic
+
+        self.thread = threading.Thread(target=self._write, args=(values, modelName, onSaved), name='checkpoint')
+        self.thread.start()
+        return stallTime
+
+    def _write(self, values, modelName, onSaved):
+        """ Write the snapshot (background thread)
+        """
+        try:
+            self.sess.run(self.loadOp, dict(zip(self.placeholders, values)))
+            self.saver.save(self.sess, modelName, write_meta_graph=False)  # The graph is rebuilt when restoring
+            if onSaved:
+                onSaved()
+        except Exception as e:  # Reported to the training thread
+            self.error = e
+
+    def wait(self):
+        """ Block until the current save (if any) is done
+        """
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        if self.error:
+            error, self.error = self.error, None
+            raise RuntimeError('The background checkpoint failed') from error
+
+    def close(self):
+        """ Wait for the last checkpoint and release the shadow graph
+        """
+        self.wait()
+        self.sess.close()
+
+
+class RetentionPolicy:
+    """ Decide which checkpoints are kept in the model directory (with --keepAll, one checkpoint per save)
+    The latest checkpoint and the one with the lowest loss are always kept. The others are pruned until the count
+    and disk budgets are respected, keeping a log-spaced history (dense for the recent steps, sparse for the old ones).
+    """
+
+    RECORDS_FILENAME = 'checkpoints.json'  # Step and loss of each checkpoint
+
+    def __init__(self, modelDir, modelExt, maxCount=10, maxSize=0):
+        """
+        Args:
+            modelDir (str): the directory containing the checkpoints
+            modelExt (str): the extension of the checkpoint names (ex: '.ckpt')
+            maxCount (int): maximum number of checkpoints kept (0 for no limit)
+            maxSize (float): maximum size of the checkpoints (in bytes, 0 for no limit)
+        """
+        self.modelDir = modelDir
+        self.modelExt = modelExt
+        self.maxCount = maxCount
+        self.maxSize = maxSize
+
+        self.records = {}  # Checkpoint name -> {'step': int, 'loss': float or None}
+        recordsName = os.path.join(self.modelDir, self.RECORDS_FILENAME)
+        if os.path.isfile(recordsName):
+            with open(recordsName, 'r') as f:
+                records = json.load(f)
+            self.records = {n: r for n, r in records.items() if os.path.isfile(os.path.join(self.modelDir, n))}
+
+        # Checkpoints saved before the records existed
+        for fileName in os.listdir(self.modelDir):
+            match = re.match(r'.*-(\d+)' + re.escape(self.modelExt) + '$', fileName)
+            if match and fileName not in self.records:
+                self.records[fileName] = {'step': int(match.group(1)), 'loss': None}
+
+    def _getFiles(self, name):
+        """ Return all the files of a checkpoint (marker file, index, data, meta)
+        """
+        return glob.glob(os.path.join(self.modelDir, glob.escape(name))) + \
+            glob.glob(os.path.join(self.modelDir, glob.escape(name) + '.*'))
+
+    def _getSize(self, name):
+        return sum(os.path.getsize(f) for f in self._getFiles(name))
+
+    def apply(self, modelName, step, loss=None):
+        """ Register a new checkpoint and prune the others if the budgets are exceeded
+        Args:
+            modelName (str): the path of the new checkpoint
+            step (int): the global step of the checkpoint
+            loss (float): the evaluation loss of the checkpoint (None if unknown)
+        Return:
+            list<str>: the names of the removed checkpoints
+        """
+        self.records[os.path.basename(modelName)] = {'step': step, 'loss': loss}
+
+        names = sorted(self.records, key=lambda n: self.records[n]['step'])
+        latest = names[-1]
+        scored = [n for n in names if self.records[n]['loss'] is not None]
+        best = min(scored, key=lambda n: self.records[n]['loss']) if scored else latest
+        sizes = {n: self._getSize(n) for n in names}
+
+        removed = []
+        while True:
+            overCount = self.maxCount and len(names) > self.maxCount
+            overSize = self.maxSize and sum(sizes[n] for n in names) > self.maxSize
+            candidates = [n for n in names if n not in (latest, best)]
+            if not (overCount or overSize) or not candidates:
+                break
+            # Remove the checkpoint whose neighbours are the closest on a log scale of the age (the oldest
+            # checkpoints are naturally further apart)
+            ages = {n: math.log1p(self.records[latest]['step'] - self.records[n]['step']) for n in names}
+            def gap(n):
+                i = names.index(n)
+                older = ages[names[i - 1]] if i > 0 else ages[n] + (ages[n] - ages[names[i + 1]])
+                return older - ages[names[i + 1]]
+            name = min(candidates, key=gap)
+            names.remove(name)
+            removed.append(name)
+
+        if overSize:
+            print('Warning: the latest and best checkpoints exceed the disk budget of the model directory')
+
+        for name in removed:
+            for fileName in self._getFiles(name):
+                os.remove(fileName)
+            del self.records[name]
+        with open(os.path.join(self.modelDir, self.RECORDS_FILENAME), 'w') as f:
+            json.dump(self.records, f, indent=2)
+        return removed
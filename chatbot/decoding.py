@@ -0,0 +1,134 @@
+"""
+Decoding strategies used at inference
+
+推理时使用的解码策略（贪心搜索，集束搜索）
+
+The functions only rely on a step function, so they can be used with any backend:
+    stepFct(inputs, state, topK) -> (logProbs, ids, nextState)
+with inputs of shape [nbHypothesis], logProbs and ids of shape [nbHypothesis, topK] and the state being a (nested)
+structure of arrays whose first dimension is the hypothesis.
+"""
+
+import numpy as np
+
+
+def mapState(fct, state):
+    """ Apply a function on each array of a (nested) recurrent state
+    Args:
+        fct (function): function to apply on each np.array
+        state (np.array, tuple or namedtuple): the state (ex: a tuple of LSTMStateTuple for multiple layers)
+    Return:
+        Obj: a state with the same structure
+    """
+    if isinstance(state, np.ndarray):
+        return fct(state)
+    values = [mapState(fct, s) for s in state]
+    if hasattr(state, '_fields'):  # Namedtuple (ex: LSTMStateTuple)
+        return type(state)(*values)
+    return type(state)(values)
+
+
+def stateBatchSize(state):
+    """ Return the number of sequences (first dimension) of a (nested) recurrent state
+    """
+    while not isinstance(state, np.ndarray):
+        state = state[0]
+    return len(state)
+
+
+def lengthPenalty(length, alpha):
+    """ Length normalization as defined in the GNMT paper (Wu et al., 2016)
+    Without normalization, the beam search favors the short answers
+    Args:
+        length (int): the length of the hypothesis
+        alpha (float): strength of the normalization (0 deactivates it)
+    Return:
+        float: the value by which divide the log probability of the hypothesis
+    """
+    return ((5.0 + length) / 6.0) ** alpha
+
+
+def greedySearch(stepFct, state, goToken, eosToken, maxLength):
+    """ Decode by choosing the most probable word at each step
+    Contrary to the unrolled graph, the decoding stops as soon as every sequence of the batch has produced <eos>.
+    Args:
+        stepFct (function): the decoding step (see module documentation)
+        state: the encoder final state for the batch
+        goToken (int): the first decoder input
+        eosToken (int): the end of sentence token
+        maxLength (int): maximum number of decoding steps
+    Return:
+        list<list<int>>: the word ids of the answer for each sequence of the batch (without <eos>)
+    """
+    batchSize = stateBatchSize(state)
+    inputs = np.full(batchSize, goToken, dtype=np.int32)
+    finished = np.zeros(batchSize, dtype=bool)
+    sequences = [[] for _ in range(batchSize)]
+
+    for _ in range(maxLength):
+        _, ids, state = stepFct(inputs, state, 1)
+        inputs = ids[:, 0].astype(np.int32)
+        for i in np.flatnonzero(~finished):
+            if inputs[i] != eosToken:
+                sequences[i].append(int(inputs[i]))
+        finished |= inputs == eosToken
+        if finished.all():
+            break
+
+    return sequences
+
+
+def beamSearch(stepFct, state, goToken, eosToken, maxLength, beamSize, alpha=0.6):
+    """ Search the most probable answer by keeping the beamSize best hypothesis at each step
+    All the hypothesis are evaluated in a single batched step. Each time a hypothesis emits <eos>, the beam is
+    shrunk by one, so the search ends as soon as every beam has finished (or maxLength is reached).
+    Args:
+        stepFct (function): the decoding step (see module documentation)
+        state: the encoder final state for a single sentence (batch of size 1)
+        goToken (int): the first decoder input
+        eosToken (int): the end of sentence token
+        maxLength (int): maximum number of decoding steps
+        beamSize (int): number of hypothesis kept at each step
+        alpha (float): length normalization strength
+    Return:
+        list<int>: the word ids of the best answer (without <eos>)
+    """
+    sequences = [[]]  # Alive hypothesis
+    scores = np.zeros(1, dtype=np.float32)  # Cumulated log probabilities of the alive hypothesis
+    inputs = np.array([goToken], dtype=np.int32)
+    finished = []  # List of (normalized score, sequence)
+
+    for _ in range(maxLength):
+        nbAlive = beamSize - len(finished)
+        logProbs, ids, state = stepFct(inputs, state, nbAlive)  # No need of more candidates than remaining slots
+        candidates = (scores[:, np.newaxis] + logProbs).flatten()
+        topK = logProbs.shape[1]
+
+        parents = []
+        newSequences = []
+        newScores = []
+        for i in np.argsort(-candidates):
+            parent = i // topK
+            wordId = int(ids[parent, i % topK])
+            if wordId == eosToken:
+                finished.append((candidates[i] / lengthPenalty(len(sequences[parent]) + 1, alpha), sequences[parent]))
+            else:
+                parents.append(parent)
+                newSequences.append(sequences[parent] + [wordId])
+                newScores.append(candidates[i])
+            if len(finished) + len(newSequences) == beamSize:
+                break
+
+        if not newSequences:  # Every beam emitted <eos>
+            break
+
+        parents = np.array(parents)
+        state = mapState(lambda s: s[parents], state)
+        sequences = newSequences
+        scores = np.array(newScores, dtype=np.float32)
+        inputs = np.array([sequence[-1] for sequence in sequences], dtype=np.int32)
+    else:  # Max length reached, the remaining hypothesis are also candidates
+        for sequence, score in zip(sequences, scores):
+            finished.append((score / lengthPenalty(len(sequence), alpha), sequence))
+
+    return max(finished, key=lambda x: x[0])[1]
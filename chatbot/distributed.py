@@ -0,0 +1,130 @@
+"""
+Data-parallel training on the local machine
+
+多进程数据并行训练：参数服务器保存变量，每个 worker 进程训练数据的一个分片
+
+The variables are placed on the parameter server processes, and each worker process runs the usual training loop on
+its own shard of the training samples. The gradients are applied asynchronously, or aggregated across the workers at
+each step with --syncReplicas. The first worker (chief) initializes or restores the variables, and is the only one
+writing the checkpoints and the summaries.
+
+The processes are started with the 'spawn' method (TensorFlow does not support fork once initialized).
+"""
+
+import json
+import multiprocessing
+import socket
+import time
+
+import tensorflow as tf
+
+
+def makeClusterSpec(nbWorkers, nbPs):
+    """ Reserve a free port on localhost for each task
+    Args:
+        nbWorkers (int): number of worker tasks
+        nbPs (int): number of parameter server tasks
+    Return:
+        dict: the cluster definition {'ps': [address], 'worker': [address]}
+    """
+    sockets = []
+    for _ in range(nbWorkers + nbPs):  # All opened at the same time to get different ports
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('localhost', 0))
+        sockets.append(s)
+    addresses = ['localhost:{}'.format(s.getsockname()[1]) for s in sockets]
+    for s in sockets:
+        s.close()
+    return {'ps': addresses[:nbPs], 'worker': addresses[nbPs:]}
+
+
+def _runParameterServer(cluster, taskIndex):
+    """ Serve the variables until terminated (parameter server process)
+    """
+    server = tf.train.Server(tf.train.ClusterSpec(cluster), job_name='ps', task_index=taskIndex)
+    server.join()
+
+
+def _runWorker(args, cluster, taskIndex):
+    """ Run the training loop on the shard of the worker (worker process)
+    """
+    from chatbot.chatbot import Chatbot  # Not imported at the module level (circular import)
+    Chatbot().main(args + ['--clusterSpec', json.dumps(cluster), '--taskIndex', str(taskIndex)])
+
+
+def launchLocalCluster(args, nbWorkers, nbPs):
+    """ Start the parameter servers and the workers on localhost, then wait for the end of the training
+    Args:
+        args (list<str>): the command line of the chatbot, forwarded to the workers
+        nbWorkers (int): number of worker processes
+        nbPs (int): number of parameter server processes
+    """
+    cluster = makeClusterSpec(nbWorkers, nbPs)
+    print('Starting {} workers and {} parameter servers: {}'.format(nbWorkers, nbPs, cluster))
+
+    context = multiprocessing.get_context('spawn')
+    parameterServers = [
+        context.Process(target=_runParameterServer, args=(cluster, i), name='ps-{}'.format(i), daemon=True)
+        for i in range(nbPs)
+    ]
+    workers = [
+        context.Process(target=_runWorker, args=(args, cluster, i), name='worker-{}'.format(i))
+        for i in range(nbWorkers)
+    ]
+    for process in parameterServers + workers:
+        process.start()
+
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:  # The workers receive the interruption too and save the model
+        for worker in workers:
+            worker.join()
+    finally:
+        for parameterServer in parameterServers:
+            parameterServer.terminate()
+            parameterServer.join()
+
+    failed = [worker.name for worker in workers if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError('Training failed on {}'.format(', '.join(failed)))
+
+
+def getDeviceSetter(cluster, taskIndex, device=None):
+    """ Place the variables on the parameter servers and the other operations on the worker
+    Args:
+        cluster (dict): the cluster definition
+        taskIndex (int): index of the current worker
+        device (str): device of the worker operations (ex: '/cpu:0'), default if None
+    Return:
+        function: the device function, to use with tf.device
+    """
+    return tf.train.replica_device_setter(
+        worker_device='/job:worker/task:{}{}'.format(taskIndex, device or ''),
+        cluster=tf.train.ClusterSpec(cluster)
+    )
+
+
+def initWorker(sess, model, isChief, globStep=0):
+    """ Synchronize the worker with the shared variables, once the chief has initialized or restored them
+    The global step is initialized last by the chief, so the other workers wait for it
+    Args:
+        sess: the session of the worker
+        model (Model): the training model (with the global step and the optional sync optimizer)
+        isChief (bool): True for the first worker
+        globStep (int): the step of the restored model (the global step is not saved with the checkpoints)
+    """
+    if isChief:
+        sess.run(model.globalStep.initializer)
+        model.globalStep.load(globStep, sess)
+    else:
+        uninitialized = tf.report_uninitialized_variables(tf.global_variables() + [model.globalStep])
+        while len(sess.run(uninitialized)):
+            print('Waiting for the chief to initialize the variables...')
+            time.sleep(1)
+
+    if model.syncOptimizer:
+        sess.run(model.syncOptimizer.local_step_init_op)
+        if isChief:  # Distribute the tokens of the first step, then aggregate the gradients of each step
+            sess.run(model.syncInitTokens)
+            model.syncQueueRunner.create_threads(sess, daemon=True, start=True)
@@ -0,0 +1,110 @@
+"""
+CPU execution configuration of the sessions
+
+CPU 执行配置：线程池大小和 CPU 亲和性
+
+TensorFlow sizes its thread pools from the number of cores of the machine, which is wrong in containers limited by a
+CPU quota or a cpuset. The thread counts can be set explicitly (or tuned with `python benchmark.py autotune`) and the
+process can be pinned to some cores.
+"""
+
+import configparser
+import os
+
+import tensorflow as tf
+
+
+EXECUTION_SECTION = 'Execution'
+
+
+def getCpuCount():
+    """ Return the number of cores really usable by the process (cpuset and cgroup CPU quota)
+    Return:
+        int: the number of cores
+    """
+    nbCpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    quota = None
+    try:
+        with open('/sys/fs/cgroup/cpu.max', 'r') as f:  # cgroup v2: '<quota> <period>' or 'max <period>'
+            values = f.read().split()
+        if values[0] != 'max':
+            quota = int(values[0]) / int(values[1])
+    except (OSError, ValueError, IndexError):
+        try:  # cgroup v1
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us', 'r') as f:
+                quotaUs = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us', 'r') as f:
+                periodUs = int(f.read())
+            if quotaUs > 0:
+                quota = quotaUs / periodUs
+        except (OSError, ValueError):
+            pass
+    if quota:
+        nbCpus = min(nbCpus, max(int(quota), 1))
+    return nbCpus
+
+
+def parseCpuList(cpuList):
+    """ Parse a list of cores in the taskset format
+    Args:
+        cpuList (str): ex: '0-3,8'
+    Return:
+        list<int>: the cores (ex: [0, 1, 2, 3, 8])
+    """
+    cpus = []
+    for part in cpuList.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-')
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+
+def setCpuAffinity(cpuList):
+    """ Pin the process to the given cores
+    Should be called before the creation of the sessions (the thread pools inherit the affinity)
+    Args:
+        cpuList (str): the cores, in the taskset format
+    """
+    cpus = parseCpuList(cpuList)
+    os.sched_setaffinity(0, cpus)
+    print('CPU affinity: {}'.format(cpus))
+
+
+def getSessionConfig(intraOpThreads=0, interOpThreads=0):
+    """ Return the configuration of a session
+    Args:
+        intraOpThreads (int): threads used inside an operation (ex: matmul), 0 for the TensorFlow default
+        interOpThreads (int): operations run in parallel, 0 for the TensorFlow default
+    Return:
+        tf.ConfigProto: the configuration
+    """
+    return tf.ConfigProto(
+        allow_soft_placement=True,  # 如果指定的设备不存在，允许tf自动分配设备（true） 如果允许false
+        log_device_placement=False,  # Too verbose ?  是否打印设备分配日志
+        intra_op_parallelism_threads=intraOpThreads,
+        inter_op_parallelism_threads=interOpThreads
+    )
+
+
+def saveTunedThreads(configName, trainingThreads, inferenceThreads):
+    """ Record the fastest thread counts in the params.ini of the model
+    Args:
+        configName (str): the params.ini file
+        trainingThreads (int, int): the intra and inter op threads of the training
+        inferenceThreads (int, int): the intra and inter op threads of the inference
+    """
+    config = configparser.ConfigParser()
+    config.read(configName)
+    if not config.has_section(EXECUTION_SECTION):
+        config[EXECUTION_SECTION] = {}
+    config[EXECUTION_SECTION]['intraOpThreads'] = str(trainingThreads[0])
+    config[EXECUTION_SECTION]['interOpThreads'] = str(trainingThreads[1])
+    config[EXECUTION_SECTION]['inferenceIntraOpThreads'] = str(inferenceThreads[0])
+    config[EXECUTION_SECTION]['inferenceInterOpThreads'] = str(inferenceThreads[1])
+    with open(configName, 'w') as configFile:
+        config.write(configFile)
@@ -0,0 +1,125 @@
+"""
+Frozen inference graph
+
+冻结的推理图：变量转成常量，只保留测试模式的输出
+
+The test mode graph is exported with its variables converted to constants (no initializer, no saver, no dropout,
+no optimizer). Only the encoder and the step by step decoder are kept: the unrolled decoder of the test graph (one
+copy of the cell for each output position) is stripped, the frozen model always decodes step by step. The tensors
+used by the inference are saved by name in a small json file, so the loader can expose the same interface as the
+Model (stepEncoder, stepDecoder) without rebuilding the network.
+"""
+
+import json
+import os
+
+import tensorflow as tf
+
+from chatbot.model import Model
+
+
+FROZEN_GRAPH_FILENAME = 'frozen.pb'
+SIGNATURE_FILENAME = 'frozen.json'
+
+
+def _tensorNames(tensors):
+    """ Replace each tensor of a (nested) structure by its name (None for the tensors not built by the model)
+    """
+    if isinstance(tensors, (list, tuple)):
+        return [_tensorNames(t) for t in tensors]
+    if tensors is None:
+        return None
+    return tensors.name
+
+
+def _getTensors(graph, names):
+    """ Inverse of _tensorNames (the nested lists are converted to tuples, as the recurrent states)
+    """
+    if isinstance(names, list):
+        return tuple(_getTensors(graph, n) for n in names)
+    if names is None:
+        return None
+    return graph.get_tensor_by_name(names)
+
+
+def exportFrozenGraph(sess, model, modelDir):
+    """ Save the inference graph of the model with the current values of the variables
+    Args:
+        sess: the session holding the restored variables
+        model (Model): a model built in test mode
+        modelDir (str): the directory where the graph and its signature are saved
+    """
+    signature = {
+        'encoderInputs': _tensorNames(model.encoderInputs),
+        'encoderStateIn': _tensorNames(model.encoderStateIn),
+        'encoderLengths': _tensorNames(model.encoderLengths),
+        'encoderState': _tensorNames(model.encoderState),
+        'stepInputs': _tensorNames(model.stepInputs),
+        'stepStateIn': _tensorNames(model.stepStateIn),
+        'stepStateOut': _tensorNames(model.stepStateOut),
+        'stepTopK': _tensorNames(model.stepTopK),
+        'stepLogProbs': _tensorNames(model.stepLogProbs),
+        'stepIds': _tensorNames(model.stepIds),
+        'stepShortlist': _tensorNames(model.stepShortlist),
+        'stepShortlistLogProbs': _tensorNames(model.stepShortlistLogProbs),
+        'stepShortlistIds': _tensorNames(model.stepShortlistIds),
+    }
+
+    outputNodes = [tensor.op.name for tensor in tf.contrib.framework.nest.flatten([
+        model.encoderState,
+        model.stepStateOut,
+        model.stepLogProbs,
+        model.stepIds,
+        model.stepShortlistLogProbs,
+        model.stepShortlistIds,
+    ]) if tensor is not None]
+    # Drop the nodes not needed by the encoder and the step decoder (the unrolled decoder, the training operators)
+    graphDef = tf.graph_util.extract_sub_graph(sess.graph.as_graph_def(), outputNodes)
+    graphDef = tf.graph_util.convert_variables_to_constants(sess, graphDef, outputNodes)
+
+    with open(os.path.join(modelDir, FROZEN_GRAPH_FILENAME), 'wb') as f:
+        f.write(graphDef.SerializeToString())
+    with open(os.path.join(modelDir, SIGNATURE_FILENAME), 'w') as f:
+        json.dump(signature, f, indent=2)
+    print('Frozen graph: {} nodes, {:.2f}MB'.format(len(graphDef.node), graphDef.ByteSize() / 2**20))
+
+
+def _loadBlockLstmOps():
+    """ Register the fused LSTM ops (LSTMBlockCell) before importing a graph which uses them
+    The contrib ops are not part of the core library: their kernels are only loaded (tf.load_op_library) when their
+    python module is imported, and tf.contrib is imported lazily.
+    """
+    from tensorflow.contrib.rnn.python.ops import lstm_ops  # Only imported for its side effect
+
+
+class FrozenModel(Model):
+    """ Inference only model loaded from the frozen graph
+    Should be created inside the graph of the session which will run it
+    """
+
+    def __init__(self, args, textData, modelDir):
+        """
+        Args:
+            args: parameters of the model
+            textData: the dataset object (only the vocabulary is used)
+            modelDir (str): the directory containing the exported graph
+        """
+        self.modelDir = modelDir
+        super().__init__(args, textData)
+
+    def buildNetwork(self):
+        """ Import the frozen graph instead of building the network
+        """
+        graphDef = tf.GraphDef()
+        with open(os.path.join(self.modelDir, FROZEN_GRAPH_FILENAME), 'rb') as f:
+            graphDef.ParseFromString(f.read())
+        with open(os.path.join(self.modelDir, SIGNATURE_FILENAME), 'r') as f:
+            signature = json.load(f)
+
+        if self.args.cellType == 'block':
+            _loadBlockLstmOps()
+        tf.import_graph_def(graphDef, name='')  # Same names as in the signature
+        graph = tf.get_default_graph()
+        for name, tensorNames in signature.items():
+            setattr(self, name, _getTensors(graph, tensorNames))
+        self.encoderInputs = list(self.encoderInputs)
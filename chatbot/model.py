@@ -6,6 +6,9 @@
 
 """
 
+import copy
+
+import numpy as np
 import tensorflow as tf
 
 from chatbot.textdata import Batch
@@ -57,6 +60,92 @@ class ProjectionOp:
             return tf.matmul(X, self.W) + self.b
 
 
+class AdaptiveSoftmax:
+    """ Output layer with the vocabulary split by frequency (adaptive softmax)
+    The head predicts the frequent words and one entry for each tail cluster. The rarer words of each cluster are
+    predicted from a smaller projection of the decoder output (divided by DIM_FACTOR for each cluster), so the cost of
+    the rare words is much lower than with the full projection.
+    """
+
+    DIM_FACTOR = 4
+
+    def __init__(self, inputSize, wordsByFrequency, cutoffs, scope, dtype=None):
+        """
+        Args:
+            inputSize (int): dimension of the decoder output
+            wordsByFrequency (list<int>): all the word ids, sorted by decreasing frequency
+            cutoffs (list<int>): the ranks where the clusters start (the first one is the size of the head)
+            scope (str): encapsulate variables
+            dtype: the weights type
+        """
+        vocabularySize = len(wordsByFrequency)
+        self.cutoffs = [c for c in cutoffs if c < vocabularySize] + [vocabularySize]
+        self.headSize = self.cutoffs[0]
+        self.nbClusters = len(self.cutoffs) - 1
+
+        rankOfId = [0] * vocabularySize
+        for rank, wordId in enumerate(wordsByFrequency):
+            rankOfId[wordId] = rank
+        self.rankOfId = tf.constant(rankOfId, dtype=tf.int32)
+
+        with tf.variable_scope('weights_' + scope):
+            self.headW = tf.get_variable('head_weights', [inputSize, self.headSize + self.nbClusters], dtype=dtype)
+            self.headB = tf.get_variable('head_bias', [self.headSize + self.nbClusters], initializer=tf.constant_initializer(), dtype=dtype)
+            self.tails = []  # (projection, weights, bias) of each cluster
+            for i in range(self.nbClusters):
+                clusterDim = max(inputSize // self.DIM_FACTOR ** (i + 1), 1)
+                clusterSize = self.cutoffs[i + 1] - self.cutoffs[i]
+                self.tails.append((
+                    tf.get_variable('tail{}_projection'.format(i), [inputSize, clusterDim], dtype=dtype),
+                    tf.get_variable('tail{}_weights'.format(i), [clusterDim, clusterSize], dtype=dtype),
+                    tf.get_variable('tail{}_bias'.format(i), [clusterSize], initializer=tf.constant_initializer(), dtype=dtype),
+                ))
+
+    def _tailLogProbs(self, i, inputs):
+        projection, W, b = self.tails[i]
+        return tf.nn.log_softmax(tf.matmul(tf.matmul(inputs, projection), W) + b)
+
+    def loss(self, labels, logits):
+        """ Cross entropy of each target (same signature as the softmax_loss_function of sequence_loss)
+        Only the decoder outputs whose target is in a cluster are projected on this cluster
+        Args:
+            labels (tf.Tensor): the target word ids [batchSize]
+            logits (tf.Tensor): the decoder outputs [batchSize, inputSize] (not projected)
+        Return:
+            tf.Tensor: the loss of each target [batchSize]
+        """
+        ranks = tf.gather(self.rankOfId, labels)
+        headLogProbs = tf.nn.log_softmax(tf.matmul(logits, self.headW) + self.headB)
+        headTargets = ranks
+        for i in range(self.nbClusters):  # The rare words are replaced by their cluster in the head
+            headTargets = tf.where(ranks >= self.cutoffs[i], tf.fill(tf.shape(ranks), self.headSize + i), headTargets)
+        indices = tf.range(tf.shape(ranks)[0])
+        losses = -tf.gather_nd(headLogProbs, tf.stack([indices, headTargets], axis=1))
+
+        for i in range(self.nbClusters):
+            inCluster = tf.where(tf.logical_and(ranks >= self.cutoffs[i], ranks < self.cutoffs[i + 1]))[:, 0]
+            inCluster = tf.cast(inCluster, tf.int32)
+            tailLogProbs = self._tailLogProbs(i, tf.gather(logits, inCluster))
+            tailTargets = tf.gather(ranks, inCluster) - self.cutoffs[i]
+            tailLosses = -tf.gather_nd(tailLogProbs, tf.stack([tf.range(tf.shape(inCluster)[0]), tailTargets], axis=1))
+            losses += tf.scatter_nd(tf.expand_dims(inCluster, 1), tailLosses, tf.shape(losses))
+        return losses
+
+    def logProbs(self, inputs):
+        """ Log probabilities of all the words (used for the decoding)
+        Args:
+            inputs (tf.Tensor): the decoder outputs [batchSize, inputSize]
+        Return:
+            tf.Tensor: the log probabilities [batchSize, vocabularySize], in the word ids order
+        """
+        headLogProbs = tf.nn.log_softmax(tf.matmul(inputs, self.headW) + self.headB)
+        byRank = [headLogProbs[:, :self.headSize]]
+        for i in range(self.nbClusters):
+            clusterLogProb = headLogProbs[:, self.headSize + i:self.headSize + i + 1]
+            byRank.append(clusterLogProb + self._tailLogProbs(i, inputs))
+        return tf.gather(tf.concat(byRank, axis=1), self.rankOfId, axis=1)
+
+
 class Model:
     """
      实现seq2seq 模型
@@ -66,6 +155,10 @@ class Model:
         2 LTSM layers
     """
 
+    # Recurrent cells: the basic LSTM (many small ops per step), the fused LSTM kernel (one op per step, faster on CPU)
+    # and the GRU. The variables have different names, so a checkpoint can only be restored with its cell type
+    CELL_TYPES = ['basic', 'block', 'gru']
+
     def __init__(self, args, textData):
         """
         Args:
@@ -85,11 +178,46 @@ class Model:
         self.decoderTargets = None
         self.decoderWeights = None  # Adjust the learning to the target sentence size
 
+        # Input pipeline (training only, if --inputPipeline), replace the placeholders above
+        self.samplesEncoder = None  # The precomputed samples, fed once per epoch when initializing the iterator
+        self.samplesDecoder = None
+        self.iterator = None
+
+        self.keepProb = None  # Dropout keep probability (training only, 1.0 when evaluating the validation set)
+
         # Main operators
         self.lossFct = None
         self.optOp = None
+        self.batchStats = None  # Batch size and number of real (not padding) tokens of the training batch
+
+        # Gradient accumulation (if --accumulateSteps > 1), optOp applies the mean of the accumulated gradients
+        self.accumulators = None  # One per trainable variable (not saved with the checkpoints)
+        self.accumulatedBatches = None  # Number of mini-batches in the accumulators
+        self.accumulateOp = None  # Add the gradients of the batch to the accumulators, without update
+        self.accumulatorsInit = None
+
+        # Data-parallel training (see chatbot/distributed.py)
+        self.globalStep = None  # Number of updates of the shared variables
+        self.globalStepUpdated = None  # Value of the global step once the update of the batch is applied
+        self.syncOptimizer = None  # Aggregate the gradients of all the workers (if --syncReplicas)
+        self.syncInitTokens = None
+        self.syncQueueRunner = None
         self.outputs = None  # Outputs of the network, list of probability for each words
 
+        # Step by step decoding (testing only), the encoder and decoder are run separately
+        self.encoderStateIn = None  # Initial state of the encoder (zero by default, the previous turns in context mode)
+        self.encoderLengths = None  # Number of encoder steps run for each sequence (all by default, see stepEncoder)
+        self.encoderState = None  # Final state of the encoder (initial state of the decoder)
+        self.stepInputs = None  # Previous predicted word for each hypothesis
+        self.stepStateIn = None  # Decoder state before the step (nested structure of placeholders)
+        self.stepStateOut = None  # Decoder state after the step
+        self.stepTopK = None  # Number of candidates to return for each hypothesis
+        self.stepLogProbs = None  # Log probabilities of the best candidates
+        self.stepIds = None  # Word ids of the best candidates
+        self.stepShortlist = None  # Candidate words of the output projection (None with the adaptive softmax)
+        self.stepShortlistLogProbs = None  # Same as stepLogProbs, but restricted to the shortlist
+        self.stepShortlistIds = None
+
         # Construct the graphs
         self.buildNetwork()
 
@@ -102,11 +230,21 @@ class Model:
 
         # Parameters of sampled softmax (needed for attention mechanism and a large vocabulary size)
         outputProjection = None
-
+        adaptiveSoftmax = None
+        outputSize = self.args.numProj or self.args.hiddenSize  # Size of the cell outputs (projected LSTM)
+
+        if self.args.adaptiveSoftmax:  # Cheaper projection for the rare words, at training and inference
+            adaptiveSoftmax = AdaptiveSoftmax(
+                outputSize,
+                self.textData.getFrequencyRanking(),
+                self.args.adaptiveSoftmax,
+                scope='adaptive_softmax',
+                dtype=self.dtype
+            )
         # Sampled softmax only makes sense if we sample less than vocabulary size.
-        if 0 < self.args.softmaxSamples < self.textData.getVocabularySize():
+        elif 0 < self.args.softmaxSamples < self.textData.getVocabularySize():
             outputProjection = ProjectionOp(
-                (self.textData.getVocabularySize(), self.args.hiddenSize),
+                (self.textData.getVocabularySize(), outputSize),
                 scope='softmax_projection',
                 dtype=self.dtype
             )
@@ -130,18 +268,35 @@ class Model:
                         self.textData.getVocabularySize()),  # The number of classes
                     self.dtype)
 
+        if not self.args.test:
+            self.keepProb = tf.placeholder_with_default(self.args.dropout, [], name='keepProb')
+
         # Creation of the rnn cell
         def create_rnn_cell():
-            # todo 可以改成不同的网络结构
-            encoDecoCell = tf.contrib.rnn.BasicLSTMCell(  # Or GRUCell, LSTMCell(args.hiddenSize)
-                self.args.hiddenSize,
-            )
+            # 不同的网络结构
+            if self.args.cellType == 'gru':
+                encoDecoCell = tf.contrib.rnn.GRUCell(
+                    self.args.hiddenSize,
+                )
+            elif self.args.cellType == 'block':  # Same equations and gate order as BasicLSTMCell
+                encoDecoCell = tf.contrib.rnn.LSTMBlockCell(
+                    self.args.hiddenSize,
+                )
+            elif self.args.numProj:  # The output and the recurrent state h are projected into a smaller space
+                encoDecoCell = tf.contrib.rnn.LSTMCell(
+                    self.args.hiddenSize,
+                    num_proj=self.args.numProj
+                )
+            else:
+                encoDecoCell = tf.contrib.rnn.BasicLSTMCell(
+                    self.args.hiddenSize,
+                )
 
-            if not self.args.test:  # TODO: Should use a placeholder instead
+            if not self.args.test:
                 encoDecoCell = tf.contrib.rnn.DropoutWrapper(
                     encoDecoCell,
                     input_keep_prob=1.0,
-                    output_keep_prob=self.args.dropout
+                    output_keep_prob=self.keepProb
                 )
             return encoDecoCell
 
@@ -151,42 +306,90 @@ class Model:
 
         # Network input (placeholders)
         # Batch size * sequence length * input dim  这个是
-        with tf.name_scope('placeholder_encoder'):
-            self.encoderInputs  = [tf.placeholder(tf.int32,   [None, ]) for _ in range(self.args.maxLengthEnco)]
+        if self.args.inputPipeline and not self.args.test:
+            self.buildInputPipeline()
+        else:
+            with tf.name_scope('placeholder_encoder'):
+                self.encoderInputs  = [tf.placeholder(tf.int32,   [None, ]) for _ in range(self.args.maxLengthEnco)]
 
-        with tf.name_scope('placeholder_decoder'):
-            self.decoderInputs  = [tf.placeholder(tf.int32,   [None, ], name='inputs') for _ in range(self.args.maxLengthDeco)]
+            with tf.name_scope('placeholder_decoder'):
+                self.decoderInputs  = [tf.placeholder(tf.int32,   [None, ], name='inputs') for _ in range(self.args.maxLengthDeco)]
 
-            # Same sentence length for input and output (Right ?) 根据实际情况进行调整，暂时不做处理
-            self.decoderTargets = [tf.placeholder(tf.int32,   [None, ], name='targets') for _ in range(self.args.maxLengthDeco)]
-            self.decoderWeights = [tf.placeholder(tf.float32, [None, ], name='weights') for _ in range(self.args.maxLengthDeco)]
+                # Same sentence length for input and output (Right ?) 根据实际情况进行调整，暂时不做处理
+                self.decoderTargets = [tf.placeholder(tf.int32,   [None, ], name='targets') for _ in range(self.args.maxLengthDeco)]
+                self.decoderWeights = [tf.placeholder(tf.float32, [None, ], name='weights') for _ in range(self.args.maxLengthDeco)]
 
         # Define the network
         # Here we use an embedding model, it takes integer as input and convert them into word vector for
         # better word representation
-        decoderOutputs, states = tf.contrib.legacy_seq2seq.embedding_rnn_seq2seq(
-            self.encoderInputs,  # List<[batch=?, inputDim=1]>, list of size args.maxLength
-            self.decoderInputs,  # For training, we force the correct output (feed_previous=False)
-            encoDecoCell,
-            self.textData.getVocabularySize(),
-            self.textData.getVocabularySize(),  # Both encoder and decoder have the same number of class
-            embedding_size=self.args.embeddingSize,  # Dimension of each word 每一个单词的维度
-            output_projection=outputProjection.getWeights() if outputProjection else None,
-            feed_previous=bool(self.args.test),  # When we test (self.args.test), we use previous output as next input (feed_previous)
-        )
-        # y = a + b;
+        # Equivalent to tf.contrib.legacy_seq2seq.embedding_rnn_seq2seq (same variable scopes, so the checkpoints
+        # stay compatible) but we keep a reference on the encoder state and the decoder cell to be able to decode
+        # step by step at inference
+        with tf.variable_scope('embedding_rnn_seq2seq'):
+            encoderCell = tf.contrib.rnn.EmbeddingWrapper(
+                copy.deepcopy(encoDecoCell),
+                embedding_classes=self.textData.getVocabularySize(),
+                embedding_size=self.args.embeddingSize  # Dimension of each word 每一个单词的维度
+            )
+            with tf.name_scope('placeholder_encoder_state'):
+                self.encoderStateIn = tf.contrib.framework.nest.map_structure(
+                    lambda zero: tf.placeholder_with_default(zero, zero.shape, name='state'),
+                    encoderCell.zero_state(tf.shape(self.encoderInputs[0])[0], self.dtype)
+                )
+            if self.args.test:  # The state is kept unchanged after the given length (context mode)
+                with tf.name_scope('placeholder_encoder_lengths'):
+                    self.encoderLengths = tf.placeholder_with_default(
+                        tf.fill([tf.shape(self.encoderInputs[0])[0]], self.args.maxLengthEnco),
+                        [None],
+                        name='lengths'
+                    )
+            _, self.encoderState = tf.contrib.rnn.static_rnn(
+                encoderCell,
+                self.encoderInputs,  # List<[batch=?, inputDim=1]>, list of size args.maxLength
+                initial_state=self.encoderStateIn,
+                dtype=self.dtype,
+                sequence_length=self.encoderLengths
+            )
 
-        # TODO: When the LSTM hidden size is too big,
-        #  we should project the LSTM output into a smaller space (4086 => 2046): Should speed up
-        # training and reduce memory usage. Other solution, use sampling softmax
+            decoderCell = encoDecoCell
+            if not outputProjection and not adaptiveSoftmax:
+                decoderCell = tf.contrib.rnn.OutputProjectionWrapper(decoderCell, self.textData.getVocabularySize())
+            if adaptiveSoftmax:  # Same as embedding_rnn_decoder, but the previous output is projected by the adaptive softmax
+                with tf.variable_scope('embedding_rnn_decoder'):
+                    embedding = tf.get_variable('embedding', [self.textData.getVocabularySize(), self.args.embeddingSize])
+                    loopFunction = None
+                    if self.args.test:
+                        def loopFunction(prev, _):
+                            return tf.nn.embedding_lookup(embedding, tf.argmax(adaptiveSoftmax.logProbs(prev), 1))
+                    decoderOutputs, states = tf.contrib.legacy_seq2seq.rnn_decoder(
+                        [tf.nn.embedding_lookup(embedding, decoderInput) for decoderInput in self.decoderInputs],
+                        self.encoderState,
+                        decoderCell,
+                        loop_function=loopFunction
+                    )
+            else:
+                decoderOutputs, states = tf.contrib.legacy_seq2seq.embedding_rnn_decoder(
+                    self.decoderInputs,  # For training, we force the correct output (feed_previous=False)
+                    self.encoderState,
+                    decoderCell,
+                    self.textData.getVocabularySize(),  # Both encoder and decoder have the same number of class
+                    embedding_size=self.args.embeddingSize,
+                    output_projection=outputProjection.getWeights() if outputProjection else None,
+                    feed_previous=bool(self.args.test),  # When we test (self.args.test), we use previous output as next input (feed_previous)
+                )
+        # y = a + b;
 
         # For testing only
         if self.args.test:
-            if not outputProjection:
+            if adaptiveSoftmax:
+                self.outputs = [adaptiveSoftmax.logProbs(output) for output in decoderOutputs]
+            elif not outputProjection:
                 self.outputs = decoderOutputs
             else:
                 self.outputs = [outputProjection(output) for output in decoderOutputs]
 
+            self.buildStepDecoder(encoDecoCell, outputProjection, adaptiveSoftmax)
+
             # TODO: Attach a summary to visualize the output
 
         # For training only
@@ -197,7 +400,7 @@ class Model:
                 self.decoderTargets,
                 self.decoderWeights,
                 self.textData.getVocabularySize(),
-                softmax_loss_function= sampledSoftmax if outputProjection else None  # If None, use default SoftMax
+                softmax_loss_function=adaptiveSoftmax.loss if adaptiveSoftmax else sampledSoftmax if outputProjection else None  # If None, use default SoftMax
             )
             tf.summary.scalar('loss', self.lossFct)  # Keep track of the cost
 
@@ -208,13 +411,170 @@ class Model:
                 beta2=0.999,
                 epsilon=1e-08
             )
-            self.optOp = opt.minimize(self.lossFct)
+            if self.args.clusterSpec:
+                # Not a global variable, so it is not saved and the checkpoints stay compatible with the single
+                # process training (initialized by the chief to the restored step, see distributed.initWorker)
+                self.globalStep = tf.Variable(0, trainable=False, dtype=tf.int64, name='global_step', collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                if self.args.syncReplicas:
+                    opt = tf.train.SyncReplicasOptimizer(
+                        opt,
+                        replicas_to_aggregate=self.args.numWorkers,
+                        total_num_replicas=self.args.numWorkers
+                    )
+                    self.syncOptimizer = opt
+            if self.args.accumulateSteps > 1:
+                self.buildAccumulation(opt)
+            else:
+                self.optOp = opt.minimize(self.lossFct, global_step=self.globalStep)
+            if self.syncOptimizer:
+                self.syncInitTokens = self.syncOptimizer.get_init_tokens_op()
+                self.syncQueueRunner = self.syncOptimizer.get_chief_queue_runner()
+            if self.globalStep is not None:  # Also counts the updates of the other workers
+                with tf.control_dependencies([self.optOp]):
+                    self.globalStepUpdated = self.globalStep.read_value()
+
+            with tf.name_scope('batch_stats'):  # For the throughput instrumentation
+                encoderTokens = tf.count_nonzero(tf.not_equal(tf.stack(self.encoderInputs), self.textData.padToken))
+                decoderTokens = tf.reduce_sum(tf.stack(self.decoderWeights))
+                self.batchStats = (
+                    tf.shape(self.encoderInputs[0])[0],
+                    tf.cast(encoderTokens, tf.float32) + decoderTokens
+                )
+
+    def buildAccumulation(self, opt):
+        """ Create the operators of the gradient accumulation: the micro-batches run accumulateOp, the last one
+        runs optOp, which also accumulates its gradients, then applies their mean and resets the accumulators
+        The mean is over the mini-batches really accumulated (fewer than accumulateSteps for the first update after a
+        restart in the middle of a cycle, the accumulators are not restored)
+        Args:
+            opt (tf.train.Optimizer): the optimizer
+        """
+        gradsAndVars = [(grad, var) for grad, var in opt.compute_gradients(self.lossFct) if grad is not None]
+        with tf.name_scope('accumulation'):
+            self.accumulators = [
+                tf.Variable(
+                    tf.zeros(var.shape, var.dtype.base_dtype),
+                    trainable=False,
+                    collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                    name='accumulator'
+                )
+                for _, var in gradsAndVars
+            ]
+            self.accumulatedBatches = tf.Variable(
+                0.0,
+                trainable=False,
+                collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                name='accumulated_batches'
+            )
+            self.accumulatorsInit = tf.variables_initializer(self.accumulators + [self.accumulatedBatches])
+
+            accumulateOps = [tf.assign_add(self.accumulatedBatches, 1.0)]
+            for accumulator, (grad, _) in zip(self.accumulators, gradsAndVars):
+                if isinstance(grad, tf.IndexedSlices):  # Embeddings: only the rows of the words of the batch
+                    accumulateOps.append(tf.scatter_add(accumulator, grad.indices, grad.values))
+                else:
+                    accumulateOps.append(tf.assign_add(accumulator, grad))
+            self.accumulateOp = tf.group(*accumulateOps)
+
+            with tf.control_dependencies([self.accumulateOp]):  # The values are read after the last micro-batch
+                nbBatches = self.accumulatedBatches.read_value()
+                meanGrads = [accumulator.read_value() / nbBatches for accumulator in self.accumulators]
+            applyOp = opt.apply_gradients(
+                [(grad, var) for grad, (_, var) in zip(meanGrads, gradsAndVars)],
+                global_step=self.globalStep
+            )
+            with tf.control_dependencies([applyOp]):
+                self.optOp = tf.group(
+                    self.accumulatedBatches.assign(0.0),
+                    *[accumulator.assign(tf.zeros_like(accumulator)) for accumulator in self.accumulators]
+                )
+
+    def buildInputPipeline(self):
+        """ Create the training inputs from a tf.data pipeline instead of placeholders
+        The samples are given once per epoch (see TextData.getSampleArrays) in the order of the epoch, then completed
+        (targets and weights) and batched by TensorFlow, so the training step does not need any feed_dict
+        """
+        padToken = self.textData.padToken
+
+        def completeSample(encoderSeqs, decoderSeqs):
+            if self.args.autoEncode:  # Pick the question or the answer
+                k = tf.random_uniform([], maxval=2, dtype=tf.int32)
+            else:
+                k = 0
+            encoderSeq = encoderSeqs[k]
+            decoderSeq = decoderSeqs[k]
+            targetSeq = tf.concat([decoderSeq[1:], [padToken]], axis=0)  # Same as decoder, but shifted to the left (ignore the <go>)
+            weights = tf.cast(tf.not_equal(targetSeq, padToken), tf.float32)
+            return encoderSeq, decoderSeq, targetSeq, weights
+
+        with tf.name_scope('input_pipeline'):
+            self.samplesEncoder = tf.placeholder(tf.int32, [None, None, self.args.maxLengthEnco], name='encoder')
+            self.samplesDecoder = tf.placeholder(tf.int32, [None, None, self.args.maxLengthDeco], name='decoder')
+
+            dataset = tf.data.Dataset.from_tensor_slices((self.samplesEncoder, self.samplesDecoder))
+            dataset = dataset.map(completeSample, num_parallel_calls=self.args.pipelineThreads)
+            dataset = dataset.batch(self.args.batchSize)
+            dataset = dataset.prefetch(2)  # The next batches are prepared while the network is trained
+            self.iterator = dataset.make_initializable_iterator()
+
+            encoderSeqs, decoderSeqs, targetSeqs, weights = self.iterator.get_next()
+            # Same format as the placeholders: one tensor for each time step
+            self.encoderInputs  = tf.unstack(encoderSeqs, num=self.args.maxLengthEnco, axis=1)
+            self.decoderInputs  = tf.unstack(decoderSeqs, num=self.args.maxLengthDeco, axis=1)
+            self.decoderTargets = tf.unstack(targetSeqs,  num=self.args.maxLengthDeco, axis=1)
+            self.decoderWeights = tf.unstack(weights,     num=self.args.maxLengthDeco, axis=1)
+
+    def buildStepDecoder(self, decoderCell, outputProjection, adaptiveSoftmax=None):
+        """ Create the operators to run the decoder one step at a time
+        The decoder cell has already been built by the unrolled decoder, so the step reuse the same weights.
+        Args:
+            decoderCell (RNNCell): the decoder cell (without the output projection)
+            outputProjection (ProjectionOp): the softmax projection, None if the projection is done by the decoder cell
+            adaptiveSoftmax (AdaptiveSoftmax): the output layer, if used instead of the projection
+        """
+        wordRows = False  # If True, W contains one row per word (transposed in the product)
+        if adaptiveSoftmax:
+            W, b = None, None
+        elif outputProjection:  # Use the stored matrix, never the transposed copy (transposed again at each step)
+            W, b = outputProjection.W_t, outputProjection.b
+            wordRows = True
+        else:  # Projection added by the OutputProjectionWrapper
+            with tf.variable_scope('embedding_rnn_seq2seq/embedding_rnn_decoder/rnn_decoder/output_projection_wrapper', reuse=True):
+                W = tf.get_variable('kernel')
+                b = tf.get_variable('bias')
+        with tf.variable_scope('embedding_rnn_seq2seq/embedding_rnn_decoder', reuse=True):
+            embedding = tf.get_variable('embedding')
+
+        with tf.name_scope('step_decoder'):
+            self.stepInputs = tf.placeholder(tf.int32, [None, ], name='inputs')
+            self.stepStateIn = tf.contrib.framework.nest.map_structure(
+                lambda size: tf.placeholder(self.dtype, [None, size], name='state'),
+                decoderCell.state_size
+            )
+            self.stepTopK = tf.placeholder_with_default(1, [], name='top_k')
+
+            output, self.stepStateOut = decoderCell(tf.nn.embedding_lookup(embedding, self.stepInputs), self.stepStateIn)
+            if adaptiveSoftmax:
+                logProbs = adaptiveSoftmax.logProbs(output)
+            else:
+                logProbs = tf.nn.log_softmax(tf.matmul(output, W, transpose_b=wordRows) + b)
+            self.stepLogProbs, self.stepIds = tf.nn.top_k(logProbs, k=self.stepTopK)
+
+            # Only project on the candidate words (the probabilities are normalized over the shortlist). Not available
+            # with the adaptive softmax, whose clusters are already cheaper than the full projection (see Chatbot.main)
+            if not adaptiveSoftmax:
+                self.stepShortlist = tf.placeholder(tf.int32, [None, ], name='shortlist')
+                shortlistW = tf.gather(W, self.stepShortlist, axis=0 if wordRows else 1)
+                shortlistLogits = tf.matmul(output, shortlistW, transpose_b=wordRows) + tf.gather(b, self.stepShortlist)
+                self.stepShortlistLogProbs, shortlistIndices = tf.nn.top_k(tf.nn.log_softmax(shortlistLogits), k=self.stepTopK)
+                self.stepShortlistIds = tf.gather(self.stepShortlist, shortlistIndices)
 
     def step(self, batch):
         """ Forward/training step operation.
         Does not perform run on itself but just return the operators to do so. Those have then to be run
         Args:
-            batch (Batch): Input data on testing mode, input and target on output mode
+            batch (Batch): Input data on testing mode, input and target on output mode (unused when training with
+                the input pipeline)
         Return:
             (ops), dict: A tuple of the (training, loss) operators or (outputs,) in testing mode with the associated feed dictionary
         """
@@ -223,7 +583,9 @@ class Model:
         feedDict = {}
         ops = None
 
-        if not self.args.test:  # Training 训练过程
+        if not self.args.test and self.args.inputPipeline:  # Training, the inputs come from the iterator
+            ops = (self.optOp, self.lossFct)
+        elif not self.args.test:  # Training 训练过程
             for i in range(self.args.maxLengthEnco):
                 feedDict[self.encoderInputs[i]]  = batch.encoderSeqs[i]
             for i in range(self.args.maxLengthDeco):
@@ -241,3 +603,91 @@ class Model:
 
         # Return one pass operator
         return ops, feedDict
+
+    def stepEvaluate(self, batch):
+        """ Evaluation operation (training only): loss of the training graph without dropout nor update
+        The inputs are fed even with the input pipeline (the iterator is not consumed)
+        Args:
+            batch (Batch): Input and target data
+        Return:
+            (ops), dict: A tuple containing the loss operator with the associated feed dictionary
+        """
+        feedDict = {self.keepProb: 1.0}
+        for i in range(self.args.maxLengthEnco):
+            feedDict[self.encoderInputs[i]]  = batch.encoderSeqs[i]
+        for i in range(self.args.maxLengthDeco):
+            feedDict[self.decoderInputs[i]]  = batch.decoderSeqs[i]
+            feedDict[self.decoderTargets[i]] = batch.targetSeqs[i]
+            feedDict[self.decoderWeights[i]] = batch.weights[i]
+
+        return (self.lossFct,), feedDict
+
+    def initInputPipeline(self, sampleArrays, order):
+        """ Start a new epoch of the input pipeline (training only, with --inputPipeline)
+        Args:
+            sampleArrays (np.array, np.array): the encoder and decoder samples (see TextData.getSampleArrays)
+            order (list<int>): the samples of the epoch, in order (see TextData.getEpochOrder), eventually without the
+                ones already trained
+        Return:
+            (ops), dict: A tuple containing the iterator initializer with the associated feed dictionary
+        """
+        feedDict = {
+            self.samplesEncoder: sampleArrays[0][order],
+            self.samplesDecoder: sampleArrays[1][order],
+        }
+        return (self.iterator.initializer,), feedDict
+
+    def stepEncoder(self, batch, initialState=None):
+        """ Encoding operation for the step by step decoding (testing only)
+        Args:
+            batch (Batch): Input data (the encoder sequences)
+            initialState: if set, the encoder continues from this state (ex: the final state of the previous turn)
+        Return:
+            (ops), dict: A tuple containing the encoder final state operator with the associated feed dictionary
+        """
+        feedDict = {}
+        encoderSeqs = batch.encoderSeqs
+        if initialState is not None:
+            feedDict[self.encoderStateIn] = initialState
+            if self.encoderLengths is not None:  # Only run the real words (training never saw padding after a context)
+                encoderSeqs, feedDict[self.encoderLengths] = self._removeLeftPadding(encoderSeqs)
+        for i in range(self.args.maxLengthEnco):
+            feedDict[self.encoderInputs[i]] = encoderSeqs[i]
+        return (self.encoderState,), feedDict
+
+    def _removeLeftPadding(self, encoderSeqs):
+        """ Move the padding of the encoder inputs after the words
+        Args:
+            encoderSeqs (list<list<int>>): the encoder inputs (as formatted in Batch.encoderSeqs, left padding)
+        Return:
+            np.array, np.array: the inputs with the padding at the end and the number of words of each sequence
+        """
+        encoderSeqs = np.asarray(encoderSeqs)
+        isWord = encoderSeqs != self.textData.padToken
+        starts = np.where(isWord.any(axis=0), isWord.argmax(axis=0), len(encoderSeqs))  # First word of each sequence
+        lengths = len(encoderSeqs) - starts
+        rightPadded = np.full_like(encoderSeqs, self.textData.padToken)
+        for j, start in enumerate(starts):
+            rightPadded[:lengths[j], j] = encoderSeqs[start:, j]
+        return rightPadded, lengths
+
+    def stepDecoder(self, inputs, state, topK=1, shortlist=None):
+        """ Single decoding step (testing only)
+        Args:
+            inputs (np.array): the previous word ids, one for each hypothesis
+            state: the previous decoder state (as returned by the encoder or a previous step)
+            topK (int): number of candidates returned for each hypothesis
+            shortlist (list<int>): if set, only those words are candidates (faster projection)
+        Return:
+            (ops), dict: A tuple of the (log probabilities, word ids, next state) operators with the associated feed
+            dictionary
+        """
+        feedDict = {
+            self.stepInputs: inputs,
+            self.stepStateIn: state,
+            self.stepTopK: topK,
+        }
+        if shortlist is not None:
+            feedDict[self.stepShortlist] = shortlist
+            return (self.stepShortlistLogProbs, self.stepShortlistIds, self.stepStateOut), feedDict
+        return (self.stepLogProbs, self.stepIds, self.stepStateOut), feedDict
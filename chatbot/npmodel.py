@@ -0,0 +1,483 @@
+"""
+Pure NumPy implementation of the inference
+
+不依赖 tensorflow 的推理实现（只使用 numpy）
+
+The weights are exported from a trained checkpoint by the chatbot (`main.py --exportNumpy`) into the model directory
+(next to model.ckpt). The NumpyChatbot can then answer the questions without TensorFlow, which makes the web server
+lighter and faster to start.
+
+Warning: This module should not import tensorflow
+"""
+
+import argparse
+import collections
+import configparser
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+
+from chatbot import decoding
+from chatbot.textdata import TextData
+
+
+LSTMStateTuple = collections.namedtuple('LSTMStateTuple', ('c', 'h'))  # Same structure as the tensorflow state
+
+WEIGHTS_FILENAME = 'model.npz'
+WEIGHTS_MMAP_DIRNAME = 'model-mmap'  # Same weights, one .npy file per array (can be memory-mapped), one directory per version
+VOCABULARY_FILENAME = 'vocab.pkl'
+
+QUANTIZATION_CHOICES = ['none', 'float16', 'int8']
+QUANTIZED_WEIGHTS = ['encoder/embedding', 'decoder/embedding', 'projection/W']  # The vocabulary sized matrices
+SCALE_SUFFIX = '/scale'
+PROJECTION_BLOCK_SIZE = 4096  # Columns of the quantized projection converted to float32 at once
+
+
+def weightsFromCheckpoint(variables):
+    """ Convert the checkpoint variables into the names used by the NumPy model
+    The training variables (optimizer slots,...) are ignored.
+    Args:
+        variables (dict<str, np.array>): the checkpoint variables with their tensorflow name
+    Return:
+        dict<str, np.array>: the weights of the NumPy model
+    """
+    weights = {}
+    for name, value in variables.items():
+        if 'Adam' in name or 'beta1_power' in name or 'beta2_power' in name:
+            continue
+
+        if '/rnn/embedding_wrapper/' in name:
+            part = 'encoder'
+        elif '/embedding_rnn_decoder/' in name:
+            part = 'decoder'
+        else:
+            part = None
+
+        cellMatch = re.search(r'/cell_(\d+)/[^/]+/(.+)$', name)  # Ex: .../multi_rnn_cell/cell_0/basic_lstm_cell/kernel, .../gru_cell/gates/kernel
+        if part and cellMatch:
+            weights['{}/cell_{}/{}'.format(part, cellMatch.group(1), cellMatch.group(2))] = value
+        elif part and name.endswith('/embedding'):
+            weights[part + '/embedding'] = value
+        elif name.endswith('output_projection_wrapper/kernel'):
+            weights['projection/W'] = value
+        elif name.endswith('output_projection_wrapper/bias'):
+            weights['projection/b'] = value
+        elif name == 'weights_softmax_projection/weights':  # Sampled softmax: stored as [vocab, hidden]
+            weights['projection/W'] = value.T
+        elif name == 'weights_softmax_projection/bias':
+            weights['projection/b'] = value
+    return weights
+
+
+def quantizeWeights(weights, quantization):
+    """ Post-training quantization of the vocabulary sized matrices (embeddings and output projection)
+    With int8, each row of the embeddings (and each column of the projection, so each word) has its own scale, saved
+    with the '/scale' suffix.
+    Args:
+        weights (dict<str, np.array>): the float32 weights
+        quantization (str): one of QUANTIZATION_CHOICES
+    Return:
+        dict<str, np.array>: the quantized weights
+    """
+    weights = dict(weights)
+    if quantization == 'none':
+        return weights
+
+    for name in QUANTIZED_WEIGHTS:
+        value = weights[name]
+        if quantization == 'float16':
+            weights[name] = value.astype(np.float16)
+        elif quantization == 'int8':
+            axis = 0 if name == 'projection/W' else 1  # The projection is [hidden, vocab]
+            scale = np.abs(value).max(axis=axis, keepdims=True) / 127.0
+            scale[scale == 0] = 1.0
+            weights[name] = np.round(value / scale).astype(np.int8)
+            weights[name + SCALE_SUFFIX] = scale.flatten().astype(np.float32)
+        else:
+            raise ValueError('Unknown quantization: {}'.format(quantization))
+    return weights
+
+
+def dequantizeWeights(weights):
+    """ Convert the quantized matrices back to float32 (inverse of quantizeWeights, up to the rounding)
+    NumPy has no int8/float16 matrix product, so the quantized weights are converted at each use otherwise.
+    Args:
+        weights (dict<str, np.array>): the weights, quantized or not
+    Return:
+        dict<str, np.array>: the float32 weights
+    """
+    weights = dict(weights)
+    for name in QUANTIZED_WEIGHTS:
+        scale = weights.pop(name + SCALE_SUFFIX, None)
+        value = weights[name].astype(np.float32)
+        if scale is not None:
+            value *= scale[np.newaxis, :] if name == 'projection/W' else scale[:, np.newaxis]
+        weights[name] = value
+    return weights
+
+
+def weightsSize(weights):
+    """ Return the memory used by the weights
+    Args:
+        weights (dict<str, np.array>): the weights
+    Return:
+        int: the size in bytes
+    """
+    return sum(value.nbytes for value in weights.values())
+
+
+def extractedWeightsDir(modelDir):
+    """ Return the directory where extractWeights puts the current version of the weights
+    """
+    weightsName = os.path.join(modelDir, WEIGHTS_FILENAME)
+    return os.path.join(modelDir, '{}-{}'.format(WEIGHTS_MMAP_DIRNAME, os.stat(weightsName).st_mtime_ns))
+
+
+def extractWeights(modelDir):
+    """ Extract the exported weights into one .npy file per array, which can be memory-mapped
+    Each version of the weights is extracted into its own directory (named after the modification time of the .npz),
+    so a new export never modifies the files still mapped by the processes serving the previous one. The directory is
+    written under a temporary name and renamed once complete.
+    Args:
+        modelDir (str): the model directory
+    Return:
+        str: the directory of the extracted weights
+    """
+    mmapDir = extractedWeightsDir(modelDir)
+    if os.path.exists(mmapDir):
+        return mmapDir
+
+    tmpDir = tempfile.mkdtemp(prefix=os.path.basename(mmapDir) + '.tmp', dir=modelDir)
+    try:
+        with np.load(os.path.join(modelDir, WEIGHTS_FILENAME)) as data:
+            for name in data.files:
+                np.save(os.path.join(tmpDir, name.replace('/', '.') + '.npy'), data[name])
+            with open(os.path.join(tmpDir, 'index.txt'), 'w') as f:
+                f.write('\n'.join(data.files))
+        os.rename(tmpDir, mmapDir)
+    except OSError:
+        if not os.path.exists(mmapDir):
+            raise
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)  # Not renamed if failed or extracted at the same time by another process
+    return mmapDir
+
+
+def removeExtractedWeights(mmapDir):
+    """ Delete the extracted weights of a previous version of the model
+    Should only be called once the processes mapping them are stopped. The extraction of the current version is kept.
+    Args:
+        mmapDir (str): the directory returned by extractWeights
+    """
+    modelDir = os.path.dirname(mmapDir)
+    try:
+        if mmapDir == extractedWeightsDir(modelDir):
+            return
+    except OSError:  # The exported weights have been removed
+        pass
+    shutil.rmtree(mmapDir, ignore_errors=True)
+
+
+def loadWeights(modelDir, mmap=False, mmapDir=None):
+    """ Load the exported weights
+    Args:
+        modelDir (str): the model directory
+        mmap (bool): if True, the arrays are memory-mapped read-only, so the processes loading the same model share the
+            same physical memory (see extractWeights)
+        mmapDir (str): the extracted weights to map (by default, the current version is extracted if needed)
+    Return:
+        dict<str, np.array>: the weights
+    """
+    if not mmap:
+        with np.load(os.path.join(modelDir, WEIGHTS_FILENAME)) as data:
+            return dict(data)
+
+    mmapDir = mmapDir or extractWeights(modelDir)
+    with open(os.path.join(mmapDir, 'index.txt'), 'r') as f:
+        names = f.read().split('\n')
+    return {name: np.load(os.path.join(mmapDir, name.replace('/', '.') + '.npy'), mmap_mode='r') for name in names}
+
+
+def sigmoid(x):
+    return 1.0 / (1.0 + np.exp(-x))
+
+
+def logSoftmax(x):
+    x = x - x.max(axis=1, keepdims=True)
+    return x - np.log(np.exp(x).sum(axis=1, keepdims=True))
+
+
+class NumpyModel:
+    """ Encoder/decoder LSTM (or GRU), equivalent to the tensorflow model in testing mode
+    The basic and block LSTM cells share the same equations, the GRU is detected from its weights
+    Warning: Not thread safe (the steps share a buffer)
+    """
+
+    def __init__(self, weights, numLayers):
+        """
+        Args:
+            weights (dict<str, np.array>): the weights as returned by weightsFromCheckpoint
+            numLayers (int): number of rnn layers
+        """
+        self.weights = weights
+        self.numLayers = numLayers
+        self.forgetBias = 1.0  # Default value of the tensorflow LSTM cells
+        self.isGru = 'encoder/cell_0/gates/kernel' in weights
+        self.projectionBuffer = None  # Float32 block of the quantized projection (see _project)
+
+    def _embed(self, part, inputs):
+        """ Embedding lookup (dequantize the selected rows if needed)
+        """
+        embedding = self.weights[part + '/embedding']
+        output = embedding[inputs].astype(np.float32)
+        scale = self.weights.get(part + '/embedding' + SCALE_SUFFIX)
+        if scale is not None:
+            output *= scale[inputs][:, np.newaxis]
+        return output
+
+    def _project(self, output, projection=None):
+        """ Project the decoder output on the vocabulary space
+        A quantized matrix is converted to float32 by blocks of columns (into a buffer reused by all the steps), so
+        the whole matrix is never converted at once. The scales are applied on the result.
+        Args:
+            output (np.array): the decoder output
+            projection (tuple): the (W, b, scale) weights to use (default to the full vocabulary)
+        """
+        W, b, scale = projection or self._getProjection()
+        if W.dtype == np.float32:
+            return output @ W + b
+
+        if self.projectionBuffer is None:
+            self.projectionBuffer = np.empty((W.shape[0], PROJECTION_BLOCK_SIZE), np.float32)
+        logits = np.empty((output.shape[0], W.shape[1]), np.float32)
+        for start in range(0, W.shape[1], PROJECTION_BLOCK_SIZE):
+            end = min(start + PROJECTION_BLOCK_SIZE, W.shape[1])
+            block = self.projectionBuffer[:, :end - start]
+            np.copyto(block, W[:, start:end])
+            logits[:, start:end] = output @ block
+        if scale is not None:
+            logits *= scale
+        return logits + b
+
+    def _getProjection(self, shortlist=None):
+        """ Return the output projection weights, eventually restricted to the shortlist
+        Return:
+            tuple: the (W, b, scale) weights, scale being None if the weights are not quantized to int8
+        """
+        W = self.weights['projection/W']
+        b = self.weights['projection/b']
+        scale = self.weights.get('projection/W' + SCALE_SUFFIX)
+        if shortlist is not None:
+            W = W[:, shortlist]
+            b = b[shortlist]
+            scale = scale[shortlist] if scale is not None else None
+        return W, b, scale
+
+    def _lstm(self, part, layer, inputs, state):
+        """ Single step of a BasicLSTMCell (or of a LSTMCell with num_proj, if the projection weights exist)
+        """
+        gates = np.concatenate([inputs, state.h], axis=1) @ self.weights['{}/cell_{}/kernel'.format(part, layer)]
+        gates += self.weights['{}/cell_{}/bias'.format(part, layer)]
+        i, j, f, o = np.split(gates, 4, axis=1)  # Same order as tensorflow
+        c = state.c * sigmoid(f + self.forgetBias) + sigmoid(i) * np.tanh(j)
+        h = np.tanh(c) * sigmoid(o)
+        projection = self.weights.get('{}/cell_{}/projection/kernel'.format(part, layer))
+        if projection is not None:
+            h = h @ projection
+        return h, LSTMStateTuple(c, h)
+
+    def _gru(self, part, layer, inputs, state):
+        """ Single step of a GRUCell (the state is the output)
+        """
+        prefix = '{}/cell_{}/'.format(part, layer)
+        gates = np.concatenate([inputs, state], axis=1) @ self.weights[prefix + 'gates/kernel']
+        r, u = np.split(sigmoid(gates + self.weights[prefix + 'gates/bias']), 2, axis=1)  # Same order as tensorflow
+        candidate = np.concatenate([inputs, r * state], axis=1) @ self.weights[prefix + 'candidate/kernel']
+        candidate = np.tanh(candidate + self.weights[prefix + 'candidate/bias'])
+        h = u * state + (1 - u) * candidate
+        return h, h
+
+    def _cell(self, part, inputs, state):
+        """ Single step of the multi layer cell
+        Args:
+            part (str): 'encoder' or 'decoder'
+            inputs (np.array): the word ids
+            state (tuple): the state of each layer (LSTMStateTuple, or np.array for the GRU)
+        Return:
+            np.array, tuple: the output of the last layer and the new state
+        """
+        output = self._embed(part, inputs)
+        layerFct = self._gru if self.isGru else self._lstm
+        newState = []
+        for layer in range(self.numLayers):
+            output, layerState = layerFct(part, layer, output, state[layer])
+            newState.append(layerState)
+        return output, tuple(newState)
+
+    def _zeroState(self, batchSize):
+        """ Initial state of the encoder (same shapes as the tensorflow state)
+        """
+        if self.isGru:
+            hiddenSize = self.weights['encoder/cell_0/candidate/bias'].shape[0]
+            return tuple(np.zeros((batchSize, hiddenSize), np.float32) for _ in range(self.numLayers))
+        hiddenSize = self.weights['encoder/cell_0/bias'].shape[0] // 4
+        projection = self.weights.get('encoder/cell_0/projection/kernel')
+        outputSize = projection.shape[1] if projection is not None else hiddenSize
+        return tuple(
+            LSTMStateTuple(np.zeros((batchSize, hiddenSize), np.float32), np.zeros((batchSize, outputSize), np.float32))
+            for _ in range(self.numLayers)
+        )
+
+    def encode(self, encoderSeqs):
+        """ Run the encoder
+        Args:
+            encoderSeqs (list<list<int>>): the inputs of the encoder (as formatted in Batch.encoderSeqs)
+        Return:
+            tuple: the final state of the encoder (LSTMStateTuple, or np.array for the GRU, for each layer)
+        """
+        state = self._zeroState(len(encoderSeqs[0]))
+        for inputs in encoderSeqs:
+            _, state = self._cell('encoder', np.asarray(inputs), state)
+        return state
+
+    def step(self, inputs, state, topK=1):
+        """ Single decoding step (see decoding module)
+        Args:
+            inputs (np.array): the previous word ids, one for each hypothesis
+            state (tuple): the previous decoder state
+            topK (int): number of candidates returned for each hypothesis
+        Return:
+            np.array, np.array, tuple: the log probabilities and word ids of the best candidates and
+            the next state
+        """
+        return self._step(inputs, state, topK)
+
+    def shortlistStep(self, shortlist):
+        """ Return a decoding step function which only predicts the words of the shortlist
+        The projection weights are restricted once, then reused for all the steps.
+        Args:
+            shortlist (list<int>): the candidate words
+        Return:
+            function: the decoding step (same signature as step())
+        """
+        shortlist = np.asarray(shortlist)
+        projection = self._getProjection(shortlist)
+
+        def runStep(inputs, state, topK=1):
+            logProbs, indices, state = self._step(inputs, state, topK, projection)
+            return logProbs, shortlist[indices], state
+        return runStep
+
+    def _step(self, inputs, state, topK, projection=None):
+        output, state = self._cell('decoder', inputs, state)
+        logProbs = logSoftmax(self._project(output, projection))
+        ids = np.argpartition(-logProbs, topK - 1, axis=1)[:, :topK]
+        ids = np.take_along_axis(ids, np.argsort(-np.take_along_axis(logProbs, ids, axis=1), axis=1), axis=1)
+        return np.take_along_axis(logProbs, ids, axis=1), ids, state
+
+
+class NumpyChatbot:
+    """ Chatbot answering with the NumPy model (daemon mode only)
+    """
+
+    def __init__(self, modelDir, beamSize=1, lengthPenalty=0.6, shortlistSize=0, mmap=False, mmapDir=None):
+        """ Load the model exported in the model directory
+        Args:
+            modelDir (str): the model directory (ex: save/model-server)
+            beamSize (int): number of hypothesis kept by the beam search decoder (1 uses the greedy decoding)
+            lengthPenalty (float): length normalization strength of the beam search
+            shortlistSize (int): if set, only predict among the most frequent answer words and the question words
+            mmap (bool): memory-map the weights (shared between the processes, see loadWeights), the quantized
+                weights then stay quantized in memory (otherwise they are converted to float32 once when loaded)
+            mmapDir (str): the extracted weights to map (see loadWeights)
+        """
+        self.args = self.loadArgs(modelDir)
+        self.args.beamSize = beamSize
+        self.args.lengthPenalty = lengthPenalty
+        self.args.shortlistSize = shortlistSize
+
+        self.textData = TextData(self.args, vocabularyFile=os.path.join(modelDir, VOCABULARY_FILENAME))
+        weights = loadWeights(modelDir, mmap, mmapDir)
+        if not mmap:  # The quantization only reduces the file size, the product is faster in float32
+            weights = dequantizeWeights(weights)
+        self.model = NumpyModel(weights, self.args.numLayers)
+
+    @staticmethod
+    def loadArgs(modelDir):
+        """ Restore the parameters needed for the inference from the params.ini of the model
+        Args:
+            modelDir (str): the model directory
+        Return:
+            argparse.Namespace: the parameters, similar to the one of the chatbot
+        """
+        config = configparser.ConfigParser()
+        config.read(os.path.join(modelDir, 'params.ini'))
+
+        args = argparse.Namespace()
+        args.rootDir = os.path.dirname(os.path.dirname(os.path.abspath(modelDir)))  # modelDir is rootDir/save/model-xxx
+        args.test = 'daemon'
+        args.playDataset = None
+        args.watsonMode = config['General'].getboolean('watsonMode')
+        args.autoEncode = config['General'].getboolean('autoEncode')
+        args.corpus = config['General'].get('corpus')
+        args.datasetTag = config['Dataset'].get('datasetTag')
+        args.maxLength = config['Dataset'].getint('maxLength')
+        args.filterVocab = config['Dataset'].getint('filterVocab')
+        args.vocabularySize = config['Dataset'].getint('vocabularySize')
+        args.validationRatio = config['Dataset'].getfloat('validationRatio', fallback=0.0)
+        args.numLayers = config['Network'].getint('numLayers')
+        args.maxLengthEnco = args.maxLength
+        args.maxLengthDeco = args.maxLength + 2
+        return args
+
+    def singlePredict(self, question):
+        """ Predict the sentence
+        Args:
+            question (str): the raw input sentence
+        Return:
+            list <int>: the word ids corresponding to the answer
+        """
+        batch = self.textData.sentence2enco(question)
+        if not batch:
+            return None
+
+        state = self.model.encode(batch.encoderSeqs)
+        stepFct = self.model.step
+        if self.args.shortlistSize:
+            stepFct = self.model.shortlistStep(self.textData.getShortlist(
+                self.args.shortlistSize,
+                [wordId for encoderSeq in batch.encoderSeqs for wordId in encoderSeq]
+            ))
+
+        if self.args.beamSize > 1:
+            return decoding.beamSearch(
+                stepFct,
+                state,
+                self.textData.goToken,
+                self.textData.eosToken,
+                self.args.maxLengthDeco,
+                self.args.beamSize,
+                alpha=self.args.lengthPenalty
+            )
+        return decoding.greedySearch(
+            stepFct,
+            state,
+            self.textData.goToken,
+            self.textData.eosToken,
+            self.args.maxLengthDeco
+        )[0]
+
+    def daemonPredict(self, sentence):
+        """ Return the answer to a given sentence (same as Chatbot.daemonPredict)
+        Args:
+            sentence (str): the raw input sentence
+        Return:
+            str: the human readable sentence
+        """
+        return self.textData.sequence2str(
+            self.singlePredict(sentence),
+            clean=True
+        )
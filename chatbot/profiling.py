@@ -0,0 +1,182 @@
+"""
+Training throughput instrumentation
+
+训练性能统计：每个阶段的时间，每秒样本数/词数，补齐浪费的比例
+
+The time of each stage of the training loop (batch creation, feed_dict, sess.run, summaries, checkpoints) is
+accumulated over a window of steps, then reported on the console and as TensorBoard scalars.
+
+For a finer analysis, the TimelineProfiler traces every op of a range of steps (--profileSteps).
+"""
+
+import collections
+import contextlib
+import os
+import time
+
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+
+class TrainingProfiler:
+    """ Accumulate the timings and the batch statistics of the training steps
+    """
+
+    STAGES = ['batches', 'feed', 'run', 'summary', 'checkpoint']
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """ Start a new window
+        """
+        self.startTime = time.perf_counter()
+        self.stageTimes = collections.OrderedDict((stage, 0.0) for stage in self.STAGES)
+        self.nbSteps = 0
+        self.nbSamples = 0
+        self.nbTokens = 0  # Real words (not padding) of the encoder inputs and decoder targets
+        self.nbSlots = 0  # All the positions of the batches, padding included
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """ Time the enclosed code as part of the given stage
+        Args:
+            name (str): one of STAGES
+        """
+        tic = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stageTimes[name] += time.perf_counter() - tic
+
+    def addStep(self, nbSamples, nbTokens, nbSlots):
+        """ Record a training step
+        Args:
+            nbSamples (int): batch size
+            nbTokens (int): number of non padding tokens of the batch
+            nbSlots (int): number of tokens of the batch, padding included
+        """
+        self.nbSteps += 1
+        self.nbSamples += nbSamples
+        self.nbTokens += nbTokens
+        self.nbSlots += nbSlots
+
+    def getStats(self):
+        """ Return the statistics of the current window
+        Return:
+            dict: samples/sec, tokens/sec, padding waste ratio and the time of each stage per step (in ms)
+        """
+        elapsed = max(time.perf_counter() - self.startTime, 1e-6)
+        nbSteps = max(self.nbSteps, 1)
+        stats = collections.OrderedDict()
+        stats['samplesPerSec'] = self.nbSamples / elapsed
+        stats['tokensPerSec'] = self.nbTokens / elapsed
+        stats['paddingWaste'] = 1.0 - self.nbTokens / self.nbSlots if self.nbSlots else 0.0
+        for stage, stageTime in self.stageTimes.items():
+            stats[stage + 'Ms'] = stageTime / nbSteps * 1000
+        stats['otherMs'] = (elapsed - sum(self.stageTimes.values())) / nbSteps * 1000  # Python loop, progress bar,...
+        return stats
+
+    def getSummary(self):
+        """ Return the statistics of the current window as TensorBoard scalars
+        Return:
+            tf.Summary: the summary to add to the writer
+        """
+        return tf.Summary(value=[
+            tf.Summary.Value(tag='throughput/' + name, simple_value=value) for name, value in self.getStats().items()
+        ])
+
+    def format(self):
+        """ Return the statistics of the current window as a console line
+        """
+        stats = self.getStats()
+        return '----- {:.1f} samples/s -- {:.0f} tokens/s -- padding {:.1%} -- per step: {}'.format(
+            stats['samplesPerSec'],
+            stats['tokensPerSec'],
+            stats['paddingWaste'],
+            ', '.join('{} {:.1f}ms'.format(stage, stats[stage + 'Ms']) for stage in self.STAGES + ['other'])
+        )
+
+
+class TimelineProfiler:
+    """ Trace the ops of a range of steps (training steps or predicted sentences)
+    For each traced sess.run, a Chrome trace is written in the output directory (open it with chrome://tracing), and
+    the table of the most expensive ops over all the traced runs is updated. The other steps are run normally.
+    """
+
+    TABLE_FILENAME = 'profile-ops.txt'
+
+    def __init__(self, stepRange, outputDir, topN=30):
+        """
+        Args:
+            stepRange (str): the steps to trace, 'a:b' for the steps a to b-1
+            outputDir (str): where the traces are written
+            topN (int): number of ops in the table
+        """
+        try:
+            self.start, self.end = (int(step) for step in stepRange.split(':'))
+        except ValueError:
+            raise ValueError('Wrong step range: {} (should be start:end)'.format(stepRange))
+        self.outputDir = outputDir
+        self.topN = topN
+
+        self.nbRuns = collections.Counter()  # Number of traced runs for each step
+        self.opTimes = collections.defaultdict(float)  # (node name, op type) -> total time (in microseconds)
+        self.opCounts = collections.Counter()
+
+    def getRunArgs(self, step):
+        """ Return the additional arguments of sess.run for the given step
+        Args:
+            step (int): the current step
+        Return:
+            dict: the trace options and metadata (empty if the step is not traced)
+        """
+        if not self.start <= step < self.end:
+            return {}
+        return {
+            'options': tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE),
+            'run_metadata': tf.RunMetadata(),
+        }
+
+    def addRunMetadata(self, step, runArgs):
+        """ Save the trace of a run made with getRunArgs
+        Args:
+            step (int): the traced step
+            runArgs (dict): the arguments given to sess.run (the metadata have been filled)
+        """
+        if not runArgs:
+            return
+        stepStats = runArgs['run_metadata'].step_stats
+
+        traceName = os.path.join(self.outputDir, 'timeline-{}-{}.json'.format(step, self.nbRuns[step]))
+        self.nbRuns[step] += 1
+        with open(traceName, 'w') as f:
+            f.write(timeline.Timeline(stepStats).generate_chrome_trace_format())
+
+        for deviceStats in stepStats.dev_stats:
+            for nodeStats in deviceStats.node_stats:
+                label = nodeStats.timeline_label  # Ex: 'MatMul_1 = MatMul(a, b)'
+                opType = label.split('=', 1)[1].split('(', 1)[0].strip() if '=' in label else nodeStats.node_name
+                key = (nodeStats.node_name, opType)
+                self.opTimes[key] += nodeStats.all_end_rel_micros
+                self.opCounts[key] += 1
+        self.saveTable()
+
+    def saveTable(self):
+        """ Write the most expensive ops (aggregated over all the traced runs, by node and by op type)
+        """
+        totalTime = max(sum(self.opTimes.values()), 1)
+        typeTimes = collections.defaultdict(float)
+        for (_, opType), opTime in self.opTimes.items():
+            typeTimes[opType] += opTime
+
+        with open(os.path.join(self.outputDir, self.TABLE_FILENAME), 'w') as f:
+            f.write('Traced runs: {}\n\n'.format(sum(self.nbRuns.values())))
+            f.write('{:<30} {:>12} {:>7}\n'.format('Op type', 'Total (ms)', '%'))
+            for opType, opTime in sorted(typeTimes.items(), key=lambda x: -x[1])[:self.topN]:
+                f.write('{:<30} {:>12.2f} {:>6.1f}%\n'.format(opType, opTime / 1000, opTime / totalTime * 100))
+            f.write('\n{:<80} {:<20} {:>7} {:>12} {:>7}\n'.format('Node', 'Op type', 'Calls', 'Total (ms)', '%'))
+            for (nodeName, opType), opTime in sorted(self.opTimes.items(), key=lambda x: -x[1])[:self.topN]:
+                f.write('{:<80} {:<20} {:>7} {:>12.2f} {:>6.1f}%\n'.format(
+                    nodeName, opType, self.opCounts[(nodeName, opType)], opTime / 1000, opTime / totalTime * 100
+                ))
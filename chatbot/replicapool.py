@@ -0,0 +1,113 @@
+"""
+Pool of processes answering with the NumPy model
+
+多进程推理：每个进程一个模型副本，权重通过内存映射共享
+
+Each replica memory-maps the same exported weights (see npmodel.extractWeights), so the RAM does not grow with the
+number of replicas. Each version of the weights is extracted into its own directory, deleted when the pool is closed
+(hot reload), so a new export never modifies the files mapped by the running replicas. The questions are dispatched to the first free replica. The pool has the same daemon interface
+as the Chatbot (daemonPredict, daemonStats, daemonClose).
+
+The processes are started with the 'spawn' method (the web server process is multithreaded and may have loaded
+TensorFlow, which is not safe to fork), with a single BLAS thread each so the replicas don't oversubscribe the cores.
+
+Warning: This module should not import tensorflow
+"""
+
+import multiprocessing
+import os
+
+from chatbot import npmodel
+from chatbot.responsecache import ResponseCache
+from chatbot.textdata import TextData
+
+
+_replica = None  # The NumpyChatbot of the current worker process
+
+# Environment of the worker processes (read by the BLAS libraries when numpy is imported)
+REPLICA_ENVIRONMENT = {
+    'OMP_NUM_THREADS': '1',
+    'OPENBLAS_NUM_THREADS': '1',
+    'MKL_NUM_THREADS': '1',
+}
+
+
+def _initReplica(modelDir, mmapDir, options):
+    """ Load the model in the worker process
+    """
+    global _replica
+    _replica = npmodel.NumpyChatbot(modelDir, mmap=True, mmapDir=mmapDir, **options)
+
+
+def _replicaPredict(sentence):
+    """ Answer the question in the worker process
+    """
+    return _replica.daemonPredict(sentence)
+
+
+class ReplicaPool:
+    """ Multi-process daemon
+    """
+
+    def __init__(self, modelDir, nbReplicas, cacheSize=0, cacheTtl=0, **options):
+        """
+        Args:
+            modelDir (str): directory of the model exported with --exportNumpy
+            nbReplicas (int): number of worker processes
+            cacheSize (int): number of answers kept in the response cache (0 to deactivate)
+            cacheTtl (float): number of seconds before a cached answer expires (0 for no expiration)
+            options: the decoding options of the NumpyChatbot (beamSize, lengthPenalty, shortlistSize)
+        """
+        print('Starting {} replicas of {}...'.format(nbReplicas, modelDir))
+        # Extract the memory-mapped files once, before the workers start (all the workers map the same version, even
+        # if a new one is exported meanwhile)
+        self.mmapDir = npmodel.extractWeights(modelDir)
+
+        # The vocabulary is needed to compute the cache keys
+        self.textData = TextData(npmodel.NumpyChatbot.loadArgs(modelDir), vocabularyFile=os.path.join(modelDir, npmodel.VOCABULARY_FILENAME))
+        self.modelVersion = os.path.getmtime(os.path.join(modelDir, npmodel.WEIGHTS_FILENAME))
+        self.responseCache = ResponseCache(cacheSize, cacheTtl) if cacheSize else None
+
+        previousEnvironment = {name: os.environ.get(name) for name in REPLICA_ENVIRONMENT}
+        os.environ.update(REPLICA_ENVIRONMENT)  # Inherited by the spawned processes
+        try:
+            context = multiprocessing.get_context('spawn')
+            self.pool = context.Pool(nbReplicas, initializer=_initReplica, initargs=(modelDir, self.mmapDir, options))
+        finally:
+            for name, value in previousEnvironment.items():
+                if value is None:
+                    del os.environ[name]
+                else:
+                    os.environ[name] = value
+
+    def daemonPredict(self, sentence):
+        """ Return the answer to a given sentence (computed by one of the replicas)
+        Args:
+            sentence (str): the raw input sentence
+        Return:
+            str: the human readable sentence
+        """
+        if self.responseCache is None:
+            return self.pool.apply(_replicaPredict, (sentence,))
+
+        batch = self.textData.sentence2enco(sentence)
+        if not batch:
+            return ''
+        key = (self.modelVersion, tuple(tuple(encoderSeq) for encoderSeq in batch.encoderSeqs))
+        return self.responseCache.get(key, lambda: self.pool.apply(_replicaPredict, (sentence,)))
+
+    def daemonStats(self):
+        """ Return the statistics of the response cache (None if the cache is not used)
+        """
+        if self.responseCache is None:
+            return None
+        return self.responseCache.getStats()
+
+    def daemonClose(self):
+        """ Stop the worker processes
+        """
+        print('Closing the replicas...')
+        self.pool.terminate()
+        self.pool.join()
+        npmodel.removeExtractedWeights(self.mmapDir)  # Replaced by a new version (kept otherwise)
+        print('Replicas closed.')
@@ -0,0 +1,88 @@
+"""
+Cache of the answers computed in daemon mode
+
+缓存机器人的回答（LRU + 过期时间）
+
+The decoding is deterministic for a given model, so the frequent questions (greetings,...) don't need to be decoded
+each time.
+"""
+
+import collections
+import threading
+import time
+
+
+class ResponseCache:
+    """ Bounded LRU cache with an optional time to live
+    Thread safe (the web server can call the bot from multiple threads)
+    """
+
+    def __init__(self, maxSize, ttl=0):
+        """
+        Args:
+            maxSize (int): maximum number of answers kept
+            ttl (float): number of seconds before an answer expires (0 for no expiration)
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+
+        self.entries = collections.OrderedDict()  # key -> (answer, creation time, computation time)
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.savedTime = 0.0  # Computation time avoided by the hits (in seconds)
+
+    def get(self, key, computeFct):
+        """ Return the cached answer or compute it
+        Args:
+            key (hashable): the key of the question
+            computeFct (function): called without arguments to compute the answer on cache miss
+        Return:
+            Obj: the answer
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:  # Expired
+                del self.entries[key]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.savedTime += entry[2]
+                return entry[0]
+            self.misses += 1
+
+        tic = time.perf_counter()
+        answer = computeFct()  # Outside the lock, the other requests can still be served
+        computationTime = time.perf_counter() - tic
+
+        with self.lock:
+            self.entries[key] = (answer, time.time(), computationTime)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        return answer
+
+    def clear(self):
+        """ Remove all the answers (ex: when a new model is loaded)
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def getStats(self):
+        """ Return the cache statistics
+        Return:
+            dict: the number of hits/misses, the hit rate, the computation time saved (in seconds) and the current size
+        """
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': self.hits / requests if requests else 0.0,
+                'savedTime': self.savedTime,
+                'size': len(self.entries),
+                'maxSize': self.maxSize,
+            }
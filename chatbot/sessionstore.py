@@ -0,0 +1,99 @@
+"""
+Conversation contexts of the connected clients
+
+多轮对话：保存每个用户上一轮的编码器状态
+
+Each client keeps the encoder state at the end of its previous turn, so the next question is encoded after the
+history without running the encoder over the whole conversation again. The idle clients are evicted first when the
+store is full.
+"""
+
+import collections
+import threading
+import time
+
+import numpy as np
+
+from chatbot import decoding
+
+
+class SessionStore:
+    """ Bounded LRU store of the conversation contexts
+    Thread safe (the answers are computed on the executor threads)
+    """
+
+    def __init__(self, maxSessions, maxTurns=0, ttl=0):
+        """
+        Args:
+            maxSessions (int): maximum number of clients kept
+            maxTurns (int): number of turns after which the context is reset (0 for no limit)
+            ttl (float): number of idle seconds before a context expires (0 for no expiration)
+        """
+        self.maxSessions = maxSessions
+        self.maxTurns = maxTurns
+        self.ttl = ttl
+
+        self.sessions = collections.OrderedDict()  # client -> (context, number of turns, model version, last access)
+        self.lock = threading.Lock()
+
+        # Statistics
+        self.evictions = 0
+
+    def get(self, client, modelVersion=None):
+        """ Return the context of the client
+        Args:
+            client (str): the client id
+            modelVersion (Obj): the model which will use the context (the contexts of a previous model are dropped)
+        Return:
+            Obj, int: the context (None to start a new conversation) and the number of turns already in the context
+        """
+        with self.lock:
+            session = self.sessions.get(client)
+            if session is None:
+                return None, 0
+            context, nbTurns, version, lastAccess = session
+            if (version != modelVersion or
+                    (self.ttl and time.time() - lastAccess > self.ttl) or
+                    (self.maxTurns and nbTurns >= self.maxTurns)):
+                del self.sessions[client]
+                return None, 0
+            return context, nbTurns
+
+    def put(self, client, context, nbTurns, modelVersion=None):
+        """ Save the context of the client after a new turn
+        Args:
+            client (str): the client id
+            context (Obj): the encoder state at the end of the turn
+            nbTurns (int): number of turns in the context
+            modelVersion (Obj): the model which has computed the context
+        """
+        with self.lock:
+            self.sessions[client] = (context, nbTurns, modelVersion, time.time())
+            self.sessions.move_to_end(client)
+            while len(self.sessions) > self.maxSessions:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, client):
+        """ Forget the conversation (ex: when the client disconnect)
+        """
+        with self.lock:
+            self.sessions.pop(client, None)
+
+    def getStats(self):
+        """ Return the store statistics
+        Return:
+            dict: the number of clients, the evictions and the memory used by the contexts (in bytes)
+        """
+        with self.lock:
+            memory = 0
+            for context, _, _, _ in self.sessions.values():
+                sizes = []
+                decoding.mapState(lambda s: sizes.append(np.asarray(s).nbytes), context)
+                memory += sum(sizes)
+            return {
+                'sessions': len(self.sessions),
+                'maxSessions': self.maxSessions,
+                'evictions': self.evictions,
+                'memory': memory,
+            }
@@ -44,6 +44,8 @@ class TextData:
         ('lightweight', LightweightData),
     ])
 
+    VALIDATION_SEED = 0  # The validation split does not change between the runs
+
     @staticmethod
     def corpusChoices():
         """Return the dataset availables
@@ -52,10 +54,12 @@ class TextData:
         """
         return list(TextData.availableCorpus.keys())
 
-    def __init__(self, args):
+    def __init__(self, args, vocabularyFile=None):
         """导入所有对话
         Args:
             args: parameters of the model
+            vocabularyFile (str): if set, only the vocabulary is loaded from this file (enough for inference, the
+                training samples stay empty)
         """
         # Model parameters
         self.args = args
@@ -69,10 +73,11 @@ class TextData:
 
         print("根路径：" + basePath)
         self.fullSamplesPath = basePath + '.pkl'  # Full sentences length/vocab
-        self.filteredSamplesPath = basePath + '-length{}-filter{}-vocabSize{}.pkl'.format(
+        self.filteredSamplesPath = basePath + '-length{}-filter{}-vocabSize{}{}.pkl'.format(
             self.args.maxLength,
             self.args.filterVocab,
             self.args.vocabularySize,
+            '-valid{}'.format(self.args.validationRatio) if self.args.validationRatio else '',
         )  # Sentences/vocab filtered for this model
 
         self.padToken = -1  # Padding
@@ -81,13 +86,19 @@ class TextData:
         self.unknownToken = -1  # Word dropped from vocabulary
 
         self.trainingSamples = []  # 2d array containing each question and his answer [[input,target]]
+        self.validationSamples = []  # Held-out samples (same format), never trained on (see --validationRatio)
+        self.validationBatches = None  # Computed once, the same batches are used for every evaluation
 
         self.word2id = {}  # 单词 id 编号表 把单词转数字使用
         self.id2word = {}  # id  单词编号表  把数字转单词使用  For a rapid conversion (Warning: If replace dict by list, modify the filtering to avoid linear complexity with del)
         self.idCount = {}  # Useful to filters the words  词频统计，过滤到使用率非常低的词的时候可以使用(TODO: Could replace dict by list or use collections.Counter)
+        self.targetCount = None  # Frequency of the words in the answers (computed on demand, used for the decoder shortlist)
 
         # 载入语料
-        self.loadCorpus()
+        if vocabularyFile:
+            self.loadVocabulary(vocabularyFile)
+        else:
+            self.loadCorpus()
 
         # Plot some stats:
         self._printStats()
@@ -115,11 +126,22 @@ class TextData:
         #    print('WARNING: Ratio feature not implemented !!!')
         pass
 
-    def shuffle(self):
-        """Shuffle the training samples
+    def getEpochOrder(self, seed=None):
+        """Return the order of the training samples for an epoch
+        The training samples are not modified, so the same seed always gives the same order (used to resume an
+        interrupted epoch)
+        Args:
+            seed (int): the seed of the shuffling (if None, use the global random generator)
+        Return:
+            list<int>: the indices of the training samples
         """
         print('Shuffling the dataset...')
-        random.shuffle(self.trainingSamples)
+        order = list(range(self.getSampleSize()))
+        if seed is None:
+            random.shuffle(order)
+        else:
+            random.Random(seed).shuffle(order)
+        return order
 
     def _createBatch(self, samples):
         """Create a single batch from the list of sample. The batch size is automatically defined by the number of
@@ -203,20 +225,24 @@ class TextData:
 
         return batch
 
-    def getBatches(self):
+    def getBatches(self, seed=None, cursor=0):
         """Prepare the batches for the current epoch
+        Args:
+            seed (int): the seed of the shuffling (see getEpochOrder)
+            cursor (int): number of samples of the epoch already trained, only the batches of the following samples
+                are created
         Return:
             list<Batch>: Get a list of the batches for the next epoch
         """
-        self.shuffle()
+        order = self.getEpochOrder(seed)[cursor:]
 
         batches = []
 
         def genNextSamples():
             """ Generator over the mini-batch training samples
             """
-            for i in range(0, self.getSampleSize(), self.args.batchSize):
-                yield self.trainingSamples[i:min(i + self.args.batchSize, self.getSampleSize())]
+            for i in range(0, len(order), self.args.batchSize):
+                yield [self.trainingSamples[j] for j in order[i:i + self.args.batchSize]]
 
         # TODO: Should replace that by generator (better: by tf.queue)
 
@@ -225,6 +251,71 @@ class TextData:
             batches.append(batch)
         return batches
 
+    def getSampleArrays(self):
+        """Return the training samples as padded arrays, in the same format as the batches (one row per sample)
+        Precomputed once for the tf.data input pipeline (see Model.buildInputPipeline), which adds the targets and
+        the weights itself. With autoEncode, the two versions of each sample (question or answer used for both input
+        and output) are given and the pipeline picks one at random.
+        Return:
+            np.array, np.array: the encoder inputs [nbSamples, nbVersions, maxLengthEnco] (reversed, left padding) and
+            the decoder inputs [nbSamples, nbVersions, maxLengthDeco] (<go> answer <eos>, right padding)
+        """
+        nbVersions = 2 if self.args.autoEncode else 1
+        encoderSeqs = np.full((self.getSampleSize(), nbVersions, self.args.maxLengthEnco), self.padToken, dtype=np.int32)
+        decoderSeqs = np.full((self.getSampleSize(), nbVersions, self.args.maxLengthDeco), self.padToken, dtype=np.int32)
+        for i, sample in enumerate(self.trainingSamples):
+            if self.args.watsonMode:  # Watson mode: invert question and answer
+                sample = list(reversed(sample))
+            if self.args.autoEncode:
+                versions = [(sample[0], sample[0]), (sample[1], sample[1])]
+            else:
+                versions = [sample]
+            for k, (inputSeq, targetSeq) in enumerate(versions):
+                if inputSeq:
+                    encoderSeqs[i, k, -len(inputSeq):] = list(reversed(inputSeq))
+                decoderSeqs[i, k, :len(targetSeq) + 2] = [self.goToken] + targetSeq + [self.eosToken]
+        return encoderSeqs, decoderSeqs
+
+    def splitValidation(self, ratio):
+        """Move a fraction of the training samples to the validation set
+        The split is deterministic (fixed seed, independent of --seed), and saved with the dataset
+        Args:
+            ratio (float): fraction of the samples held out
+        """
+        nbValidation = int(len(self.trainingSamples) * ratio)
+        if not nbValidation:
+            return
+        indices = list(range(len(self.trainingSamples)))
+        random.Random(self.VALIDATION_SEED).shuffle(indices)
+        validationIndices = set(indices[:nbValidation])
+        self.validationSamples = [sample for i, sample in enumerate(self.trainingSamples) if i in validationIndices]
+        self.trainingSamples = [sample for i, sample in enumerate(self.trainingSamples) if i not in validationIndices]
+        print('Validation split: {} QA held out'.format(len(self.validationSamples)))
+
+    def shard(self, index, count):
+        """Only keep the training samples of one worker (data-parallel training)
+        All the shards have the same size, so the workers run the same number of steps
+        Args:
+            index (int): the shard of the worker
+            count (int): number of workers
+        """
+        self.getTargetCount()  # The frequencies of the whole dataset are kept (same for all the workers)
+        shardSize = len(self.trainingSamples) // count
+        self.trainingSamples = self.trainingSamples[index::count][:shardSize]
+        print('Shard {}/{}: {} QA'.format(index + 1, count, len(self.trainingSamples)))
+
+    def getValidationBatches(self):
+        """Return the batches of the validation set (not shuffled, created on the first call)
+        Return:
+            list<Batch>: the validation batches
+        """
+        if self.validationBatches is None:
+            self.validationBatches = [
+                self._createBatch(self.validationSamples[i:i + self.args.batchSize])
+                for i in range(0, len(self.validationSamples), self.args.batchSize)
+            ]
+        return self.validationBatches
+
     def getSampleSize(self):
         """Return the size of the dataset
         Return:
@@ -232,6 +323,45 @@ class TextData:
         """
         return len(self.trainingSamples)
 
+    def getTargetCount(self):
+        """Return the frequency of each word in the answers of the training samples
+        Return:
+            collections.Counter: the number of occurrences of each word id
+        """
+        if self.targetCount is None:
+            self.targetCount = collections.Counter(wordId for sample in self.trainingSamples for wordId in sample[1])
+        return self.targetCount
+
+    def getFrequencyRanking(self):
+        """Return all the word ids, sorted by decreasing frequency in the answers (special tokens first)
+        Used to split the vocabulary in clusters for the adaptive softmax (same ranking at training and inference,
+        the frequencies are saved with the vocabulary)
+        Return:
+            list<int>: the word ids
+        """
+        specialTokens = [self.padToken, self.goToken, self.eosToken, self.unknownToken]
+        targetCount = self.getTargetCount()
+        words = sorted(
+            (wordId for wordId in range(self.getVocabularySize()) if wordId not in specialTokens),
+            key=lambda wordId: (-targetCount[wordId], wordId)
+        )
+        return specialTokens + words
+
+    def getShortlist(self, size, wordIds=()):
+        """Return the candidate words for the decoder output at inference: the most frequent words of the answers,
+        <eos>, <unknown> and the given words (ex: the words of the question)
+        Args:
+            size (int): number of frequent words to keep
+            wordIds (iterable<int>): additional words to include
+        Return:
+            list<int>: the sorted word ids of the shortlist
+        """
+        shortlist = {wordId for wordId, _ in self.getTargetCount().most_common(size)}
+        shortlist |= {self.eosToken, self.unknownToken}
+        shortlist |= set(wordIds)
+        shortlist.discard(self.padToken)
+        return sorted(shortlist)
+
     def getVocabularySize(self):
         """Return the number of words present in the dataset
         Return:
@@ -286,6 +416,7 @@ class TextData:
                 self.args.filterVocab
             ))
             self.filterFromFull()  # Extract the sub vocabulary for the given maxLength and filterVocab
+            self.splitValidation(self.args.validationRatio)
 
             # Saving
             print('Saving dataset...')
@@ -308,7 +439,8 @@ class TextData:
                 'word2id': self.word2id,
                 'id2word': self.id2word,
                 'idCount': self.idCount,
-                'trainingSamples': self.trainingSamples
+                'trainingSamples': self.trainingSamples,
+                'validationSamples': self.validationSamples
             }
             pickle.dump(data, handle, -1)  # Using the highest protocol available
 
@@ -325,11 +457,44 @@ class TextData:
             self.id2word = data['id2word']
             self.idCount = data.get('idCount', None)
             self.trainingSamples = data['trainingSamples']
+            self.validationSamples = data.get('validationSamples', [])
 
-            self.padToken = self.word2id['<pad>']
-            self.goToken = self.word2id['<go>']
-            self.eosToken = self.word2id['<eos>']
-            self.unknownToken = self.word2id['<unknown>']  # Restore special words
+            self._restoreSpecialTokens()
+
+    def saveVocabulary(self, filename):
+        """Save the vocabulary only (small file, enough for inference)
+        Args:
+            filename (str): pickle filename
+        """
+        with open(filename, 'wb') as handle:
+            data = {  # Warning: If adding something here, also modifying loadVocabulary
+                'word2id': self.word2id,
+                'id2word': self.id2word,
+                'targetCount': self.getTargetCount(),
+            }
+            pickle.dump(data, handle, -1)
+
+    def loadVocabulary(self, filename):
+        """Load the vocabulary saved with saveVocabulary
+        Args:
+            filename (str): pickle filename
+        """
+        print('Loading vocabulary from {}'.format(filename))
+        with open(filename, 'rb') as handle:
+            data = pickle.load(handle)  # Warning: If adding something here, also modifying saveVocabulary
+            self.word2id = data['word2id']
+            self.id2word = data['id2word']
+            self.targetCount = data.get('targetCount', None)
+
+            self._restoreSpecialTokens()
+
+    def _restoreSpecialTokens(self):
+        """Restore the ids of the special words from the vocabulary
+        """
+        self.padToken = self.word2id['<pad>']
+        self.goToken = self.word2id['<go>']
+        self.eosToken = self.word2id['<eos>']
+        self.unknownToken = self.word2id['<unknown>']
 
     # 过滤出来满足要求的语料
     def filterFromFull(self):
@@ -635,9 +800,16 @@ class TextData:
 
         # Third step: creating the batch (add padding, reverse)
 
-        batch = self._createBatch([[wordIds, []]])  # Mono batch, no target output 单次批处理，没有目标输出
+        return self.sequence2enco(wordIds)
 
-        return batch
+    def sequence2enco(self, wordIds):
+        """Return a batch as an input for the model from a sequence of word ids (ex: a previous answer)
+        Args:
+            wordIds (list<int>): the sentence, truncated if longer than the encoder
+        Return:
+            Batch: a batch object containing the sentence
+        """
+        return self._createBatch([[wordIds[:self.args.maxLengthEnco], []]])  # Mono batch, no target output 单次批处理，没有目标输出
 
     def deco2sentence(self, decoderOutputs):
         """
@@ -1,6 +1,10 @@
 from django.conf import settings
+from concurrent.futures import ThreadPoolExecutor
+import collections
 import logging
 import sys
+import threading
+import time
 
 from django.apps import AppConfig
 import sys
@@ -22,11 +26,42 @@ import os
 chatbotPath = "/".join(settings.BASE_DIR.split('/')[:-1])
 sys.path.append(chatbotPath)
 from chatbot import chatbot
+from chatbot import frozenmodel
+from chatbot import npmodel
+from chatbot.replicapool import ReplicaPool
+from chatbot.sessionstore import SessionStore
 
 
 logger = logging.getLogger(__name__)
 
+# Response cache of the bot (the greetings are asked again and again)
+CACHE_SIZE = int(os.environ.get('CHATBOT_CACHE_SIZE', 10000))  # 0 to deactivate
+CACHE_TTL = float(os.environ.get('CHATBOT_CACHE_TTL', 0))  # In seconds, 0 for no expiration
+STATS_EVERY = 100  # Log the cache statistics every STATS_EVERY calls
 
+# Inference workers (the channels workers only dispatch the questions)
+NB_WORKERS = int(os.environ.get('CHATBOT_WORKERS', 4))
+MAX_PENDING = int(os.environ.get('CHATBOT_MAX_PENDING', 32))  # Questions running or waiting, the others are refused
+
+# If set, the questions are answered by this number of processes running the NumPy model (exported with --exportNumpy)
+# instead of the in-process TensorFlow session (CHATBOT_WORKERS should be at least the number of replicas)
+NB_REPLICAS = int(os.environ.get('CHATBOT_REPLICAS', 0))
+MODEL_DIR = os.path.join(chatbotPath, 'save', 'model-server')
+
+# If set, the TensorFlow bot serves the graph exported with --exportFrozen (faster startup, less memory)
+FROZEN = bool(int(os.environ.get('CHATBOT_FROZEN', 0)))
+
+# Hot reload: the model directory is checked every RELOAD_INTERVAL seconds, a new checkpoint (or new exported NumPy
+# weights) is loaded in background and replaces the current bot without restarting the server
+RELOAD_INTERVAL = float(os.environ.get('CHATBOT_RELOAD_INTERVAL', 30))  # 0 to deactivate
+RELEASE_TIMEOUT = float(os.environ.get('CHATBOT_RELEASE_TIMEOUT', 300))  # Max seconds waited for the questions of the previous bot
+MODEL_INDEX_FILENAME = 'model.ckpt.index'  # Written by the saver with the checkpoint
+WARMUP_SENTENCE = 'Hello'
+
+# Multi-turn conversations: each question is encoded after the previous turns of the client (TensorFlow bot only)
+CONTEXT_TURNS = int(os.environ.get('CHATBOT_CONTEXT_TURNS', 0))  # Turns kept before the context is reset, 0 to deactivate
+MAX_SESSIONS = int(os.environ.get('CHATBOT_MAX_SESSIONS', 1000))  # The least recently active clients are forgotten
+SESSION_TTL = float(os.environ.get('CHATBOT_SESSION_TTL', 1800))  # Idle seconds before the context expires
 
 
 class ChatbotManager(AppConfig):
@@ -36,6 +71,16 @@ class ChatbotManager(AppConfig):
     verbose_name = 'Chatbot Interface'
 
     bot = None
+    nbCalls = 0
+
+    modelVersion = None  # Modification time of the served model files
+    botCondition = threading.Condition()  # Protect the bot swap
+    inFlight = collections.Counter()  # Number of questions being answered by each bot
+
+    sessions = None  # Conversation contexts of the clients (None if the multi-turn mode is deactivated)
+
+    executor = None  # Run the predictions outside of the channels workers
+    pendingSlots = None  # Bound the number of questions waiting for the executor
 
     def ready(self):
         """ Called by Django only once during startup
@@ -55,30 +100,190 @@ class ChatbotManager(AppConfig):
 
          实例化机器人
         """
+        if not ChatbotManager.executor:
+            ChatbotManager.executor = ThreadPoolExecutor(max_workers=NB_WORKERS)
+            ChatbotManager.pendingSlots = threading.BoundedSemaphore(MAX_PENDING)
+
+        if CONTEXT_TURNS and NB_REPLICAS:
+            logger.warning('Multi-turn conversations are not supported by the replicas, the context is ignored')
+        elif CONTEXT_TURNS and not ChatbotManager.sessions:
+            ChatbotManager.sessions = SessionStore(MAX_SESSIONS, CONTEXT_TURNS, SESSION_TTL)
+
         if not ChatbotManager.bot:
             logger.info('Initializing bot...')
-            ChatbotManager.bot = chatbot.Chatbot()
-            # 指定 模型的启动和加载路径
-            ChatbotManager.bot.main(['--modelTag', 'server', '--test', 'daemon', '--rootDir', chatbotPath])
+            ChatbotManager.modelVersion = ChatbotManager._getModelVersion()
+            ChatbotManager.bot = ChatbotManager._loadBot()
+            if RELOAD_INTERVAL:
+                watcher = threading.Thread(target=ChatbotManager._watchModel, name='model-watcher', daemon=True)
+                watcher.start()
         else:
             logger.info('Bot already initialized.')
 
+    @staticmethod
+    def _loadBot():
+        """ Create a new bot from the files currently in save/model-server
+        Return:
+            Chatbot or ReplicaPool: the loaded bot, ready to answer
+        """
+        if NB_REPLICAS:
+            return ReplicaPool(MODEL_DIR, NB_REPLICAS, cacheSize=CACHE_SIZE, cacheTtl=CACHE_TTL)
+
+        bot = chatbot.Chatbot()
+        # 指定 模型的启动和加载路径
+        bot.main([
+            '--modelTag', 'server',
+            '--test', 'daemon',
+            '--rootDir', chatbotPath,
+            '--cacheSize', str(CACHE_SIZE),
+            '--cacheTtl', str(CACHE_TTL),
+        ] + (['--frozen'] if FROZEN else []))
+        return bot
+
+    @staticmethod
+    def _getModelVersion():
+        """ Return the modification time of the served model (None if the model files are missing)
+        """
+        if NB_REPLICAS:
+            fileName = npmodel.WEIGHTS_FILENAME
+        elif FROZEN:
+            fileName = frozenmodel.FROZEN_GRAPH_FILENAME
+        else:
+            fileName = MODEL_INDEX_FILENAME
+        try:
+            return os.path.getmtime(os.path.join(MODEL_DIR, fileName))
+        except OSError:
+            return None
+
+    @staticmethod
+    def _watchModel():
+        """ Reload the bot each time a new model is copied into save/model-server
+        Run on a background thread. The new bot is loaded and warmed up while the previous one keeps answering, then
+        the traffic is switched at once. The previous bot is closed when its last question has been answered (or
+        after RELEASE_TIMEOUT seconds, so a stuck question does not block the next reloads).
+
+        热更新模型
+        """
+        candidateVersion = None
+        while True:
+            time.sleep(RELOAD_INTERVAL)
+            version = ChatbotManager._getModelVersion()
+            if version is None or version == ChatbotManager.modelVersion:
+                candidateVersion = None
+                continue
+            if version != candidateVersion:  # The files may still be written, wait until they are stable
+                candidateVersion = version
+                continue
+
+            logger.info('New model detected, loading it in background...')
+            try:
+                newBot = ChatbotManager._loadBot()
+                newBot.daemonPredict(WARMUP_SENTENCE)  # The first call is slower (memory allocation,...)
+            except Exception:
+                logger.exception('Error: Could not load the new model, keep the previous one')
+                ChatbotManager.modelVersion = version  # Don't retry until the next model
+                continue
+
+            with ChatbotManager.botCondition:
+                previousBot = ChatbotManager.bot
+                ChatbotManager.bot = newBot
+                ChatbotManager.modelVersion = version
+                released = ChatbotManager.botCondition.wait_for(
+                    lambda: not ChatbotManager.inFlight[previousBot],
+                    timeout=RELEASE_TIMEOUT
+                )
+                if not released:
+                    logger.warning('{} questions still running on the previous model after {}s, closing it anyway'.format(
+                        ChatbotManager.inFlight[previousBot], RELEASE_TIMEOUT))
+                del ChatbotManager.inFlight[previousBot]
+            previousBot.daemonClose()
+            logger.info('Model reloaded.')
+
     # 调用机器人
     @staticmethod
-    def callBot(sentence):
+    def callBot(sentence, clientName=None):
         """ Use the previously instantiated bot to predict a response to the given sentence
 
             使用句子调用机器人
         Args:
             sentence (str): the question to answer
+            clientName (str): if set (and the multi-turn mode activated), the previous turns of this client are used
+                as context
         Return:
             str: the answer
         """
-        if ChatbotManager.bot:
-            return ChatbotManager.bot.daemonPredict(sentence)
+        with ChatbotManager.botCondition:  # The bot can be swapped by the model watcher
+            bot = ChatbotManager.bot
+            modelVersion = ChatbotManager.modelVersion
+            if bot:
+                ChatbotManager.inFlight[bot] += 1
+        if bot:
+            try:
+                if clientName and ChatbotManager.sessions:
+                    context, nbTurns = ChatbotManager.sessions.get(clientName, modelVersion)
+                    answer, context = bot.daemonPredictContext(sentence, context)
+                    ChatbotManager.sessions.put(clientName, context, nbTurns + 1, modelVersion)
+                else:
+                    answer = bot.daemonPredict(sentence)
+            finally:
+                with ChatbotManager.botCondition:
+                    ChatbotManager.inFlight[bot] -= 1
+                    if ChatbotManager.inFlight[bot] < 0:  # The bot has been closed before the end of the question
+                        del ChatbotManager.inFlight[bot]
+                    ChatbotManager.botCondition.notify_all()
+            ChatbotManager.nbCalls += 1
+            if ChatbotManager.nbCalls % STATS_EVERY == 0:
+                logger.info('Cache stats: {}'.format(ChatbotManager.getStats()))
+                if ChatbotManager.sessions:
+                    logger.info('Sessions stats: {}'.format(ChatbotManager.sessions.getStats()))
+            return answer
         else:
             logger.error('Error: Bot not initialized!')
 
+    @staticmethod
+    def callBotAsync(sentence, callback, clientName=None):
+        """ Same as callBot, but the prediction is computed by the executor
+        Args:
+            sentence (str): the question to answer
+            callback (function): called with the future of the answer once the prediction is done (from the
+                executor thread)
+            clientName (str): the client asking the question (see callBot)
+        Return:
+            bool: False if the system is saturated (the question is dropped and the callback won't be called)
+        """
+        if not ChatbotManager.executor:
+            logger.error('Error: Bot not initialized!')
+            return False
+        if not ChatbotManager.pendingSlots.acquire(blocking=False):
+            return False
+
+        def onDone(future):
+            ChatbotManager.pendingSlots.release()
+            callback(future)
+
+        future = ChatbotManager.executor.submit(ChatbotManager.callBot, sentence, clientName)
+        future.add_done_callback(onDone)
+        return True
+
+    @staticmethod
+    def getStats():
+        """ Return the statistics of the bot response cache
+        Return:
+            dict: the cache statistics (None if the bot is not initialized or the cache deactivated)
+        """
+        if ChatbotManager.bot:
+            return ChatbotManager.bot.daemonStats()
+        return None
+
+    @staticmethod
+    def getSessionStats():
+        """ Return the statistics of the conversation contexts
+        Return:
+            dict: the number of clients, evictions and memory used (None if the multi-turn mode is deactivated)
+        """
+        if ChatbotManager.sessions:
+            return ChatbotManager.sessions.getStats()
+        return None
+
 
 # def if __name__ == '__main__':
 
@@ -44,10 +44,22 @@ def ws_receive(message):
     clientName = message.channel_session['room']
     data = json.loads(message['text'])
 
-    # Compute the prediction
+    # Compute the prediction (the answer is sent back by the inference worker)
     question = data['message']
+    if not ChatbotManager.callBotAsync(question, lambda future: _sendAnswer(clientName, question, future), clientName):
+        logger.warning('{}: Busy, question dropped: {}'.format(clientName, question))
+        Group(clientName).send({'text': json.dumps({'message': 'Busy: Too many questions, try again later'})})
+
+
+def _sendAnswer(clientName, question, future):
+    """ Called by the inference worker when the prediction is done
+    Args:
+        clientName (str): the id associated with the client
+        question (str): the question asked by the client
+        future (concurrent.futures.Future): the prediction
+    """
     try:
-        answer = ChatbotManager.callBot(question)
+        answer = future.result()
     except:  # Catching all possible mistakes
         logger.error('{}: Error with this question {}'.format(clientName, question))
         logger.error("Unexpected error:", sys.exc_info()[0])
@@ -59,8 +71,9 @@ def ws_receive(message):
 
     logger.info('{}: {} -> {}'.format(clientName, question, answer))
 
-    # Send the prediction back
-    Group(clientName).send({'text': json.dumps({'message': answer})})
+    # Send the prediction back (immediately, we are outside of the consumer)
+    Group(clientName).send({'text': json.dumps({'message': answer})}, immediately=True)
+
 
 @channel_session
 def ws_disconnect(message):
@@ -71,3 +84,5 @@ def ws_disconnect(message):
     clientName = message.channel_session['room']
     logger.info('Client disconnected: {}'.format(clientName))
     Group(clientName).discard(message.reply_channel)
+    if ChatbotManager.sessions:  # Free the conversation context
+        ChatbotManager.sessions.remove(clientName)
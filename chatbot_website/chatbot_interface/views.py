@@ -1,8 +1,20 @@
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from .chatbotmanager import ChatbotManager
+
+
 def mainView(request):
     """ Main view which launch and handle the chatbot view
     Args:
         request (Obj): django request object
     """
     return render(request, 'index.html', {})
+
+
+def statsView(request):
+    """ Statistics of the chatbot (response cache hit rate, time saved, conversation contexts,...)
+    Args:
+        request (Obj): django request object
+    """
+    return JsonResponse({'cache': ChatbotManager.getStats(), 'sessions': ChatbotManager.getSessionStats()})
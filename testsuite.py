@@ -8,10 +8,26 @@
 """
 
 import unittest
+import configparser
+import copy
 import io
+import os
 import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
 
 from chatbot import chatbot
+from chatbot import decoding
+from chatbot import distributed
+from chatbot import execution
+from chatbot import npmodel
+from chatbot.checkpointmanager import RetentionPolicy, copyCheckpoint
+from chatbot.model import AdaptiveSoftmax, Model
+from chatbot.responsecache import ResponseCache
+from chatbot.sessionstore import SessionStore
+from chatbot.textdata import TextData
 
 
 class TestChatbot(unittest.TestCase):
@@ -24,6 +40,86 @@ class TestChatbot(unittest.TestCase):
             '--numEpoch', '1', 
             '--modelTag', 'unit-test'
         ])
+
+    def test_training_pipeline(self):
+        self.chatbot.main([
+            '--maxLength', '3',
+            '--numEpoch', '1',
+            '--modelTag', 'unit-test',
+            '--inputPipeline',
+            '--autoEncode',
+            '--reset'
+        ])
+
+    def test_training_validation(self):
+        self.chatbot.main([
+            '--maxLength', '3',
+            '--numEpoch', '2',
+            '--modelTag', 'unit-test',
+            '--validationRatio', '0.1',
+            '--validateEvery', '1',
+            '--patience', '1',
+            '--keepAll',
+            '--reset'
+        ])
+        self.assertTrue(os.path.exists(self.chatbot._getBestModelName() + '.index'))  # Not pruned with the history
+
+    def test_training_resume(self):
+        self.chatbot.main([
+            '--maxLength', '3',
+            '--numEpoch', '1',
+            '--modelTag', 'unit-test',
+            '--reset'
+        ])
+        self.assertEqual((self.chatbot.epoch, self.chatbot.sampleCursor), (1, 0))
+
+        # --numEpochs is the total: the resumed model only runs the remaining epochs
+        for numEpochs in ['2', '2']:
+            tf.reset_default_graph()
+            self.chatbot = chatbot.Chatbot()
+            self.chatbot.main(['--maxLength', '3', '--numEpoch', numEpochs, '--modelTag', 'unit-test'])
+            self.assertEqual((self.chatbot.epoch, self.chatbot.sampleCursor), (2, 0))
+
+        textData = self.chatbot.textData
+        batchSize = textData.args.batchSize
+        batches = textData.getBatches(seed=1)
+        resumedBatches = textData.getBatches(seed=1, cursor=2 * batchSize)  # Interrupted after 2 steps
+        self.assertEqual(len(resumedBatches), len(batches) - 2)
+        for batch, resumedBatch in zip(batches[2:], resumedBatches):
+            self.assertEqual(batch.encoderSeqs, resumedBatch.encoderSeqs)
+            self.assertEqual(batch.targetSeqs, resumedBatch.targetSeqs)
+
+    def test_training_adaptive_softmax(self):
+        self.chatbot.main([
+            '--maxLength', '3',
+            '--numEpoch', '1',
+            '--modelTag', 'unit-test-adaptive',
+            '--adaptiveSoftmax', '10', '50',
+            '--reset'
+        ])
+
+        tf.reset_default_graph()
+        self.chatbot = chatbot.Chatbot()
+        self.chatbot.main(['--test', 'daemon', '--modelTag', 'unit-test-adaptive'])
+        self.assertEqual(self.chatbot.args.adaptiveSoftmax, [10, 50])  # Restored from the params.ini
+        for question in ['Hi!', 'How are you ?', 'aersdsd azej qsdfs', '']:
+            self.assertIsInstance(self.chatbot.daemonPredict(question), str)
+        self.chatbot.daemonClose()
+
+        tf.reset_default_graph()
+        with self.assertRaises(ValueError):  # Not supported by the NumPy inference
+            chatbot.Chatbot().main(['--exportNumpy', '--modelTag', 'unit-test-adaptive'])
+
+    def test_training_async_save(self):
+        self.chatbot.main([
+            '--maxLength', '3',
+            '--numEpoch', '1',
+            '--modelTag', 'unit-test',
+            '--saveEvery', '1',
+            '--asyncSave',
+            '--reset'
+        ])
+
     # 测试多伦对话
     def test_training_watson(self):
         pass
@@ -50,5 +146,389 @@ class TestChatbot(unittest.TestCase):
     def test_testing_daemon(self):
         pass
 
+    def test_testing_context(self):
+        self.chatbot.main(['--maxLength', '3', '--numEpoch', '1', '--modelTag', 'unit-test'])
+        tf.reset_default_graph()
+        self.chatbot = chatbot.Chatbot()
+        self.chatbot.main(['--test', 'daemon', '--modelTag', 'unit-test'])
+
+        _, context = self.chatbot.daemonPredictContext('Hi!')
+        _, otherContext = self.chatbot.daemonPredictContext('How are you ?')
+        batch = self.chatbot.textData.sentence2enco('Hi!')
+        states = [
+            tf.contrib.framework.nest.flatten(self.chatbot._encode(batch, initialState))
+            for initialState in [None, context, otherContext]
+        ]
+        # The question is encoded differently after each previous turn
+        self.assertFalse(all(np.allclose(a, b) for a, b in zip(states[0], states[1])))
+        self.assertFalse(all(np.allclose(a, b) for a, b in zip(states[1], states[2])))
+
+        # The padding is not run after a context: an empty turn keeps the context unchanged
+        emptyState = self.chatbot._encode(self.chatbot.textData.sequence2enco([]), context)
+        for a, b in zip(tf.contrib.framework.nest.flatten(emptyState), tf.contrib.framework.nest.flatten(context)):
+            np.testing.assert_allclose(a, b)
+        self.chatbot.daemonClose()
+
+    def test_numpy_parity(self):
+        self.chatbot.main(['--maxLength', '3', '--numEpoch', '1', '--modelTag', 'unit-test'])
+        self.chatbot.main(['--exportNumpy', '--modelTag', 'unit-test'])
+
+        tf.reset_default_graph()
+        self.chatbot = chatbot.Chatbot()
+        self.chatbot.main(['--test', 'daemon', '--modelTag', 'unit-test'])
+        npChatbot = npmodel.NumpyChatbot(self.chatbot.modelDir)
+        for question in ['Hi!', 'How are you ?', 'aersdsd azej qsdfs', '']:
+            self.assertEqual(npChatbot.daemonPredict(question), self.chatbot.daemonPredict(question))
+        self.chatbot.daemonClose()
+
+    def _checkNumpyParity(self, modelTag, networkArgs):
+        self.chatbot.main(['--maxLength', '3', '--numEpoch', '1', '--modelTag', modelTag, '--reset'] + networkArgs)
+        self.chatbot.main(['--exportNumpy', '--modelTag', modelTag])
+
+        tf.reset_default_graph()
+        self.chatbot = chatbot.Chatbot()
+        self.chatbot.main(['--test', 'daemon', '--modelTag', modelTag])
+        npChatbot = npmodel.NumpyChatbot(self.chatbot.modelDir)
+        for question in ['Hi!', 'How are you ?', 'aersdsd azej qsdfs', '']:
+            self.assertEqual(npChatbot.daemonPredict(question), self.chatbot.daemonPredict(question))
+        self.chatbot.daemonClose()
+
+    def test_numpy_parity_projection(self):
+        self._checkNumpyParity('unit-test-proj', ['--hiddenSize', '16', '--numProj', '8'])
+
+    def test_numpy_parity_cells(self):
+        for cellType in ['block', 'gru']:
+            tf.reset_default_graph()
+            self.chatbot = chatbot.Chatbot()
+            self._checkNumpyParity('unit-test-' + cellType, ['--cellType', cellType])
+
+    def test_frozen_parity(self):
+        self.chatbot.main(['--maxLength', '3', '--numEpoch', '1', '--modelTag', 'unit-test'])
+        chatbot.Chatbot().main(['--exportFrozen', '--modelTag', 'unit-test'])
+
+        self.chatbot = chatbot.Chatbot()
+        self.chatbot.main(['--test', 'daemon', '--modelTag', 'unit-test'])
+        frozenChatbot = chatbot.Chatbot()
+        frozenChatbot.main(['--test', 'daemon', '--frozen', '--modelTag', 'unit-test'])
+        for beamSize in [1, 3]:
+            self.chatbot.args.beamSize = frozenChatbot.args.beamSize = beamSize
+            for question in ['Hi!', 'How are you ?', 'aersdsd azej qsdfs', '']:
+                self.assertEqual(frozenChatbot.daemonPredict(question), self.chatbot.daemonPredict(question))
+        frozenChatbot.daemonClose()
+        self.chatbot.daemonClose()
+
+
+class TestDecoding(unittest.TestCase):
+    def setUp(self):
+        # Fake decoder: the next word only depends on the previous one
+        self.transitions = np.log(np.array([
+            [0.1, 0.1, 0.1, 0.4, 0.3],  # <go>: 'a' (0.4) or 'b' (0.3)
+            [1.0, 0.0, 0.0, 0.0, 0.0],
+            [0.2, 0.2, 0.2, 0.2, 0.2],  # <eos>
+            [0.0, 0.0, 0.4, 0.3, 0.3],  # 'a' is followed by an uncertain word
+            [0.0, 0.0, 0.9, 0.1, 0.0],  # 'b' is almost always followed by <eos>
+        ]) + 1e-12)
+
+    def stepFct(self, inputs, state, topK):
+        logProbs = self.transitions[inputs]
+        ids = np.argsort(-logProbs, axis=1)[:, :topK]
+        return np.take_along_axis(logProbs, ids, axis=1), ids, decoding.mapState(lambda s: s + 1, state)
+
+    def test_beam_search(self):
+        state = (np.zeros((1, 4)),)
+        self.assertEqual(decoding.beamSearch(self.stepFct, state, 0, 2, 10, beamSize=1), [3])  # Greedy: <go> a <eos>
+        self.assertEqual(decoding.beamSearch(self.stepFct, state, 0, 2, 10, beamSize=3), [4])  # <go> b <eos> is more probable
+
+    def test_greedy_search(self):
+        state = (np.zeros((2, 4)),)
+        self.assertEqual(decoding.greedySearch(self.stepFct, state, 0, 2, 10), [[3], [3]])
+
+
+class TestQuantization(unittest.TestCase):
+    def setUp(self):
+        # Random single layer model, with more words than a projection block
+        rng = np.random.RandomState(0)
+        vocabularySize, embeddingSize, hiddenSize = npmodel.PROJECTION_BLOCK_SIZE + 100, 8, 16
+        self.weights = {'projection/W': rng.randn(hiddenSize, vocabularySize).astype(np.float32)}
+        self.weights['projection/b'] = rng.randn(vocabularySize).astype(np.float32)
+        for part in ['encoder', 'decoder']:
+            self.weights[part + '/embedding'] = rng.randn(vocabularySize, embeddingSize).astype(np.float32)
+            self.weights[part + '/cell_0/kernel'] = rng.randn(embeddingSize + hiddenSize, 4 * hiddenSize).astype(np.float32) * 0.3
+            self.weights[part + '/cell_0/bias'] = np.zeros(4 * hiddenSize, np.float32)
+        self.encoderSeqs = [[1, 5], [7, 9], [3, 4]]
+
+    def test_round_trip(self):
+        for quantization, tolerance in [('none', 0), ('float16', 1e-2), ('int8', 0.5 / 127)]:
+            weights = npmodel.dequantizeWeights(npmodel.quantizeWeights(self.weights, quantization))
+            self.assertEqual(set(weights), set(self.weights))
+            for name, value in self.weights.items():
+                self.assertEqual(weights[name].dtype, np.float32)
+                maxValue = np.abs(value).max()
+                np.testing.assert_allclose(weights[name], value, atol=tolerance * maxValue)
+
+    def test_parity(self):
+        for quantization in ['float16', 'int8']:
+            quantizedWeights = npmodel.quantizeWeights(self.weights, quantization)
+            quantizedModel = npmodel.NumpyModel(quantizedWeights, 1)  # Projection converted by blocks
+            loadedModel = npmodel.NumpyModel(npmodel.dequantizeWeights(quantizedWeights), 1)
+            inputs = np.array([2, 6])
+            quantizedLogProbs, quantizedIds, _ = quantizedModel.step(inputs, quantizedModel.encode(self.encoderSeqs), 5)
+            logProbs, ids, _ = loadedModel.step(inputs, loadedModel.encode(self.encoderSeqs), 5)
+            np.testing.assert_allclose(quantizedLogProbs, logProbs, rtol=1e-4, atol=1e-4)
+            np.testing.assert_array_equal(quantizedIds, ids)
+
+
+class TestExtractedWeights(unittest.TestCase):
+    def test_new_version(self):
+        with tempfile.TemporaryDirectory() as modelDir:
+            weightsName = os.path.join(modelDir, npmodel.WEIGHTS_FILENAME)
+            np.savez(weightsName, **{'projection/b': np.arange(5, dtype=np.float32)})
+            weights = npmodel.loadWeights(modelDir, mmap=True)
+            previousDir = npmodel.extractWeights(modelDir)
+
+            # A new export is extracted into another directory, the mapped files of the previous one are unchanged
+            np.savez(weightsName, **{'projection/b': np.ones(5, dtype=np.float32)})
+            os.utime(weightsName, ns=(0, os.stat(weightsName).st_mtime_ns + 1))
+            mmapDir = npmodel.extractWeights(modelDir)
+            self.assertNotEqual(mmapDir, previousDir)
+            np.testing.assert_array_equal(weights['projection/b'], np.arange(5))
+            np.testing.assert_array_equal(npmodel.loadWeights(modelDir, mmap=True)['projection/b'], np.ones(5))
+
+            npmodel.removeExtractedWeights(mmapDir)  # Current version: kept
+            npmodel.removeExtractedWeights(previousDir)
+            self.assertEqual(sorted(os.listdir(modelDir)), sorted([npmodel.WEIGHTS_FILENAME, os.path.basename(mmapDir)]))
+            del weights
+
+
+class TestAccumulation(unittest.TestCase):
+    def setUp(self):
+        self.chatbot = chatbot.Chatbot()
+        self.chatbot.args = self.chatbot.parseArgs(['--maxLength', '3', '--dropout', '1.0', '--batchSize', '4', '--reset'])
+        self.chatbot.args.rootDir = os.getcwd()
+        self.chatbot.loadModelParams()
+        self.textData = TextData(self.chatbot.args)
+        self.samples = self.textData.trainingSamples[:12]
+
+    def _trainUpdate(self, accumulateSteps, batchSize, initValues=None):
+        """ Apply a single update from the given mini-batches (accumulated if more than one)
+        Return:
+            dict, dict: the values of the variables before and after the update
+        """
+        args = copy.copy(self.chatbot.args)
+        args.accumulateSteps = accumulateSteps
+        batches = [
+            self.textData._createBatch(self.samples[i:i+batchSize])
+            for i in range(0, len(self.samples), batchSize)
+        ]
+        with tf.Graph().as_default():
+            model = Model(args, self.textData)
+            variables = tf.trainable_variables()
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                if model.accumulatorsInit is not None:
+                    sess.run(model.accumulatorsInit)
+                if initValues:  # Same initialization for all the configurations
+                    for var in variables:
+                        var.load(initValues[var.op.name], sess)
+                before = dict(zip([var.op.name for var in variables], sess.run(variables)))
+                for step, batch in enumerate(batches):
+                    ops, feedDict = model.step(batch)
+                    if step < len(batches) - 1:  # The update is applied by the last mini-batch
+                        ops = (model.accumulateOp,) + ops[1:]
+                    sess.run(ops, feedDict)
+                after = dict(zip([var.op.name for var in variables], sess.run(variables)))
+        return before, after
+
+    def _assertSameVariables(self, values, otherValues):
+        self.assertEqual(set(values), set(otherValues))
+        for name, value in values.items():
+            np.testing.assert_allclose(otherValues[name], value, rtol=1e-4, atol=1e-6)
+
+    def test_same_update(self):
+        # 3 mini-batches of 4 samples give the same update as a single batch of 12 samples
+        initValues, expected = self._trainUpdate(1, 12)
+        _, values = self._trainUpdate(3, 4, initValues)
+        self._assertSameVariables(expected, values)
+
+    def test_partial_cycle(self):
+        # After a restart in the middle of a cycle, the update is the mean of the mini-batches really accumulated
+        self.samples = self.samples[:8]
+        initValues, expected = self._trainUpdate(1, 8)
+        _, values = self._trainUpdate(3, 4, initValues)
+        self._assertSameVariables(expected, values)
+
+
+class TestDistributed(unittest.TestCase):
+    def test_cluster_spec(self):
+        cluster = distributed.makeClusterSpec(3, 2)
+        self.assertEqual(len(cluster['worker']), 3)
+        self.assertEqual(len(cluster['ps']), 2)
+        addresses = cluster['worker'] + cluster['ps']
+        self.assertEqual(len(set(addresses)), 5)  # One port for each task
+        for address in addresses:
+            host, port = address.split(':')
+            self.assertEqual(host, 'localhost')
+            self.assertGreater(int(port), 0)
+
+    def test_shard(self):
+        bot = chatbot.Chatbot()
+        bot.args = bot.parseArgs(['--maxLength', '3', '--modelTag', 'unit-test-shard'])
+        bot.args.rootDir = os.getcwd()
+        bot.loadModelParams()
+        textData = TextData(bot.args)
+        samples = list(textData.trainingSamples)
+
+        nbWorkers = 3
+        shards = []
+        for index in range(nbWorkers):
+            shard = copy.copy(textData)
+            shard.trainingSamples = list(samples)
+            shard.shard(index, nbWorkers)
+            shards.append(shard.trainingSamples)
+
+        self.assertEqual({len(shard) for shard in shards}, {len(samples) // nbWorkers})  # Same number of steps
+        ids = [id(sample) for shard in shards for sample in shard]
+        self.assertEqual(len(ids), len(set(ids)))  # Disjoint
+        self.assertTrue(set(ids) <= {id(sample) for sample in samples})
+
+
+class TestAdaptiveSoftmax(unittest.TestCase):
+    def setUp(self):
+        # Tiny vocabulary: a head of 3 words and 2 clusters (2 and 3 words)
+        self.wordsByFrequency = [3, 0, 5, 1, 4, 2, 6, 7]
+        rng = np.random.RandomState(0)
+        self.inputs = rng.randn(len(self.wordsByFrequency), 16).astype(np.float32)
+        self.labels = rng.permutation(len(self.wordsByFrequency)).astype(np.int32)  # Head and tail targets
+
+        with tf.Graph().as_default():
+            tf.set_random_seed(0)
+            softmax = AdaptiveSoftmax(16, self.wordsByFrequency, [3, 5], 'adaptive_softmax')
+            inputs = tf.constant(self.inputs)
+            with tf.Session() as sess:
+                sess.run(tf.global_variables_initializer())
+                self.logProbs, self.losses = sess.run([
+                    softmax.logProbs(inputs),
+                    softmax.loss(tf.constant(self.labels), inputs)
+                ])
+
+    def test_normalized(self):
+        self.assertEqual(self.logProbs.shape, (len(self.wordsByFrequency), len(self.wordsByFrequency)))
+        np.testing.assert_allclose(np.exp(self.logProbs).sum(axis=1), 1.0, rtol=1e-5)
+
+    def test_loss(self):
+        expected = -self.logProbs[np.arange(len(self.labels)), self.labels]
+        np.testing.assert_allclose(self.losses, expected, rtol=1e-5, atol=1e-6)
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_lru(self):
+        cache = ResponseCache(2)
+        self.assertEqual(cache.get('hi', lambda: 'Hello'), 'Hello')
+        self.assertEqual(cache.get('hi', lambda: 'Not cached'), 'Hello')
+        cache.get('how are you', lambda: 'Fine')
+        cache.get('bye', lambda: 'Bye')  # Evict the least recently used ('hi')
+        self.assertEqual(cache.get('hi', lambda: 'Recomputed'), 'Recomputed')
+        stats = cache.getStats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 4, 2))
+
+    def test_clear(self):
+        cache = ResponseCache(10)
+        cache.get('hi', lambda: 'Hello')
+        cache.clear()
+        self.assertEqual(cache.get('hi', lambda: 'New model'), 'New model')
+
+
+class TestSessionStore(unittest.TestCase):
+    def test_context(self):
+        store = SessionStore(2, maxTurns=2)
+        state = (np.zeros((1, 4), dtype=np.float32),)
+        self.assertEqual(store.get('client1'), (None, 0))
+        store.put('client1', state, 1)
+        self.assertEqual(store.get('client1'), (state, 1))
+        self.assertEqual(store.get('client1', modelVersion='new'), (None, 0))  # Context of a previous model
+        store.put('client1', state, 2)
+        self.assertEqual(store.get('client1'), (None, 0))  # Too many turns
+
+    def test_lru(self):
+        store = SessionStore(2)
+        state = (np.zeros((1, 4), dtype=np.float32),)
+        for client in ['client1', 'client2', 'client3']:
+            store.put(client, state, 1)
+        self.assertEqual(store.get('client1'), (None, 0))
+        stats = store.getStats()
+        self.assertEqual((stats['sessions'], stats['evictions'], stats['memory']), (2, 1, 32))
+
+
+class TestRetentionPolicy(unittest.TestCase):
+    def test_budget(self):
+        with tempfile.TemporaryDirectory() as modelDir:
+            policy = RetentionPolicy(modelDir, '.ckpt', maxCount=4)
+            for step in range(100, 2100, 100):
+                modelName = os.path.join(modelDir, 'model-{}.ckpt'.format(step))
+                for suffix in ['', '.index', '.data-00000-of-00001']:
+                    open(modelName + suffix, 'w').close()
+                policy.apply(modelName, step, loss=1.0 if step != 500 else 0.5)
+
+            steps = sorted(record['step'] for record in policy.records.values())
+            self.assertEqual(len(steps), 4)
+            self.assertIn(500, steps)  # Best loss
+            self.assertEqual(steps[-2:], [1900, 2000])  # Dense for the recent checkpoints
+            self.assertEqual(len(os.listdir(modelDir)), 4 * 3 + 1)  # Files of the checkpoints kept + records
+
+    def test_best_copy(self):
+        with tempfile.TemporaryDirectory() as modelDir:
+            modelName = os.path.join(modelDir, 'model.ckpt')
+            bestName = os.path.join(modelDir, 'model-best.ckpt')
+            for suffix in ['', '.index', '.data-00000-of-00001']:
+                with open(modelName + suffix, 'w') as f:
+                    f.write('best' + suffix)
+            copyCheckpoint(modelName, bestName)
+            with open(modelName + '.index', 'w') as f:  # Overwritten by the next checkpoint
+                f.write('next')
+
+            policy = RetentionPolicy(modelDir, '.ckpt')
+            self.assertEqual(policy.records, {})  # The best copy is never pruned
+            for suffix in ['', '.index', '.data-00000-of-00001']:
+                with open(bestName + suffix, 'r') as f:
+                    self.assertEqual(f.read(), 'best' + suffix)
+            self.assertEqual(len(os.listdir(modelDir)), 6)
+
+
+class TestExecution(unittest.TestCase):
+    def test_cpu_list(self):
+        self.assertEqual(execution.parseCpuList('0-3,8'), [0, 1, 2, 3, 8])
+        self.assertEqual(execution.parseCpuList('5'), [5])
+
+    def test_tuned_threads(self):
+        with tempfile.TemporaryDirectory() as modelDir:
+            configName = os.path.join(modelDir, 'params.ini')
+            execution.saveTunedThreads(configName, (8, 2), (1, 1))
+            execution.saveTunedThreads(configName, (4, 2), (2, 1))  # Overwrite the previous values
+            config = configparser.ConfigParser()
+            config.read(configName)
+            section = config[execution.EXECUTION_SECTION]
+            self.assertEqual(section.getint('intraOpThreads'), 4)
+            self.assertEqual(section.getint('inferenceIntraOpThreads'), 2)
+
+    def test_command_line_not_saved(self):
+        with tempfile.TemporaryDirectory() as rootDir:
+            bot = chatbot.Chatbot()
+            bot.args = bot.parseArgs(['--rootDir', rootDir, '--modelTag', 'unit-test'])
+            bot.loadModelParams()
+            os.makedirs(bot.modelDir)
+            bot.saveModelParams()
+            configName = os.path.join(bot.modelDir, bot.CONFIG_FILENAME)
+            execution.saveTunedThreads(configName, (8, 2), (1, 1))
+
+            bot = chatbot.Chatbot()
+            bot.args = bot.parseArgs(['--rootDir', rootDir, '--modelTag', 'unit-test', '--intraOpThreads', '3'])
+            bot.loadModelParams()
+            self.assertEqual((bot.args.intraOpThreads, bot.args.interOpThreads), (3, 2))  # The command line wins
+            bot.saveModelParams()  # Ex: a checkpoint
+            config = configparser.ConfigParser()
+            config.read(configName)
+            self.assertEqual(config[execution.EXECUTION_SECTION].getint('intraOpThreads'), 8)  # The tuned value is kept
+
+
 if __name__ == '__main__':
     unittest.main()